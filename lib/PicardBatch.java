@@ -0,0 +1,212 @@
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.MalformedURLException;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.nio.file.Files;
+import java.nio.file.Paths;
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.List;
+import java.util.Map;
+import java.util.Set;
+import java.util.TreeMap;
+import java.util.concurrent.CompletionService;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.ExecutorCompletionService;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.concurrent.atomic.AtomicLong;
+
+/**
+ * Runs multiple Picard tools inside of one JVM, so the JVM only has to start and warm up once.
+ * Every line on stdin is a step: stage, log file, tool and its arguments, separated by tabs.
+ * Stages run one after the other, the steps of a stage run at the same time so they can be
+ * connected with named pipes. For every step a line is printed with the tool, exit code,
+ * wall-clock seconds and the peak resident memory (kB) of the JVM while the step ran.
+ * The resident memory is sampled, the high-water mark of the kernel (VmHWM) covers the whole
+ * life of the JVM so it would include the memory of all the steps before.
+ *
+ * Every step loads Picard with its own class loader, because Picard keeps settings like the
+ * default compression level and index creation in static fields that are shared by all the
+ * tools of a class loader. When a step fails the JVM exits straight away, the other steps
+ * of the stage could otherwise wait forever for a named pipe the failed step never opens.
+ *
+ * Compile it with: javac -cp lib/Picard_2.23.9/picard.jar -d lib/classes lib/PicardBatch.java
+ * Run it with: java -cp lib/Picard_2.23.9/picard.jar:lib/classes PicardBatch
+ */
+public class PicardBatch {
+    /** The log file every thread writes its output to, so every step gets its own log file */
+    private static final ThreadLocal<PrintStream> STEP_LOG = new ThreadLocal<>();
+    /** The class path the class loader of every step loads Picard from */
+    private static final URL[] CLASS_PATH = readClassPath();
+    /** The peak resident memory (kB) of every running step, updated by the memory sampler */
+    private static final Set<AtomicLong> RUNNING_PEAKS = ConcurrentHashMap.newKeySet();
+    /** Milliseconds between two samples of the resident memory */
+    private static final long SAMPLE_INTERVAL = 100;
+
+    public static void main(final String[] args) throws Exception {
+        final PrintStream defaultErr = System.err;
+        // Set before any step loads htsjdk, its Log class writes to System.err
+        System.setErr(new PrintStream(new StepLogStream(defaultErr), true));
+        final Thread sampler = new Thread(PicardBatch::sampleMemory, "memory-sampler");
+        sampler.setDaemon(true);
+        sampler.start();
+
+        final Map<Integer, List<String[]>> stages = new TreeMap<>();
+        final BufferedReader reader = new BufferedReader(new InputStreamReader(System.in));
+        String line;
+        while ((line = reader.readLine()) != null) {
+            if (!line.isEmpty()) {
+                final String[] fields = line.split("\t");
+                stages.computeIfAbsent(Integer.parseInt(fields[0]), k -> new ArrayList<>())
+                        .add(fields);
+            }
+        }
+
+        for (final List<String[]> steps : stages.values()) {
+            final ExecutorService executor = Executors.newFixedThreadPool(steps.size());
+            final CompletionService<Integer> results = new ExecutorCompletionService<>(executor);
+            for (final String[] step : steps) {
+                results.submit(() -> runStep(step));
+            }
+            for (int finished = 0; finished < steps.size(); finished++) {
+                final int exitCode = results.take().get();
+                if (exitCode != 0) {
+                    // The other steps of the stage may be blocked on the named pipes of this step
+                    System.exit(exitCode);
+                }
+            }
+            executor.shutdown();
+        }
+        System.exit(0);
+    }
+
+    /** Runs a single Picard tool with its output written to the log file of the step */
+    private static int runStep(final String[] step) throws IOException {
+        final String[] toolArgs = Arrays.copyOfRange(step, 2, step.length);
+        int exitCode;
+        final long start = System.nanoTime();
+        final AtomicLong peakMemory = new AtomicLong(residentMemory());
+        RUNNING_PEAKS.add(peakMemory);
+        try (PrintStream log = new PrintStream(new FileOutputStream(step[1]), true);
+             URLClassLoader loader = new URLClassLoader(CLASS_PATH,
+                                                        ClassLoader.getPlatformClassLoader())) {
+            STEP_LOG.set(log);
+            Thread.currentThread().setContextClassLoader(loader);
+            try {
+                exitCode = runTool(loader, toolArgs);
+            } catch (final InvocationTargetException exception) {
+                exception.getCause().printStackTrace(log);
+                exitCode = 1;
+            } catch (final Exception exception) {
+                exception.printStackTrace(log);
+                exitCode = 1;
+            } finally {
+                STEP_LOG.remove();
+                RUNNING_PEAKS.remove(peakMemory);
+            }
+        }
+        final double seconds = (System.nanoTime() - start) / 1e9;
+        peakMemory.accumulateAndGet(residentMemory(), Math::max);
+        synchronized (System.out) {
+            System.out.printf("%s\t%d\t%.3f\t%d%n", step[2], exitCode, seconds,
+                              peakMemory.get());
+            System.out.flush();
+        }
+        return exitCode;
+    }
+
+    /** Runs a Picard tool from the given class loader and returns its exit code */
+    private static int runTool(final ClassLoader loader, final String[] toolArgs)
+            throws ReflectiveOperationException {
+        final Class<?> commandLine = Class.forName("picard.cmdline.PicardCommandLine", true,
+                                                   loader);
+        final Method packageList = commandLine.getDeclaredMethod("getPackageList");
+        final Method instanceMain = commandLine.getDeclaredMethod(
+                "instanceMain", String[].class, List.class, String.class);
+        packageList.setAccessible(true);
+        instanceMain.setAccessible(true);
+        return (Integer) instanceMain.invoke(commandLine.getDeclaredConstructor().newInstance(),
+                                             toolArgs, packageList.invoke(null), "PicardBatch");
+    }
+
+    /** Reads the class path of the JVM, so every step can load Picard from it again */
+    private static URL[] readClassPath() {
+        final String[] entries = System.getProperty("java.class.path").split(File.pathSeparator);
+        final URL[] urls = new URL[entries.length];
+        for (int index = 0; index < entries.length; index++) {
+            try {
+                urls[index] = Paths.get(entries[index]).toUri().toURL();
+            } catch (final MalformedURLException exception) {
+                throw new IllegalStateException(exception);
+            }
+        }
+        return urls;
+    }
+
+    /** Samples the resident memory and updates the peak of every running step, until exit */
+    private static void sampleMemory() {
+        while (true) {
+            final long memory = residentMemory();
+            for (final AtomicLong peakMemory : RUNNING_PEAKS) {
+                peakMemory.accumulateAndGet(memory, Math::max);
+            }
+            try {
+                Thread.sleep(SAMPLE_INTERVAL);
+            } catch (final InterruptedException exception) {
+                return;
+            }
+        }
+    }
+
+    /** Reads the current resident memory (VmRSS) of the JVM in kB, -1 when it is not available */
+    private static long residentMemory() {
+        try {
+            for (final String line : Files.readAllLines(Paths.get("/proc/self/status"))) {
+                if (line.startsWith("VmRSS:")) {
+                    return Long.parseLong(line.replaceAll("[^0-9]", ""));
+                }
+            }
+        } catch (final IOException | NumberFormatException exception) {
+            return -1;
+        }
+        return -1;
+    }
+
+    /** Output stream that writes to the log file of the step the current thread is running */
+    private static class StepLogStream extends OutputStream {
+        private final PrintStream fallback;
+
+        StepLogStream(final PrintStream fallback) {
+            this.fallback = fallback;
+        }
+
+        private PrintStream current() {
+            final PrintStream log = STEP_LOG.get();
+            return log != null ? log : fallback;
+        }
+
+        @Override
+        public void write(final int b) {
+            current().write(b);
+        }
+
+        @Override
+        public void write(final byte[] b, final int off, final int len) {
+            current().write(b, off, len);
+        }
+
+        @Override
+        public void flush() {
+            current().flush();
+        }
+    }
+}
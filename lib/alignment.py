@@ -8,16 +8,41 @@ Performs the alignment via the Hisat2 tool and converts output to a bam file usi
 __author__ = "Vincent Talen and Joost Numan"
 __status__ = "Development"
 __date__ = "29-01-2020"
-__version__ = "v0.8"
+__version__ = "v1.10"
 
 
 # IMPORTS
+import os
+import re
 import glob
 import gzip
+from math import floor
+from collections import Counter
+from threading import Thread, Event
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 from sys import exit as sys_exit
 from pathlib import Path
-from subprocess import run
+from subprocess import run, Popen, PIPE, DEVNULL
 import lib.general_functions as gen_func
+from lib.genome_registry import get_genome
+from lib.pairing import FilePairer
+
+# Gigabytes a hisat2 process (and its samtools view) needs next to the index itself
+ALIGNER_MEMORY = 1.5
+# Maximum amount of samples that are aligned together in one batch
+MAX_BATCH_SAMPLES = 48
+# Minimum amount of gigabytes (compressed) of a chunk of a large sample and the threads it gets,
+# hisat2 does not scale well beyond a few threads so large samples are aligned in chunks instead
+MIN_CHUNK_SIZE = 0.5
+CHUNK_THREADS = 4
+# Divides the reads over the chunks in turns, the mates (if any) are read from 'mates' in lockstep
+AWK_SPLIT_PROGRAM = '{ chunk = int((NR - 1) / 4) % chunks; print > (prefix chunk ".fq") } ' \
+                    'mates { getline mate < mates; print mate > (mate_prefix chunk ".fq") }'
+NH_TAG_PATTERN = re.compile(rb"\tNH:i:(\d+)")
+ALIGNED_TIMES = ["aligned 0 times", "aligned exactly 1 time", "aligned >1 times"]
+SUMMARY_TIMES = ["0 times", "exactly 1 time", ">1 times"]
+SUMMARY_LINE_PATTERN = re.compile(r"\s*(\d+) (?:\([\d.]+%\) )?(.*)$")
+SUMMARY_TIMES_PATTERN = re.compile(r"aligned (?:concordantly )?(0 times|exactly 1 time|>1 times)$")
 
 
 class Alignment:
@@ -26,89 +51,118 @@ class Alignment:
     The trimmed reads are obtained from the trimmed folder in the given output directory.
     A log from the alignment is written to the tool_logs folder and the .bam file is created
     """
-    def __init__(self, paired, output_dir):
+    def __init__(self, paired, output_dir, genome, shared_index=False):
         """
         Constructor that assigns the parameters to the instance variables
 
         :param output_dir: The path of the output directory
         :param paired: Determines if the data is single or paired
+        :param genome: The Genome from the genome registry the reads need to be aligned to
+        :param shared_index: Memory-map the index so all concurrent aligners share one copy
         """
         self.paired = paired
         self.output_dir = output_dir
+        self.shared_index = shared_index
 
         self.threads = 1
-        self.hisat_index = f"{output_dir}/Data/genome/grch38/genome"
+        self.hisat_index = f"{output_dir}/Data/genome/{genome.index_prefix}"
 
-    def perform_alignment(self, cores):
+    def perform_alignment(self, cores, memory):
         """
         Perform the alignment, it will check if the user wanted paired end and will run accordingly.
-        It runs multiple processes simultaneously (multiprocessing).
+        It runs multiple processes simultaneously (multiprocessing),
+        as many as fit in the memory with a copy of the index (or a shared one) per process.
 
         :param cores: The amount of cores the alignment needs to use
+        :param memory: The amount of gigabytes of memory the alignment may use
         """
         file_dict = self.check_files()
-        self.threads = gen_func.calculate_threads(cores, len(file_dict.keys()))
+        processes = min(cores, len(file_dict.keys()), self.calculate_max_aligners(memory))
+        self.threads = gen_func.calculate_threads(cores, processes)
 
         if self.paired:
             pairs, single_ended = self.create_pairs(file_dict)
-            gen_func.process_files(cores, self.align_pair, pairs)
+            gen_func.process_files(processes, self.align_pair, pairs)
             if single_ended:  # There might be left-over files that were not in pairs
-                gen_func.process_files(cores, self.align_single, single_ended)
+                gen_func.process_files(processes, self.align_single, single_ended)
         else:
             files = file_dict.keys()
-            gen_func.process_files(cores, self.align_single, files)
+            gen_func.process_files(processes, self.align_single, files)
 
-    def check_files(self):
+    def get_index_size(self):
+        """
+        Gets the size of the HISAT2 index, which is the memory every aligner needs for it.
+
+        :return: The size of all the files of the index in gigabytes
+        """
+        index_files = glob.glob(f"{self.hisat_index}.*.ht2")
+        return sum(os.path.getsize(index_file) for index_file in index_files) / 1024 ** 3
+
+    def calculate_max_aligners(self, memory):
+        """
+        Calculates how many aligners can run at the same time within the given memory.
+        Without a shared index every aligner loads its own copy of the index,
+        with a shared index the index is only in the page cache once.
+        The memory that is currently available on the system is used when that is less.
+
+        :param memory: The amount of gigabytes of memory the aligners together may use
+        :return: The maximum amount of aligners that can run at the same time (at least 1)
+        """
+        memory = min(memory, gen_func.get_available_memory())
+        index_size = self.get_index_size()
+        if self.shared_index:
+            return max(floor((memory - index_size) / ALIGNER_MEMORY), 1)
+        return max(floor(memory / (index_size + ALIGNER_MEMORY)), 1)
+
+    def calculate_aligner_memory(self, aligners):
+        """
+        Calculates how much memory the given amount of aligners running at the same time use.
+
+        :param aligners: The amount of aligners running at the same time
+        :return: The amount of gigabytes of memory the aligners together use
+        """
+        index_size = self.get_index_size()
+        if self.shared_index:
+            return index_size + aligners * ALIGNER_MEMORY
+        return aligners * (index_size + ALIGNER_MEMORY)
+
+    def create_hisat_query(self, threads=None):
+        """
+        Creates the start of the hisat2 query that is the same for every alignment.
+
+        :param threads: The amount of threads hisat2 may use (defaults to self.threads)
+        :return: The hisat2 query in the form of a string
+        """
+        threads = self.threads if threads is None else threads
+        query = f"hisat2 -x {self.hisat_index} -p {str(threads)}"
+        if self.shared_index:
+            query += " --mm"
+        return query
+
+    def check_files(self, files=None):
         """
         This method will collect the first line from all files and check if they are not empty.
         If the file is not empty it will put it in a dictionary with the file name as key
-        and the first line (header) as value.
+        and the first line (header) as value. The files are read at the same time.
 
+        :param files: The files that need to be checked (defaults to all the trimmed files)
         :return: A dictionary with filenames as keys and first lines/headers as values
         """
-        files = glob.glob(f"{self.output_dir}/Preprocessing/trimmed/*.gz")
-        file_line_dict = dict()
+        if files is None:
+            files = glob.glob(f"{self.output_dir}/Preprocessing/trimmed/*.gz")
+        return FilePairer().read_headers(files)
 
-        # Gather header lines from files and put them in a dictionary bound to the file name
-        for file in files:
-            first_line = gzip.open(file).readline()
-            if first_line:
-                file_line_dict[file] = first_line.strip().decode('UTF-8')
-        return file_line_dict
-
-    def create_pairs(self, file_line_dict):
+    @staticmethod
+    def create_pairs(file_line_dict):
         """
-        If files need to be paired this function will look for the pair identifier in the header
-        of a file and look for the corresponding file to complete the pair.
+        Pairs the files by the read name in their header (or else by their file name),
+        with a single lookup per file.
 
         :param file_line_dict: A dictionary with filenames as keys and first lines/headers as values
         :return: pairs: A list containing lists with the names of the files from a pair
                  single_ended: A list containing all the filenames of single ended files
         """
-        single_ended = list()
-        pairs = list()
-        for file_name, header in file_line_dict.items():
-            header = header.split()
-            # Look for the identifier that a file is a part of a pair
-            if header[1].endswith("/1") or header[1].endswith("/2"):
-                # Both files of a pair get added simultaneously so the file should not be added yet
-                if not any(file_name in pair_list for pair_list in pairs):
-                    # Get the paired file of the current file
-                    found_paired_file, side = self._find_pair(file_line_dict, file_name, header[0])
-
-                    # Add the pair in the correct order or if no pair could be made add to single
-                    if side == "1":
-                        pairs.append([found_paired_file, file_name])
-                    elif side == "2":
-                        pairs.append([file_name, found_paired_file])
-                    else:
-                        single_ended.append(file_name)
-                        print(f"\t[INFO] File {file_name} was paired but the complementary "
-                              f"file could not be found so it was aligned as singled ended")
-            else:
-                # If there isn't an identifier indicating the file is paired add it to single_ended
-                single_ended.append(file_name)
-        return pairs, single_ended
+        return FilePairer.create_pairs(file_line_dict)
 
     def align_single(self, file):
         """
@@ -116,10 +170,10 @@ class Alignment:
 
         :param file: The file the alignment needs to be performed on.
         """
-        file_name = Path(file).stem
-        new_name = Path(file_name).stem.replace("_trimmed", "_aligned")
+        new_name = self.get_aligned_name(file)
 
-        single_query = f"hisat2 -x {self.hisat_index} -U {file} -p {str(self.threads)} | " \
+        single_query = f"{self.create_hisat_query()} -U {file} " \
+                       f"{self.get_read_group(new_name)} | " \
                        f"samtools view -b -o {self.output_dir}/Preprocessing/aligned/{new_name}.bam"
         self.align(single_query, new_name)
 
@@ -129,64 +183,606 @@ class Alignment:
 
         :param pair: A list containing both filenames from a pair (in correct order)
         """
-        # Create 1 filename from both files of the pair
-        clean_pair = list()
-        for input_file in pair:
-            file_name = Path(input_file).stem
-            clean_name = Path(file_name).stem.replace("_trimmed", "")
-            clean_pair.append(clean_name)
-        clean_name = "_".join(clean_pair)
-        new_name = clean_name + "_aligned"
+        new_name = self.get_aligned_name(pair)
+        clean_name = new_name.replace("_aligned", "")
 
         # Create and run the query for paired ended
-        pair_query = f"hisat2 -x {self.hisat_index} -1 {pair[0]} -2 {pair[1]} " \
-                     f"-p {str(self.threads)} | samtools view -b " \
+        pair_query = f"{self.create_hisat_query()} -1 {pair[0]} -2 {pair[1]} " \
+                     f"{self.get_read_group(new_name)} | samtools view -b " \
                      f"-o {self.output_dir}/Preprocessing/aligned/{new_name}.bam"
         self.align(pair_query, clean_name)
 
-    def align(self, query, log_name):
+    @staticmethod
+    def create_batches(units, threshold):
+        """
+        Divides the samples into batches of small samples that are aligned together in
+        one hisat2 process and the samples that are big enough to be aligned on their own.
+        Single ended and paired samples are never put in the same batch.
+
+        :param units: A list with a list of files (1 file or both files of a pair) per sample
+        :param threshold: Samples with less megabytes than this are aligned in a batch
+        :return: batches: A list of batches, every batch is a list of samples
+                 separate: A list with the samples that need to be aligned on their own
+        """
+        batches = list()
+        separate = list()
+        small_units = {1: list(), 2: list()}
+        for unit in units:
+            unit_size = sum(os.path.getsize(file) for file in unit) / 1024 ** 2
+            if unit_size < threshold:
+                small_units[len(unit)].append(unit)
+            else:
+                separate.append(unit)
+
+        for unit_list in small_units.values():
+            for start in range(0, len(unit_list), MAX_BATCH_SAMPLES):
+                batch = unit_list[start:start + MAX_BATCH_SAMPLES]
+                # A batch of 1 sample has no index loads to save
+                if len(batch) > 1:
+                    batches.append(batch)
+                else:
+                    separate.extend(batch)
+        return batches, separate
+
+    def align_batch(self, units):
+        """
+        Aligns multiple small samples with a single hisat2 process so the index is loaded once.
+        The name of every read gets the number of its sample in front of it,
+        which is used to split the alignments back up into a bam file (and read group) per sample.
+
+        :param units: A list with the trimmed file (or both files of a pair) of every sample
+        """
+        names = [self.get_aligned_name(unit) for unit in units]
+        log_name = f"batch_{names[0].replace('_aligned', '')}"
+        aligned_dir = f"{self.output_dir}/Preprocessing/aligned"
+        gen_func.print_tool(log_name, "s", f"batched alignment process of {len(units)} samples")
+
+        # Single ended reads are fed through stdin, paired reads through a named pipe per side
+        if len(units[0]) == 2:
+            inputs = [f"{aligned_dir}/{log_name}.{side}.fifo" for side in (1, 2)]
+            for fifo in inputs:
+                os.mkfifo(fifo)
+            query = [*self.create_hisat_query().split(), "-1", inputs[0], "-2", inputs[1]]
+        else:
+            inputs = None
+            query = [*self.create_hisat_query().split(), "-U", "-"]
+
+        # The summary of hisat2 is about the whole batch, every sample gets its own summary below
+        tool_dir = f"{self.output_dir}/tool_logs/preprocessing"
+        with open(f"{tool_dir}/{log_name}_hisat2.log", "w") as opened_log_file:
+            process = Popen(query, stdin=PIPE if inputs is None else DEVNULL, stdout=PIPE,
+                            stderr=opened_log_file)
+            if inputs is None:
+                feeders = [Thread(target=self._feed_reads,
+                                  args=([unit[0] for unit in units], process.stdin))]
+            else:
+                feeders = [Thread(target=self._feed_reads, args=([unit[side] for unit in units],
+                                                                 fifo))
+                           for side, fifo in enumerate(inputs)]
+            for feeder in feeders:
+                feeder.start()
+
+            summaries = self._split_alignments(process.stdout, names, aligned_dir)
+            process.wait()
+
+        # Make sure feeders that are still waiting for hisat2 to open their pipe can finish
+        for fifo in inputs or []:
+            os.close(os.open(fifo, os.O_RDONLY | os.O_NONBLOCK))
+        for feeder in feeders:
+            feeder.join()
+        for fifo in inputs or []:
+            os.remove(fifo)
+
+        if process.returncode != 0:
+            raise RuntimeError(f"hisat2 failed for batch {log_name} "
+                               f"(exit code {process.returncode})")
+        for name, summary in zip(names, summaries):
+            # The same log names as the samples that are aligned on their own
+            summary.write(f"{tool_dir}/{self.get_log_name(name, len(units[0]))}_alignment.log")
+        gen_func.print_tool(log_name, "f", f"batched alignment process of {len(units)} samples")
+
+    @staticmethod
+    def _feed_reads(files, destination):
+        """
+        Writes the reads of all the given files after each other to the destination,
+        with the number of the sample the read is from in front of the name of every read.
+
+        :param files: The gzipped fastq files, one per sample in the order of the samples
+        :param destination: An opened binary stream or the path of a named pipe
+        """
+        try:
+            stream = open(destination, "wb") if isinstance(destination, str) else destination
+            with stream:
+                for sample_number, file in enumerate(files):
+                    prefix = f"@{sample_number}:".encode()
+                    with gzip.open(file) as opened_file:
+                        for line_number, line in enumerate(opened_file):
+                            if line_number % 4 == 0:
+                                line = prefix + line[1:]
+                            stream.write(line)
+        except BrokenPipeError:
+            pass  # hisat2 stopped reading, it reports why itself
+
+    @staticmethod
+    def _split_alignments(alignments, names, aligned_dir):
+        """
+        Splits the SAM output of a batched alignment into a bam file per sample.
+        The sample number is removed from the name of every read again
+        and the read group of the sample is added to the header and every alignment.
+        The alignments of every sample are counted for its own alignment summary.
+
+        :param alignments: The binary SAM output stream of hisat2
+        :param names: The names of the aligned bam files, in the order of the samples
+        :param aligned_dir: The directory the bam files are written to
+        :return: A list with the AlignmentSummary of every sample, in the order of the samples
+        """
+        header = list()
+        writers = list()
+        summaries = [AlignmentSummary() for _ in names]
+        for line in alignments:
+            if not writers:
+                if line.startswith(b"@"):
+                    header.append(line)
+                    continue
+                # The header is complete, start a samtools view process for every sample
+                for name in names:
+                    writer = Popen(["samtools", "view", "-b", "-o", f"{aligned_dir}/{name}.bam",
+                                    "-"], stdin=PIPE)
+                    read_group = f"@RG\tID:{name}\tSM:{name}\tLB:{name}\tPU:{name}" \
+                                 f"\tPL:illumina\n"
+                    writer.stdin.writelines([*header, read_group.encode()])
+                    writers.append((writer, f"\tRG:Z:{name}\n".encode()))
+
+            sample_number, _, record = line.partition(b":")
+            record = record.rstrip(b"\n")
+            writer, read_group_tag = writers[int(sample_number)]
+            writer.stdin.write(record + read_group_tag)
+            summaries[int(sample_number)].add(record)
+
+        for writer, _ in writers:
+            writer.stdin.close()
+            writer.wait()
+        return summaries
+
+    def align_trimming(self, trimmer, files):
+        """
+        Trims the file (or both files of a pair) of a sample and aligns the trimmed reads
+        straight away, the trimmer writes into named pipes hisat2 reads from so the trimmed
+        reads never have to be compressed, written to disk, read and decompressed again.
+        The trimming reports are still written next to where the trimmed files would be.
+        Pairs can only be streamed when they are clipped (the clipper writes every read),
+        Trim Galore only writes the validated pairs after both files are trimmed completely.
+
+        :param trimmer: The Trimmer used to trim the files
+        :param files: The input file or both input files of a pair
+        """
+        fifos = [trimmer.get_trimmed_file(file, compressed=False) for file in files]
+        for fifo in fifos:
+            if os.path.lexists(fifo):
+                os.remove(fifo)
+            os.mkfifo(fifo)
+
+        # Both files of a pair are clipped at the same time, so hisat2 can read them side by side
+        alignment_done = Event()
+        try:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                trimming = executor.submit(self._trim_into_pipes, trimmer, files, fifos,
+                                           alignment_done)
+                try:
+                    if len(fifos) == 2:
+                        self.align_pair(fifos)
+                    else:
+                        self.align_single(fifos[0])
+                finally:
+                    alignment_done.set()
+                    # Make sure trimmers still waiting for hisat2 to open their pipe can finish
+                    for fifo in fifos:
+                        os.close(os.open(fifo, os.O_RDONLY | os.O_NONBLOCK))
+                # hisat2 succeeds on the reads it got when the trimmer fails, so raise its error
+                trimming.result()
+        finally:
+            for fifo in fifos:
+                os.remove(fifo)
+
+    @staticmethod
+    def _trim_into_pipes(trimmer, files, fifos, alignment_done):
+        """
+        Trims a file (or both files of a pair) into named pipes. When the trimmer stops without
+        ever opening a pipe, the pipe is opened and closed once hisat2 opens it
+        so hisat2 does not wait for reads.
+
+        :param trimmer: The Trimmer used to trim the files
+        :param files: The input file or both input files of a pair
+        :param fifos: The named pipes the trimmer writes the trimmed reads to
+        :param alignment_done: Event that is set when the alignment has finished
+        """
+        try:
+            trimmer.trim_unit(files, compress=False)
+        finally:
+            for fifo in fifos:
+                while not alignment_done.is_set():
+                    try:
+                        os.close(os.open(fifo, os.O_WRONLY | os.O_NONBLOCK))
+                        break
+                    except OSError:  # hisat2 has not opened the pipe yet or is done with it
+                        alignment_done.wait(0.5)
+
+    @staticmethod
+    def calculate_chunks(unit, cores):
+        """
+        Calculates in how many chunks a sample is split to align the chunks at the same time.
+        Every chunk has at least MIN_CHUNK_SIZE gigabytes and gets CHUNK_THREADS threads,
+        so there are never more chunks than can be aligned at the same time.
+
+        :param unit: A list with the file (or both files of a pair) of a sample
+        :param cores: The amount of cores the pipeline may use
+        :return: The amount of chunks, 1 means the sample does not need to be split
+        """
+        unit_size = sum(os.path.getsize(file) for file in unit) / 1024 ** 3
+        return max(min(floor(unit_size / MIN_CHUNK_SIZE), cores // CHUNK_THREADS), 1)
+
+    def get_chunk_prefix(self, file):
+        """
+        Gets the start of the names of the chunks of a trimmed file.
+
+        :param file: The trimmed file the chunks are from
+        :return: The name of the chunk files with directories, without the number and extension
+        """
+        clean_name = Path(Path(file).stem).stem
+        return f"{self.output_dir}/Preprocessing/trimmed/chunks/{clean_name}.chunk"
+
+    def get_chunk_file(self, file, chunk_number):
+        """
+        Gets the name of the named pipe a chunk of a trimmed file is streamed through.
+
+        :param file: The trimmed file the chunk is from
+        :param chunk_number: The number of the chunk
+        :return: The name of the chunk file with directories
+        """
+        return f"{self.get_chunk_prefix(file)}{chunk_number}.fq"
+
+    def align_chunks(self, files, chunks):
+        """
+        Splits the file (or both files of a pair) of a sample into chunks and aligns the chunks
+        at the same time. The reads are streamed into a named pipe per chunk while they are
+        split, so the alignment of every chunk starts straight away.
+
+        :param files: The trimmed file or both trimmed files of a pair
+        :param chunks: The amount of chunks the files need to be split in
+        """
+        aligned_name = self.get_aligned_name(files)
+        os.makedirs(f"{self.output_dir}/Preprocessing/trimmed/chunks", exist_ok=True)
+        fifos = [self.get_chunk_file(file, number) for file in files for number in range(chunks)]
+        for fifo in fifos:
+            if os.path.lexists(fifo):
+                os.remove(fifo)
+            os.mkfifo(fifo)
+        gen_func.print_tool(aligned_name, "s", f"aligning in {chunks} chunks")
+
+        alignment_done = Event()
+        try:
+            with ThreadPoolExecutor(max_workers=chunks + 1) as executor:
+                split = executor.submit(self._split_into_pipes, files, chunks, alignment_done)
+                alignments = [executor.submit(self.align_chunk, files, number)
+                              for number in range(chunks)]
+                try:
+                    # When an aligner fails before it opens its pipes, the splitter waits for
+                    # it forever, so its pipes are opened until all the other aligners are done
+                    running, failed = alignments, False
+                    while running:
+                        done, running = wait(running, timeout=0.5, return_when=FIRST_EXCEPTION)
+                        failed = failed or any(alignment.exception() for alignment in done)
+                        if failed:
+                            for fifo in fifos:
+                                os.close(os.open(fifo, os.O_RDONLY | os.O_NONBLOCK))
+                    summaries = [alignment.result() for alignment in alignments]
+                finally:
+                    alignment_done.set()
+                    # The splitter may be waiting for an aligner that never opened its pipe
+                    for fifo in fifos:
+                        os.close(os.open(fifo, os.O_RDONLY | os.O_NONBLOCK))
+                split.result()
+        finally:
+            for fifo in fifos:
+                os.remove(fifo)
+
+        # The chunks are one sample for MultiQC, so their summaries are added up
+        summary = AlignmentSummary()
+        for chunk_summary in summaries:
+            summary.counts.update(chunk_summary.counts)
+        tool_dir = f"{self.output_dir}/tool_logs/preprocessing"
+        summary.write(f"{tool_dir}/{self.get_log_name(aligned_name, len(files))}_alignment.log")
+        gen_func.print_tool(aligned_name, "f", f"aligning in {chunks} chunks")
+
+    def _split_into_pipes(self, files, chunks, alignment_done):
+        """
+        Divides the reads of the file (or both files of a pair) of a sample over the named pipes
+        of the chunks in turns, so the mates of a pair end up in the chunks with the same number
+        in the same order. When the splitter stops without opening a pipe, the pipe is opened and
+        closed once hisat2 opens it so hisat2 does not wait for reads.
+
+        :param files: The trimmed file or both trimmed files of a pair
+        :param chunks: The amount of chunks the files need to be split in
+        :param alignment_done: Event that is set when the alignments of all the chunks finished
+        """
+        try:
+            decompressors = [Popen(["gzip", "-dc", file], stdout=PIPE) for file in files]
+            query = ["awk", "-v", f"chunks={chunks}", "-v",
+                     f"prefix={self.get_chunk_prefix(files[0])}"]
+            if len(files) == 2:
+                mates = decompressors[1].stdout.fileno()
+                query.extend(["-v", f"mates=/dev/fd/{mates}", "-v",
+                              f"mate_prefix={self.get_chunk_prefix(files[1])}"])
+            splitter = Popen([*query, AWK_SPLIT_PROGRAM], stdin=decompressors[0].stdout,
+                             stderr=PIPE, text=True,
+                             pass_fds=[decompressor.stdout.fileno()
+                                       for decompressor in decompressors[1:]])
+            for decompressor in decompressors:
+                decompressor.stdout.close()
+
+            _, errors = splitter.communicate()
+            if splitter.returncode != 0 or any(decompressor.wait() != 0
+                                               for decompressor in decompressors):
+                raise RuntimeError(f"Splitting {', '.join(files)} into chunks failed: {errors}")
+        finally:
+            for number in range(chunks):
+                for file in files:
+                    fifo = self.get_chunk_file(file, number)
+                    while not alignment_done.is_set():
+                        try:
+                            os.close(os.open(fifo, os.O_WRONLY | os.O_NONBLOCK))
+                            break
+                        except OSError:  # hisat2 has not opened the pipe yet or is done with it
+                            alignment_done.wait(0.5)
+
+    def align_chunk(self, files, chunk_number):
+        """
+        Aligns a chunk of a sample, the reads get the read group of the whole sample.
+
+        :param files: The trimmed file or both trimmed files of a pair the chunk is from
+        :param chunk_number: The number of the chunk
+        :return: The AlignmentSummary of the chunk, read from the summary of hisat2
+        """
+        aligned_name = self.get_aligned_name(files)
+        chunk_files = [self.get_chunk_file(file, chunk_number) for file in files]
+        if len(chunk_files) == 2:
+            reads = f"-1 {chunk_files[0]} -2 {chunk_files[1]}"
+        else:
+            reads = f"-U {chunk_files[0]}"
+
+        chunk_name = f"{aligned_name}.chunk{chunk_number}"
+        chunk_query = f"{self.create_hisat_query(CHUNK_THREADS)} {reads} " \
+                      f"{self.get_read_group(aligned_name)} | samtools view -b -o " \
+                      f"{self.output_dir}/Preprocessing/aligned/{chunk_name}.bam"
+        executed_process = self.align(chunk_query, chunk_name, "hisat2")
+        return AlignmentSummary.read_hisat2_summary(executed_process.stderr)
+
+    def gather_chunks(self, files, chunks):
+        """
+        Merges the bam files of all the chunks of a sample into the bam file of the sample
+        and removes the files of the chunks.
+
+        :param files: The trimmed file or both trimmed files of a pair the chunks are from
+        :param chunks: The amount of chunks the sample was split in
+        """
+        aligned_name = self.get_aligned_name(files)
+        aligned_dir = f"{self.output_dir}/Preprocessing/aligned"
+        chunk_bams = [f"{aligned_dir}/{aligned_name}.chunk{number}.bam" for number in range(chunks)]
+
+        gen_func.print_tool(aligned_name, "s", "merging chunks")
+        executed_process = run(["samtools", "cat", "-o", f"{aligned_dir}/{aligned_name}.bam",
+                                *chunk_bams], capture_output=True, text=True)
+        tool_dir = f"{self.output_dir}/tool_logs/preprocessing"
+        gen_func.save_tool_log(executed_process, f"{tool_dir}/{aligned_name}_merge_chunks.log")
+        if executed_process.returncode != 0:
+            raise RuntimeError(f"Merging the chunks of {aligned_name} failed")
+
+        for chunk_bam in chunk_bams:
+            os.remove(chunk_bam)
+        gen_func.print_tool(aligned_name, "f", "merging chunks")
+
+    @staticmethod
+    def get_aligned_name(unit):
+        """
+        Creates the name (without directories and extension) of the bam file an alignment creates.
+        For a pair the names of both files are combined into 1 name.
+
+        :param unit: A single file or a list containing both filenames from a pair
+        :return: The name of the aligned bam file
+        """
+        files = unit if isinstance(unit, (list, tuple)) else [unit]
+
+        clean_names = list()
+        for input_file in files:
+            # Remove the extensions, the trimmed files are not gzipped when they are named pipes
+            file_name = re.sub(r"(\.fq|\.fastq)?(\.gz)?$", "", Path(input_file).name)
+            clean_names.append(re.sub(r"_(trimmed|val_[12])$", "", file_name))
+        return "_".join(clean_names) + "_aligned"
+
+    @staticmethod
+    def get_log_name(aligned_name, files):
+        """
+        Gets the name the alignment log of a sample is saved with,
+        the logs of pairs are named without '_aligned' in them.
+
+        :param aligned_name: The name of the aligned bam file of the sample
+        :param files: The amount of input files of the sample (1 or 2 for a pair)
+        :return: The name of the log file without the '_alignment.log' part
+        """
+        return aligned_name.replace("_aligned", "") if files == 2 else aligned_name
+
+    @staticmethod
+    def get_read_group(aligned_name):
+        """
+        Creates the hisat2 arguments that add a read group to every read during the alignment,
+        so it does not have to be added afterwards with Picard AddOrReplaceReadGroups.
+
+        :param aligned_name: The name of the aligned bam file, used as read group and sample name
+        :return: The hisat2 arguments in the form of a string
+        """
+        return f"--rg-id {aligned_name} --rg SM:{aligned_name} --rg LB:{aligned_name} " \
+               f"--rg PU:{aligned_name} --rg PL:illumina"
+
+    def align(self, query, log_name, log_type="alignment"):
         """
         Performs the actual alignment using the given query and creates a logfile with given name.
         It will also convert the output file from the hisat tool to bam using samtools view.
+        A RuntimeError is raised when hisat2 or samtools view fails.
 
         :param query: The complete query to run the alignment with in the form of a string
         :param log_name: The basename of the file that the alignment is getting done on
+        :param log_type: The end of the name of the log file, only the '_alignment.log' files
+                         are read by MultiQC
+        :return: The executed process with the output of hisat2 and samtools
         """
-        # Run the hisat too and samtools view query and save the log file after
+        # Run the hisat too and samtools view query and save the log file after,
+        # pipefail makes a failing hisat2 fail the query even though samtools view succeeds
         gen_func.print_tool(log_name, "s", "alignment process")
-        executed_process = run(query, shell=True, capture_output=True, text=True)
+        executed_process = run(f"set -o pipefail; {query}", shell=True, executable="/bin/bash",
+                               capture_output=True, text=True)
 
         # Save all logs from stdout and stderr to a logfile
         tool_dir = f"{self.output_dir}/tool_logs/preprocessing"
-        gen_func.save_tool_log(executed_process, f"{tool_dir}/{log_name}_alignment.log")
+        gen_func.save_tool_log(executed_process, f"{tool_dir}/{log_name}_{log_type}.log")
+        if executed_process.returncode != 0:
+            raise RuntimeError(f"The alignment of {log_name} failed (exit code "
+                               f"{executed_process.returncode}), see {log_name}_{log_type}.log")
         gen_func.print_tool(log_name, "f", "alignment process")
+        return executed_process
 
-    @staticmethod
-    def _find_pair(dictionary, mate_name, w_full_tag):
+
+class AlignmentSummary:
+    """
+    Counts the alignments of the reads of a sample the same way hisat2 does for its summary,
+    so the samples that are aligned together in a batch still get an alignment log each.
+    Only the primary alignment of every read is counted.
+    """
+    def __init__(self):
+        """
+        Constructor for the AlignmentSummary class
+        """
+        self.counts = Counter()
+        self.mates = dict()
+
+    @classmethod
+    def read_hisat2_summary(cls, text):
+        """
+        Reads the counts of an alignment summary written by hisat2 (or by the write method).
+
+        :param text: The text with the summary, other lines in it are ignored
+        :return: An AlignmentSummary with the counts of the summary
+        """
+        summary = cls()
+        section = None
+        for line in text.splitlines():
+            line_match = SUMMARY_LINE_PATTERN.match(line)
+            if not line_match:
+                continue
+            amount, description = int(line_match.group(1)), line_match.group(2)
+            times_match = SUMMARY_TIMES_PATTERN.search(description)
+            if "were paired" in description:
+                section = "concordant"
+            elif "were unpaired" in description:
+                section = "unpaired"
+            elif "mates make up the pairs" in description:
+                section = "mate"
+            elif "aligned discordantly 1 time" in description:
+                summary.counts["discordant"] = amount
+            elif "aligned 0 times concordantly or discordantly" in description:
+                summary.counts["other_pairs"] = amount
+            elif section is not None and times_match:
+                times = SUMMARY_TIMES.index(times_match.group(1))
+                if section != "concordant" or times:  # Follows from the other pair counts
+                    summary.counts[f"{section}_{times}"] = amount
+        return summary
+
+    def add(self, record):
         """
-        This method tries to find the complementary file from a pair
-        using the other file from the pair.
-        It goes through the given dictionary and tries to match the wanted tag with another file.
-        If a file is found it will return the found file's name and the read direction.
+        Counts a SAM record of the sample.
 
-        :param dictionary: The dictionary with all the filenames as keys and file headers as values
-        :param mate_name: The file you want the paired complementary file of
-        :param w_full_tag: Tag from the header of the 'mate_name' file
+        :param record: The SAM record in the form of bytes, without the line ending
+        """
+        read_name, flag, _ = record.split(b"\t", 2)
+        flag = int(flag)
+        if flag & 0x900:  # Secondary or supplementary alignment
+            return
+        times = 0
+        if not flag & 0x4:
+            nh_match = NH_TAG_PATTERN.search(record)
+            times = min(int(nh_match.group(1)) if nh_match else 1, 2)
+        if not flag & 0x1:
+            self.counts[f"unpaired_{times}"] += 1
+            return
+
+        # The mates of a pair are next to each other in the output of hisat2
+        mate_times = self.mates.pop(read_name, None)
+        if mate_times is None:
+            self.mates[read_name] = times
+        elif flag & 0x2:
+            self.counts[f"concordant_{times}"] += 1
+        elif times == 1 and mate_times == 1:
+            self.counts["discordant"] += 1
+        else:
+            self.counts["other_pairs"] += 1
+            self.counts[f"mate_{times}"] += 1
+            self.counts[f"mate_{mate_times}"] += 1
 
-        :return: file_name: The name of the matched file (or None if not found)
-                 paired_side: 1 or 2 indicating the side of the found file (or None if not found)
+    def write(self, log_file):
         """
-        wanted_tag = w_full_tag.split(".")[0]
+        Writes the summary in the format of hisat2, so MultiQC can read it.
 
-        for file_name, header in dictionary.items():
-            full_tag = header.split()[0]  # Get only the tag from the header (first item)
-            tag = full_tag.split(".")[0]  # Remove read number from the tag
+        :param log_file: The name of the log file with directories
+        """
+        counts = self.counts
+        unpaired = sum(counts[f"unpaired_{times}"] for times in range(3))
+        concordant = counts["concordant_1"] + counts["concordant_2"]
+        pairs = concordant + counts["discordant"] + counts["other_pairs"]
+        aligned = counts["unpaired_1"] + counts["unpaired_2"] + counts["mate_1"] + \
+            counts["mate_2"] + 2 * (concordant + counts["discordant"])
+
+        lines = [f"{unpaired + pairs} reads; of these:"]
+        if pairs:
+            lines.extend([
+                f"  {pairs} ({percent(pairs, unpaired + pairs)}) were paired; of these:",
+                f"    {pairs - concordant} ({percent(pairs - concordant, pairs)}) "
+                "aligned concordantly 0 times",
+                f"    {counts['concordant_1']} ({percent(counts['concordant_1'], pairs)}) "
+                "aligned concordantly exactly 1 time",
+                f"    {counts['concordant_2']} ({percent(counts['concordant_2'], pairs)}) "
+                "aligned concordantly >1 times",
+                "    ----",
+                f"    {pairs - concordant} pairs aligned concordantly 0 times; of these:",
+                f"      {counts['discordant']} "
+                f"({percent(counts['discordant'], pairs - concordant)}) "
+                "aligned discordantly 1 time",
+                "    ----",
+                f"    {counts['other_pairs']} pairs aligned 0 times concordantly or "
+                "discordantly; of these:",
+                f"      {2 * counts['other_pairs']} mates make up the pairs; of these:",
+                *[f"        {counts[f'mate_{times}']} "
+                  f"({percent(counts[f'mate_{times}'], 2 * counts['other_pairs'])}) {text}"
+                  for times, text in enumerate(ALIGNED_TIMES)]])
+        if unpaired or not pairs:
+            lines.append(f"  {unpaired} ({percent(unpaired, unpaired + pairs)}) "
+                         "were unpaired; of these:")
+            lines.extend(f"    {counts[f'unpaired_{times}']} "
+                         f"({percent(counts[f'unpaired_{times}'], unpaired)}) {text}"
+                         for times, text in enumerate(ALIGNED_TIMES))
+        lines.append(f"{percent(aligned, unpaired + 2 * pairs)} overall alignment rate")
+
+        with open(log_file, "w") as opened_log_file:
+            opened_log_file.write("\n".join(lines) + "\n")
+
+
+def percent(part, whole):
+    """
+    Formats a part of a whole as a percentage the way hisat2 does.
 
-            # We want a matched file (and that's not itself)
-            if tag == wanted_tag and mate_name != file_name:
-                paired_side = header.split()[1][-1]  # Collect the side of the file in the pair
-                return file_name, paired_side
-        return None, None
+    :param part: The amount of the part
+    :param whole: The amount of the whole
+    :return: The percentage with 2 decimals and a percent sign
+    """
+    return f"{100 * part / whole if whole else 0:.2f}%"
 
 
 # MAIN
@@ -195,8 +791,8 @@ def main():
     output_directory = "../../../students/2020-2021/Thema06/groepje3/temp"
     paired = True
 
-    align = Alignment(paired, output_directory)
-    align.perform_alignment(32)
+    align = Alignment(paired, output_directory, get_genome("human"), shared_index=True)
+    align.perform_alignment(32, 64)
     return 0
 
 
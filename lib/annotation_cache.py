@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+"""
+This module converts the GTF annotation of a genome into a flattened SAF annotation
+for featureCounts. Parsing and flattening a GTF file is the startup cost of every featureCounts
+run, the SAF file only has the merged exons of every gene so it is read a lot faster.
+The SAF file is saved next to the genome files with the checksum of the GTF file in its name,
+so it is built once and reused by all the runs that use the same annotation.
+The checksum is saved next to the GTF file with the size and modification time of the GTF file,
+so it is only calculated again when the GTF file changed.
+"""
+
+# METADATA VARIABLES
+__author__ = "Vincent Talen"
+__status__ = "Development"
+__date__ = "17-10-2026"
+__version__ = "v0.2"
+
+# IMPORTS
+import os
+import re
+import sys
+import glob
+import json
+import hashlib
+from pathlib import Path
+import lib.general_functions as gen_func
+from lib.genome_registry import get_genome
+
+# Amount of bytes of the GTF file that are read at the same time to calculate the checksum
+CHECKSUM_BLOCK_SIZE = 8 * 1024 ** 2
+GENE_ID_PATTERN = re.compile(r'gene_id "([^"]+)"')
+
+
+# FUNCTIONS
+def prepare_annotation(output_dir, genome):
+    """
+    Gets the SAF annotation of a genome, it is converted from the GTF file if it is not cached.
+
+    :param output_dir: The path of the output directory
+    :param genome: The Genome from the genome registry with the annotation file to use
+    :return: The name of the SAF file with directories
+    """
+    gtf_file = f"{output_dir}/Data/genome/{genome.gtf_file}"
+    saf_file = get_saf_file(gtf_file)
+    if not os.path.isfile(saf_file):
+        gen_func.print_tool(Path(gtf_file).name, "s", "annotation conversion")
+        convert_gtf_to_saf(gtf_file, saf_file)
+
+        # Annotations of earlier versions of the GTF file will never be used again
+        for old_saf_file in glob.glob(f"{Path(gtf_file).with_suffix('')}.*.saf"):
+            if old_saf_file != saf_file:
+                os.remove(old_saf_file)
+        gen_func.print_tool(Path(gtf_file).name, "f", "annotation conversion")
+    return saf_file
+
+
+def get_saf_file(gtf_file):
+    """
+    Gets the name of the SAF file that belongs to the current contents of a GTF file.
+    The checksum of the GTF file is only calculated when its size or modification time
+    differs from the last time it was calculated.
+
+    :param gtf_file: The GTF annotation file
+    :return: The name of the SAF file with directories
+    """
+    checksum_file = f"{Path(gtf_file).with_suffix('')}.checksum.json"
+    gtf_stat = os.stat(gtf_file)
+    signature = [gtf_stat.st_size, gtf_stat.st_mtime_ns]
+    saved = dict()
+    if os.path.isfile(checksum_file):
+        try:
+            with open(checksum_file) as opened_checksum:
+                saved = json.load(opened_checksum)
+        except ValueError:
+            pass  # A broken checksum file only means the checksum is calculated again
+
+    if saved.get("signature") == signature:
+        checksum = saved["checksum"]
+    else:
+        hashed = hashlib.sha256()
+        with open(gtf_file, "rb") as opened_gtf:
+            for block in iter(lambda: opened_gtf.read(CHECKSUM_BLOCK_SIZE), b""):
+                hashed.update(block)
+        checksum = hashed.hexdigest()[:12]
+
+        temporary_file = f"{checksum_file}.{os.getpid()}.tmp"
+        with open(temporary_file, "w") as opened_checksum:
+            json.dump({"signature": signature, "checksum": checksum}, opened_checksum)
+        os.replace(temporary_file, checksum_file)
+    return f"{Path(gtf_file).with_suffix('')}.{checksum}.saf"
+
+
+def convert_gtf_to_saf(gtf_file, saf_file):
+    """
+    Converts the exons of a GTF file into a SAF file, the same way featureCounts reads a GTF file
+    by default (exon features grouped by gene_id). Overlapping exons of a gene are merged,
+    which does not change the counts because a read is only counted once per gene.
+    The genes keep the order of the GTF file, so the count matrix keeps the same order as well.
+
+    :param gtf_file: The GTF annotation file
+    :param saf_file: The SAF file that needs to be created
+    """
+    exons = dict()
+    with open(gtf_file) as opened_gtf:
+        for line in opened_gtf:
+            if line.startswith("#"):
+                continue
+            columns = line.rstrip("\n").split("\t")
+            if len(columns) < 9 or columns[2] != "exon":
+                continue
+            gene_match = GENE_ID_PATTERN.search(columns[8])
+            if gene_match:
+                key = (gene_match.group(1), columns[0], columns[6])
+                exons.setdefault(key, list()).append((int(columns[3]), int(columns[4])))
+
+    # Write to a temporary file first, so other runs never read a half written annotation
+    temporary_file = f"{saf_file}.{os.getpid()}.tmp"
+    with open(temporary_file, "w") as opened_saf:
+        opened_saf.write("GeneID\tChr\tStart\tEnd\tStrand\n")
+        for (gene_id, chromosome, strand), intervals in exons.items():
+            for start, end in merge_intervals(intervals):
+                opened_saf.write(f"{gene_id}\t{chromosome}\t{start}\t{end}\t{strand}\n")
+    os.replace(temporary_file, saf_file)
+
+
+def merge_intervals(intervals):
+    """
+    Merges overlapping intervals.
+
+    :param intervals: A list with tuples of the start and end of the intervals (1-based, inclusive)
+    :return: A list with tuples of the start and end of the merged intervals, sorted by start
+    """
+    merged = list()
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(interval) for interval in merged]
+
+
+# MAIN
+def main():
+    """Main function to test functionality of the module"""
+    saf_file = prepare_annotation("../../../students/2020-2021/Thema06/groepje3/temp",
+                                  get_genome("human"))
+    print(saf_file)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,6 +5,9 @@ This is a module that contains a class performing all the processing of a bam fi
 It takes the output directory as argument and collects aligned BAM files
 and sorts, groups, fixes and marks duplicate reads for all of the files.
 Every file will be created into a process and multiple will run at the same time.
+By default the tools are piped together and the reads are only sorted when a tool needs it,
+the bam files of all the steps in between can be kept with 'keep_intermediates'.
+The steps can be performed with Picard (single threaded) or samtools (multithreaded).
 To use simply import the BamProcessing class and create an object from it with the output directory.
 """
 
@@ -12,28 +15,56 @@ To use simply import the BamProcessing class and create an object from it with t
 __author__ = "Vincent Talen"
 __status__ = "Development"
 __date__ = "29-12-2020"
-__version__ = "v0.5"
+__version__ = "v0.10"
 
 # IMPORTS
+import os
 import sys
+import time
+import argparse
 from glob import glob
 from pathlib import Path
-from subprocess import run
+from subprocess import run, Popen, PIPE
 import lib.general_functions as gen_func
+from lib.picard_runner import PicardRunner
+
+# The tools of every backend that process every file, in the order they need to be run
+PICARD_STEPS = ["FixMateInformation", "MarkDuplicates"]
+SAMTOOLS_STEPS = ["fixmate", "markdup"]
+BACKEND_STEPS = {"picard": PICARD_STEPS, "samtools": SAMTOOLS_STEPS}
+# The sort order the tools (and featureCounts after them) need their input to be in
+REQUIRED_SORT_ORDER = {"FixMateInformation": "queryname", "MarkDuplicates": "queryname",
+                       "fixmate": "queryname", "markdup": "coordinate",
+                       "featureCounts": "queryname"}
+# The columns of the Picard duplication metrics, samtools markdup stats are converted to these
+DUPLICATION_METRICS = ["LIBRARY", "UNPAIRED_READS_EXAMINED", "READ_PAIRS_EXAMINED",
+                       "SECONDARY_OR_SUPPLEMENTARY_RDS", "UNMAPPED_READS",
+                       "UNPAIRED_READ_DUPLICATES", "READ_PAIR_DUPLICATES",
+                       "READ_PAIR_OPTICAL_DUPLICATES", "PERCENT_DUPLICATION",
+                       "ESTIMATED_LIBRARY_SIZE"]
+# The tools that read their input twice, so it needs to be a file and can not be piped
+SEEKABLE_INPUT = {"MarkDuplicates"}
 
 
 class BamProcessing:
     """
     Class for processing bam files with multiple tools from packages like picard and samtools.
     """
-    def __init__(self, output_dir):
+    def __init__(self, output_dir, keep_intermediates=False, backend="picard"):
         """
         Constructor for the BamProcessing class
 
         :param output_dir: The directory the user gave for all the output files to be saved in
+        :param keep_intermediates: Write the bam file of every step to disk instead of piping them
+        :param backend: The tools to process the files with, 'picard' or 'samtools'
         """
         self.output_dir = output_dir
         self.working_dir = f"{output_dir}/Preprocessing"
+        self.keep_intermediates = keep_intermediates
+        self.backend = backend
+
+        self.threads = 1
+        self.picard_runner = PicardRunner()
 
     def perform_preprocessing(self, cores):
         """
@@ -42,6 +73,8 @@ class BamProcessing:
         :param cores: The amount of cores the processes needs to use
         """
         files = self.gather_files()
+        if self.backend == "samtools":
+            self.threads = gen_func.calculate_threads(cores, len(files))
 
         gen_func.process_files(cores, self.process_file, files)
 
@@ -57,6 +90,276 @@ class BamProcessing:
         return files
 
     def process_file(self, current_file):
+        """
+        This method takes a file and performs all the processing steps on it,
+        either piped together or with an output file per step.
+
+        :param current_file: The file all the processes need to be run on
+        """
+        if self.keep_intermediates:
+            self.process_file_with_intermediates(current_file)
+        else:
+            self.stream_file(current_file)
+
+    def stream_file(self, current_file):
+        """
+        This method takes a file and performs the processing steps of the backend piped together.
+        The read groups are already added during the alignment and merging a single file is
+        only a copy, so those steps are skipped. Sorts are only added where the next step
+        needs another sort order than the reads already have (see plan_steps).
+        The reads are streamed uncompressed from one tool into the next,
+        only the input of Picard MarkDuplicates is written to disk because it reads it twice.
+        All the Picard tools of a file run inside of one JVM and are connected with named pipes.
+        Per step/tool there will be a log file saved in toolLogs.
+
+        :param current_file: The file all the processes need to be run on
+        """
+        log_name = current_file.replace("_aligned", "")
+        aligned_file = f"{self.working_dir}/aligned/{current_file}.bam"
+        final_file = f"{self.working_dir}/markDuplicates/{current_file}_sorted.bam"
+
+        sort_tool = "SortSam" if self.backend == "picard" else "sort"
+        plan = self.plan_steps(self.read_sort_order(aligned_file), BACKEND_STEPS[self.backend],
+                               sort_tool=sort_tool)
+
+        # Split the plan into groups of tools that can be piped together
+        groups = list()
+        for tool_name, sort_order in plan:
+            if not groups or tool_name in SEEKABLE_INPUT:
+                groups.append(list())
+            groups[-1].append((tool_name, sort_order))
+
+        input_file = aligned_file
+        stages = list()
+        temporary_files = list()
+        try:
+            for group_number, group in enumerate(groups):
+                last_group = group_number == len(groups) - 1
+                if last_group:
+                    output_file = final_file
+                else:
+                    output_file = f"{self.working_dir}/markDuplicates/" \
+                                  f"{current_file}.{group[-1][0]}.bam"
+                    temporary_files.append(output_file)
+
+                queries = dict()
+                tool_input = input_file
+                # The tools of a pipe run at the same time, so they share the threads of the file
+                tool_threads = max(self.threads // len(group), 1)
+                for index, (tool_name, sort_order) in enumerate(group):
+                    last_tool = index == len(group) - 1
+                    if last_tool:
+                        tool_output = output_file
+                        compression = "5" if last_group else "1"
+                    elif self.backend == "picard":
+                        # Tools in the same JVM are connected with named pipes instead of stdout
+                        tool_output = f"{self.working_dir}/markDuplicates/" \
+                                      f"{current_file}.{tool_name}.fifo"
+                        if os.path.lexists(tool_output):  # Left behind by an earlier run
+                            os.remove(tool_output)
+                        os.mkfifo(tool_output)
+                        temporary_files.append(tool_output)
+                        compression = "0"
+                    else:
+                        tool_output = "/dev/stdout"
+                        compression = "0"
+
+                    if self.backend == "picard":
+                        queries[tool_name] = self.create_picard_arguments(
+                            current_file, tool_name, sort_order, tool_input, tool_output,
+                            compression)
+                        tool_input = tool_output
+                    else:
+                        label, query = self.create_samtools_query(
+                            current_file, tool_name, sort_order, tool_input, tool_output,
+                            compression, last_group and last_tool, tool_threads)
+                        queries[label] = query
+                        tool_input = "/dev/stdin"
+
+                if self.backend == "picard":
+                    stages.append(queries)
+                else:
+                    self.run_pipe(log_name, queries)
+                input_file = output_file
+
+            if self.backend == "picard":
+                self.picard_runner.run(stages,
+                                       f"{self.output_dir}/tool_logs/preprocessing/{log_name}")
+            else:
+                self.convert_markdup_stats(current_file)
+        finally:
+            # Also when a tool failed, so a rerun does not find the named pipes already there
+            for temporary_file in temporary_files:
+                if os.path.lexists(temporary_file):
+                    os.remove(temporary_file)
+
+    def create_picard_arguments(self, current_file, tool_name, sort_order, input_file,
+                                output_file, compression):
+        """
+        Creates the arguments for one of the Picard tools of the processing steps.
+
+        :param current_file: The file all the processes are run on
+        :param tool_name: The name of the Picard tool (SortSam or one of PICARD_STEPS)
+        :param sort_order: The sort order SortSam needs to sort to (None for other tools)
+        :param input_file: The file (or named pipe) the tool needs to read from
+        :param output_file: The file (or named pipe) the tool needs to write to
+        :param compression: The compression level of the output
+        :return: The arguments in the form of a list
+        """
+        arguments = ["-INPUT", input_file, "-OUTPUT", output_file,
+                     "-COMPRESSION_LEVEL", compression]
+        if tool_name == "SortSam":
+            arguments += ["-SORT_ORDER", sort_order]
+        elif tool_name == "MarkDuplicates":
+            arguments += ["-METRICS_FILE",
+                          f"{self.working_dir}/markDuplicates/{current_file}.metrics.log"]
+        return arguments
+
+    def create_samtools_query(self, current_file, tool_name, sort_order, input_file, output_file,
+                              compression, final_step, threads):
+        """
+        Creates the query for one of the samtools tools of the processing steps.
+        A sort to queryname in between steps is done with samtools collate, which only groups
+        the reads of a pair together and is a lot faster than a full sort.
+        The -@ option of samtools sets the threads the tool uses next to its main thread.
+
+        :param current_file: The file all the processes are run on
+        :param tool_name: The name of the samtools tool (sort or one of SAMTOOLS_STEPS)
+        :param sort_order: The sort order sort needs to sort to (None for other tools)
+        :param input_file: The file (or /dev/stdin) the tool needs to read from
+        :param output_file: The file (or /dev/stdout) the tool needs to write to
+        :param compression: The compression level of the output
+        :param final_step: If this is the last step, creating the final file
+        :param threads: The amount of threads the tool may use, including its main thread
+        :return: The name of the step used for the log file and the query in the form of a list
+        """
+        input_file = "-" if input_file == "/dev/stdin" else input_file
+        output_file = "-" if output_file == "/dev/stdout" else output_file
+        options = ["-@", str(threads - 1), "--output-fmt", f"bam,level={compression}"]
+
+        if tool_name == "sort" and sort_order == "queryname" and not final_step:
+            label = "SamtoolsCollate"
+            output_option = ["-O"] if output_file == "-" else ["-o", output_file]
+            query = ["samtools", "collate", *options, *output_option, input_file]
+        elif tool_name == "sort":
+            label = f"SamtoolsSort{sort_order.capitalize()}"
+            name_option = ["-n"] if sort_order == "queryname" else []
+            query = ["samtools", "sort", *name_option, *options, "-o", output_file, input_file]
+        elif tool_name == "fixmate":
+            label = "SamtoolsFixmate"
+            query = ["samtools", "fixmate", "-m", *options, input_file, output_file]
+        else:
+            label = "SamtoolsMarkdup"
+            query = ["samtools", "markdup", *options, "-f",
+                     f"{self.working_dir}/markDuplicates/{current_file}.markdup.stats",
+                     input_file, output_file]
+        return label, query
+
+    def convert_markdup_stats(self, current_file):
+        """
+        Converts the statistics of samtools markdup into the format of the Picard
+        duplication metrics, so MultiQC reports them the same way for both backends.
+        samtools counts reads where Picard counts pairs, so the pair counts are halved.
+
+        :param current_file: The file all the processes are run on
+        """
+        metrics_dir = f"{self.working_dir}/markDuplicates"
+        stats = dict()
+        with open(f"{metrics_dir}/{current_file}.markdup.stats") as opened_stats:
+            for line in opened_stats:
+                key, _, value = line.partition(":")
+                stats[key.strip()] = value.strip()
+
+        unpaired = int(stats.get("SINGLE", 0))
+        pairs = int(stats.get("PAIRED", 0)) // 2
+        unpaired_dupes = int(stats.get("DUPLICATE SINGLE", 0))
+        pair_dupes = int(stats.get("DUPLICATE PAIR", 0)) // 2
+        examined = unpaired + 2 * pairs
+        percentage = (unpaired_dupes + 2 * pair_dupes) / examined if examined else 0
+
+        values = [current_file, unpaired, pairs, 0, int(stats.get("EXCLUDED", 0)),
+                  unpaired_dupes, pair_dupes, int(stats.get("DUPLICATE PAIR OPTICAL", 0)) // 2,
+                  f"{percentage:.6f}", stats.get("ESTIMATED_LIBRARY_SIZE", "")]
+        with open(f"{metrics_dir}/{current_file}.metrics.log", "w") as opened_metrics:
+            opened_metrics.write(f"## htsjdk.samtools.metrics.StringHeader\n"
+                                 f"# picard.sam.markduplicates.MarkDuplicates "
+                                 f"INPUT=[{self.working_dir}/aligned/{current_file}.bam] "
+                                 f"(converted from samtools markdup)\n\n"
+                                 f"## METRICS CLASS\tpicard.sam.DuplicationMetrics\n")
+            opened_metrics.write("\t".join(DUPLICATION_METRICS) + "\n")
+            opened_metrics.write("\t".join(str(value) for value in values) + "\n\n")
+
+    def benchmark_backends(self, current_file):
+        """
+        Processes the same file with both backends and reports how long each of them took.
+        The final files are kept next to each other with the backend in their name.
+
+        :param current_file: The aligned file (without extension) to benchmark the backends on
+        :return: A dictionary with the backends as keys and the seconds they took as values
+        """
+        log_name = current_file.replace("_aligned", "")
+        final_file = f"{self.working_dir}/markDuplicates/{current_file}_sorted.bam"
+        original_backend = self.backend
+
+        timings = dict()
+        for benchmarked_backend in BACKEND_STEPS:
+            self.backend = benchmarked_backend
+            start_time = time.time()
+            self.stream_file(current_file)
+            timings[benchmarked_backend] = time.time() - start_time
+            os.replace(final_file, final_file.replace(".bam", f".{benchmarked_backend}.bam"))
+        self.backend = original_backend
+
+        with open(f"{self.output_dir}/tool_logs/preprocessing/{log_name}_benchmark.log",
+                  "w") as opened_log_file:
+            for name, seconds in timings.items():
+                result = f"{name} backend ({self.threads} threads): {seconds:.1f} seconds"
+                print(f"\t[{log_name}]\t{result}")
+                opened_log_file.write(result + "\n")
+        return timings
+
+    @staticmethod
+    def read_sort_order(bam_file):
+        """
+        Reads the sort order of a bam file from its header.
+
+        :param bam_file: The bam file to read the sort order of
+        :return: The sort order (queryname, coordinate, unsorted or unknown)
+        """
+        header = run(["samtools", "view", "-H", bam_file], capture_output=True, text=True).stdout
+        for line in header.splitlines():
+            if line.startswith("@HD"):
+                for field in line.split("\t")[1:]:
+                    if field.startswith("SO:"):
+                        return field[3:]
+        return "unsorted"
+
+    @staticmethod
+    def plan_steps(sort_order, steps, final_order=REQUIRED_SORT_ORDER["featureCounts"],
+                   sort_tool="SortSam"):
+        """
+        Plans the processing steps, a sort step is only added in front of a step
+        if it needs another sort order than the reads have at that point.
+        The steps themselves keep the sort order of their input.
+
+        :param sort_order: The sort order of the reads before the first step
+        :param steps: The names of the steps that need to be performed in order
+        :param final_order: The sort order the final file needs to have (None for any order)
+        :param sort_tool: The name of the tool that sorts the reads
+        :return: A list with tuples of the tool name and the sort order the sort tool needs to
+                 sort to (None for the other tools)
+        """
+        plan = list()
+        for step in [*steps, None]:
+            required = REQUIRED_SORT_ORDER.get(step) if step is not None else final_order
+            if required is not None and required != sort_order:
+                plan.append((sort_tool, required))
+                sort_order = required
+            if step is not None:
+                plan.append((step, None))
+        return plan
+
+    def process_file_with_intermediates(self, current_file):
         """
         This method takes a file and performs multiple steps creating output files per step.
         These output files will be saved in the output directory under Preprocessing.
@@ -64,43 +367,38 @@ class BamProcessing:
 
         :param current_file: The file all the processes need to be run on
         """
-        call_picard = ["java", "-jar", "lib/Picard_2.23.9/picard.jar"]
         log_name = current_file.replace("_aligned", "")
 
         # run Picard SortSam (creates sorted bam alignment)
-        sort_sam = [*call_picard, "SortSam",
-                    "-I", f"{self.working_dir}/aligned/{current_file}.bam",
+        sort_sam = ["-I", f"{self.working_dir}/aligned/{current_file}.bam",
                     "-O", f"{self.working_dir}/sortedBam/{current_file}.bam",
                     "-SO", "queryname"]
-        self.run_tool(log_name, "SortSam", sort_sam)
 
         # run Picard AddOrReplaceReadGroups (processed bam alignment)
-        read_groups = [*call_picard, "AddOrReplaceReadGroups",
-                       "-I", f"{self.working_dir}/sortedBam/{current_file}.bam",
+        read_groups = ["-I", f"{self.working_dir}/sortedBam/{current_file}.bam",
                        "-O", f"{self.working_dir}/addOrReplace/{current_file}.bam",
                        "-LB", current_file, "-PU", current_file, "-SM", current_file,
                        "-PL", "illumina", "-CREATE_INDEX", "true"]
-        self.run_tool(log_name, "AddOrReplaceReadGroups", read_groups)
 
         # run Picard FixMateInformation
-        fix_mate_info = [*call_picard, "FixMateInformation",
-                         "-INPUT", f"{self.working_dir}/addOrReplace/{current_file}.bam"]
-        self.run_tool(log_name, "FixMateInformation", fix_mate_info)
+        fix_mate_info = ["-INPUT", f"{self.working_dir}/addOrReplace/{current_file}.bam"]
 
         # run Picard MergeSamFiles (merged bam alignment)
-        merge_sam = [*call_picard, "MergeSamFiles",
-                     "-INPUT", f"{self.working_dir}/addOrReplace/{current_file}.bam",
+        merge_sam = ["-INPUT", f"{self.working_dir}/addOrReplace/{current_file}.bam",
                      "-OUTPUT", f"{self.working_dir}/mergeSam/{current_file}.bam",
                      "-CREATE_INDEX", "true", "-USE_THREADING", "true"]
-        self.run_tool(log_name, "MergeSamFiles", merge_sam)
 
         # run Picard MarkDuplicates (created duplicates log)
-        mark_dupes = [*call_picard, "MarkDuplicates",
-                      "-INPUT", f"{self.working_dir}/mergeSam/{current_file}.bam",
+        mark_dupes = ["-INPUT", f"{self.working_dir}/mergeSam/{current_file}.bam",
                       "-OUTPUT", f"{self.working_dir}/markDuplicates/{current_file}.bam",
                       "-CREATE_INDEX", "true", "-METRICS_FILE",
                       f"{self.working_dir}/markDuplicates/{current_file}.metrics.log"]
-        self.run_tool(log_name, "MarkDuplicates", mark_dupes)
+
+        # All the Picard steps run one after the other inside of one JVM
+        stages = [{"SortSam": sort_sam}, {"AddOrReplaceReadGroups": read_groups},
+                  {"FixMateInformation": fix_mate_info}, {"MergeSamFiles": merge_sam},
+                  {"MarkDuplicates": mark_dupes}]
+        self.picard_runner.run(stages, f"{self.output_dir}/tool_logs/preprocessing/{log_name}")
 
         # run SamTools Sort (FINAL: Sorted bam alignment)
         final_sort = ["samtools", "sort",
@@ -125,13 +423,73 @@ class BamProcessing:
 
         gen_func.print_tool(log_name, "f", tool_name)
 
+    def run_pipe(self, log_name, queries):
+        """
+        This method runs multiple tools at the same time with the output of every tool
+        piped into the input of the next one. Every tool gets its own log file.
+
+        :param log_name: The name of the file without extensions and '_aligned'
+        :param queries: A dictionary with the tool names as keys and their queries as values
+        """
+        tool_names = "|".join(queries.keys())
+        gen_func.print_tool(log_name, "s", tool_names)
+
+        save_tool_dir = f"{self.output_dir}/tool_logs/preprocessing/{log_name}"
+        processes = list()
+        previous_output = None
+        for index, (tool_name, query) in enumerate(queries.items()):
+            last_tool = index == len(queries) - 1
+            with open(f"{save_tool_dir}_{tool_name}.log", "w") as opened_log_file:
+                process = Popen(query, stdin=previous_output,
+                                stdout=opened_log_file if last_tool else PIPE,
+                                stderr=opened_log_file)
+            if previous_output is not None:
+                previous_output.close()  # Only the next tool needs to read it
+            previous_output = process.stdout
+            processes.append(process)
+
+        for process in processes:
+            process.wait()
+
+        failed = [(tool_name, process.returncode) for tool_name, process
+                  in zip(queries.keys(), processes) if process.returncode != 0]
+        if failed:
+            failures = ", ".join(f"{tool_name} (exit code {exit_code})"
+                                 for tool_name, exit_code in failed)
+            raise RuntimeError(f"{failures} failed for {log_name}, "
+                               f"see {save_tool_dir}_{failed[0][0]}.log")
+        gen_func.print_tool(log_name, "f", tool_names)
+
 
 # MAIN
 def main():
-    """Main function calling forth all tasks"""
+    """
+    Main function calling forth all tasks.
+    With --benchmark both backends get benchmarked on one aligned file instead, e.g.
+    python3 -m lib.bam_processing -o output --benchmark S1_aligned --threads 8
+    """
+    parser = argparse.ArgumentParser(description="Processes the aligned bam files of a run")
+    parser.add_argument("-o", "--output_directory", required=False, default="../output",
+                        help="Output directory of the pipeline (Defaults to '../output')")
+    parser.add_argument("-c", "--cores", required=False, type=int, default=32,
+                        help="Number of cores to be used (Defaults to 32)")
+    parser.add_argument("--benchmark", required=False, metavar="ALIGNED_FILE",
+                        help="Name of an aligned file in Preprocessing/aligned (without "
+                             "extension) to process with both backends and time them")
+    parser.add_argument("--threads", required=False, type=int, default=1,
+                        help="Threads the samtools backend uses for the benchmarked file "
+                             "(Defaults to 1)")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        bam_pro = BamProcessing(args.output_directory)
+        bam_pro.threads = args.threads
+        bam_pro.benchmark_backends(args.benchmark)
+        return 0
+
     print("Processing bam files...")
-    bam_pro = BamProcessing("../output")
-    bam_pro.perform_preprocessing(32)
+    bam_pro = BamProcessing(args.output_directory)
+    bam_pro.perform_preprocessing(args.cores)
     print("Done processing all bam files")
     return 0
 
@@ -2,7 +2,17 @@
 
 """
 This python module runs the featureCounts tool to create a count matrix file.
-It requires the output directory and the amount of cores for multiprocessing
+It requires the output directory and the amount of cores for multiprocessing.
+The counts of every sample are cached by the name, size and modification time of its input
+files, the settings the pipeline processed it with and how it was aligned, so only samples that
+were not counted before are counted and the matrix is merged from the cache. The bam files
+themselves can not be used for this, their headers change between runs (hisat2 records its
+amount of threads for example).
+The samples are counted by multiple featureCounts processes at the same time,
+because the threads of a single featureCounts process do not scale beyond a few cores.
+Next to the text matrix the counts are saved as a NumPy array with the gene and sample names in
+index files, the CountMatrix class loads slices of genes or samples from it without reading
+the whole matrix.
 """
 
 
@@ -10,41 +20,305 @@ It requires the output directory and the amount of cores for multiprocessing
 __author__ = "Joost Numan and Vincent Talen"
 __status__ = "Development"
 __date__ = "29-01-2021"
-__version__ = "v0.4"
+__version__ = "v0.12"
 
 
 # IMPORTS
+import os
+import re
 import sys
 import glob
+import json
+import hashlib
+from pathlib import Path
 from subprocess import run
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import lib.general_functions as gen_func
+from lib.annotation_cache import prepare_annotation
+from lib.genome_registry import get_genome
+
+# The columns featureCounts writes before the counts of the samples
+ANNOTATION_COLUMNS = 6
+# Amount of threads a featureCounts process gets, more threads hardly make it any faster
+FEATURE_COUNTS_THREADS = 4
 
 
 # FUNCTIONS
-def run_feature_counts(cores, output_dir):
+def run_feature_counts(cores, output_dir, anno_file, samples, settings, alignments=None):
     """
-    This method runs the feature counts tool and captures the output
+    This method counts the samples that are not in the count cache yet with the feature counts
+    tool and merges the counts of all samples into one matrix and summary file.
 
     :param cores: The amount of cores the feature counts tool needs to use
     :param output_dir: The path of the output directory
+    :param anno_file: The SAF annotation file (see annotation_cache.prepare_annotation)
+    :param samples: A dictionary with the aligned names of the samples as keys and a list with
+                    their input file (or both input files of a pair) as values
+    :param settings: A dictionary with the settings that change the alignments of the samples
+    :param alignments: A dictionary with the aligned names of the samples as keys and how they
+                       were aligned (single, batch, chunks or streamed) as values
+    """
+    names = sorted(samples)
+    files = [f"{output_dir}/Preprocessing/markDuplicates/{name}_sorted.bam" for name in names]
+
+    # The counts depend on the annotation as well, every annotation has its own cache
+    cache_dir = f"{output_dir}/Data/count_cache/{Path(anno_file).stem}"
+    os.makedirs(cache_dir, exist_ok=True)
+    alignments = alignments or dict()
+    count_files = list()
+    for name in names:
+        sample_settings = {**settings, "annotation": Path(anno_file).stem,
+                           "alignment": alignments.get(name, "single")}
+        count_files.append(f"{cache_dir}/{get_count_key(samples[name], sample_settings)}.counts")
+    # Samples with the same input files only have to be counted once
+    to_count = {count_file: file for file, count_file in zip(files, count_files)
+                if not os.path.isfile(count_file)}
+
+    # The cores are divided over the featureCounts processes that run at the same time
+    processes, threads = calculate_processes(cores, len(to_count))
+    with ThreadPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(count_sample, file, count_file, anno_file, threads, output_dir)
+                   for count_file, file in to_count.items()]
+        for future in futures:
+            future.result()  # Raises the error of a failed count
+
+    genes, counts = merge_counts(count_files, files, f"{output_dir}/Data/counts/geneCounts.txt")
+    samples = [re.sub(r"(_aligned)?_sorted$", "", Path(file).stem) for file in files]
+    write_count_store(f"{output_dir}/Data/counts/geneCounts", genes, samples, counts)
+
+
+def calculate_processes(cores, samples):
+    """
+    Calculates how many featureCounts processes run at the same time and how many threads
+    every process gets, every process gets about FEATURE_COUNTS_THREADS threads.
+
+    :param cores: The amount of cores that may be used
+    :param samples: The amount of samples that need to be counted
+    :return: The amount of processes and the amount of threads per process
+    """
+    processes = max(min(cores // FEATURE_COUNTS_THREADS, samples), 1)
+    return processes, max(cores // processes, 1)
+
+
+def count_sample(bam_file, count_file, anno_file, threads, output_dir):
+    """
+    Counts the reads of a single sample with the feature counts tool and saves the counts
+    (and the summary next to it) in the count cache.
+
+    :param bam_file: The sorted bam file of the sample
+    :param count_file: The file in the count cache the counts need to be saved in
+    :param anno_file: The SAF annotation file
+    :param threads: The amount of threads the feature counts tool may use
+    :param output_dir: The path of the output directory
     """
     feature_count_loc = "lib/Subread-2.0.1/bin/featureCounts"
-    anno_file = f"{output_dir}/Data/genome/Homo_sapiens.GRCh38.84.gtf"
-    files = glob.glob(f"{output_dir}/Preprocessing/markDuplicates/*_sorted.bam")
+    sample_name = Path(bam_file).stem
+    gen_func.print_tool(sample_name, "s", "counting process")
 
-    query = [feature_count_loc, "-a", anno_file, "-T", str(cores),
-             "-o", f"{output_dir}/Data/counts/geneCounts.txt", *files]
+    # Written to a temporary file first, so a failed count never ends up in the cache
+    temporary_file = f"{count_file}.{os.getpid()}.tmp"
+    query = [feature_count_loc, "-a", anno_file, "-F", "SAF", "-T", str(threads),
+             "-o", temporary_file, bam_file]
     executed_process = run(query, capture_output=True, text=True)
 
     # Save all logs from stdout and stderr to a logfile
-    log_dir = f"{output_dir}/tool_logs"
-    gen_func.save_tool_log(executed_process, f"{log_dir}/feature_counts.log")
+    log_dir = f"{output_dir}/tool_logs/feature_counts"
+    gen_func.save_tool_log(executed_process, f"{log_dir}/{sample_name}.log")
+    if executed_process.returncode != 0:
+        raise RuntimeError(f"featureCounts failed for {bam_file}")
+
+    os.replace(f"{temporary_file}.summary", f"{count_file}.summary")
+    os.replace(temporary_file, count_file)
+    gen_func.print_tool(sample_name, "f", "counting process")
+
+
+def get_count_key(input_files, settings):
+    """
+    Gets the name the counts of a sample are cached under, which is a checksum of the name,
+    size and modification time of its input files (the same signature FilePairer uses,
+    the files themselves are never read) and the settings it was processed with.
+
+    :param input_files: The input file (or both input files of a pair) of the sample
+    :param settings: A dictionary with the settings that change the alignments of the sample
+    :return: The key of the counts of the sample
+    """
+    inputs = list()
+    for file in input_files:
+        file_stat = os.stat(file)
+        inputs.append([Path(file).name, file_stat.st_size, file_stat.st_mtime_ns])
+    key = {"inputs": inputs, "settings": settings}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def read_counts(count_file):
+    """
+    Reads a count file (and the summary next to it) of feature counts.
+
+    :param count_file: The count file written by feature counts
+    :return: program: The first line with the program and command
+             annotation: A list with the annotation columns of every gene as a string
+             counts: A NumPy array with the counts, a column per sample
+             summary_statuses: A list with the statuses of the summary
+             summary_counts: A NumPy array with the summary counts, a column per sample
+    """
+    with open(count_file) as opened_counts:
+        program = opened_counts.readline().rstrip("\n")
+        opened_counts.readline()  # The column names
+        annotation, counts = list(), list()
+        for line in opened_counts:
+            columns = line.rstrip("\n").split("\t")
+            annotation.append("\t".join(columns[:ANNOTATION_COLUMNS]))
+            counts.append(columns[ANNOTATION_COLUMNS:])
+
+    with open(f"{count_file}.summary") as opened_summary:
+        opened_summary.readline()  # The column names
+        summary_statuses, summary_counts = list(), list()
+        for line in opened_summary:
+            columns = line.rstrip("\n").split("\t")
+            summary_statuses.append(columns[0])
+            summary_counts.append(columns[1:])
+    return (program, annotation, np.array(counts, dtype=np.int64).reshape(len(annotation), -1),
+            summary_statuses, np.array(summary_counts, dtype=np.int64))
+
+
+def merge_counts(count_files, samples, output_file):
+    """
+    Merges the count files of the samples into one count matrix and summary file,
+    in the same format as feature counts writes them when it counts all samples at once.
+
+    :param count_files: The count files (with a summary file next to them) of the samples
+    :param samples: The names of the samples, in the same order as the count files
+    :param output_file: The file the merged counts need to be written to
+    :return: genes: A list with the ids of the genes
+             counts: A NumPy array with the counts, a row per gene and a column per sample
+    """
+    program, annotation, statuses = None, None, None
+    counts, summary_counts = list(), list()
+    for count_file in count_files:
+        file_program, file_annotation, file_counts, file_statuses, file_summary = \
+            read_counts(count_file)
+        if annotation is None:
+            program, annotation, statuses = file_program, file_annotation, file_statuses
+        elif file_annotation != annotation:
+            raise ValueError(f"{count_file} was counted with a different annotation")
+        counts.append(file_counts)
+        summary_counts.append(file_summary)
+
+    if annotation is None:
+        raise ValueError("There are no counts to merge")
+    counts = np.hstack(counts)
+    summary_counts = np.hstack(summary_counts)
+
+    with open(output_file, "w") as opened_output:
+        opened_output.write(f"{program}\n")
+        opened_output.write("\t".join(["Geneid", "Chr", "Start", "End", "Strand", "Length",
+                                       *samples]) + "\n")
+        for gene_annotation, gene_counts in zip(annotation, counts):
+            opened_output.write(f"{gene_annotation}\t{join_counts(gene_counts)}\n")
+
+    with open(f"{output_file}.summary", "w") as opened_summary:
+        opened_summary.write("\t".join(["Status", *samples]) + "\n")
+        for status, status_counts in zip(statuses, summary_counts):
+            opened_summary.write(f"{status}\t{join_counts(status_counts)}\n")
+    return [gene_annotation.split("\t", 1)[0] for gene_annotation in annotation], counts
+
+
+def write_count_store(prefix, genes, samples, counts):
+    """
+    Saves the counts as a NumPy array ({prefix}.npy) that can be memory-mapped, with the names
+    of the genes and samples in {prefix}.genes.txt and {prefix}.samples.txt.
+    The counts of a sample are stored next to each other (column-major),
+    so a sample is read in one piece and a gene needs one small read per sample.
+
+    :param prefix: The name of the files without the extensions (with directories)
+    :param genes: A list with the ids of the genes
+    :param samples: A list with the names of the samples
+    :param counts: A NumPy array with the counts, a row per gene and a column per sample
+    """
+    dtype = np.uint32 if counts.max(initial=0) <= np.iinfo(np.uint32).max else np.int64
+    # Written to temporary files first, so a loader never reads a half written matrix
+    temporary_file = f"{prefix}.{os.getpid()}.tmp.npy"
+    store = np.lib.format.open_memmap(temporary_file, mode="w+", dtype=dtype,
+                                      shape=counts.shape, fortran_order=True)
+    store[:] = counts
+    store.flush()
+    del store
+
+    for names, extension in [(genes, "genes"), (samples, "samples")]:
+        with open(f"{prefix}.{extension}.txt.tmp", "w") as opened_index:
+            opened_index.writelines(f"{name}\n" for name in names)
+        os.replace(f"{prefix}.{extension}.txt.tmp", f"{prefix}.{extension}.txt")
+    os.replace(temporary_file, f"{prefix}.npy")
+
+
+def join_counts(counts):
+    """
+    Joins the counts of a row with tabs.
+
+    :param counts: A NumPy array with the counts
+    :return: The counts as a tab separated string
+    """
+    return "\t".join(map(str, counts.tolist()))
+
+
+class CountMatrix:
+    """
+    Class to load slices of the count matrix written by write_count_store.
+    The matrix is memory-mapped, only the parts of it that are used are read from disk.
+    """
+    def __init__(self, prefix):
+        """
+        Constructor for the CountMatrix class
+
+        :param prefix: The name of the files without the extensions (with directories),
+                       for example {output_dir}/Data/counts/geneCounts
+        """
+        self.counts = np.load(f"{prefix}.npy", mmap_mode="r")
+        with open(f"{prefix}.genes.txt") as opened_genes:
+            self.genes = opened_genes.read().splitlines()
+        with open(f"{prefix}.samples.txt") as opened_samples:
+            self.samples = opened_samples.read().splitlines()
+        # The index files are replaced before the matrix, a loader can see a mix of two writes
+        if self.counts.shape != (len(self.genes), len(self.samples)):
+            raise ValueError(f"The count matrix {prefix}.npy has shape {self.counts.shape}, but "
+                             f"there are {len(self.genes)} genes and {len(self.samples)} samples")
+        self.gene_index = {gene: number for number, gene in enumerate(self.genes)}
+        self.sample_index = {sample: number for number, sample in enumerate(self.samples)}
+
+    def get_genes(self, genes, samples=None):
+        """
+        Gets the counts of some genes.
+
+        :param genes: A list with the ids of the genes
+        :param samples: A list with the names of the samples (None for all samples)
+        :return: A NumPy array with a row per gene and a column per sample
+        """
+        rows = [self.gene_index[gene] for gene in genes]
+        if samples is None:
+            return np.asarray(self.counts[rows, :])
+        return np.asarray(self.counts[np.ix_(rows, [self.sample_index[sample]
+                                                    for sample in samples])])
+
+    def get_samples(self, samples):
+        """
+        Gets the counts of all genes of some samples.
+
+        :param samples: A list with the names of the samples
+        :return: A NumPy array with a row per gene and a column per sample
+        """
+        return np.asarray(self.counts[:, [self.sample_index[sample] for sample in samples]])
 
 
 # MAIN
 def main():
     """Main function calling forth all tasks"""
-    run_feature_counts(32, "../../../students/2020-2021/Thema06/groepje3/temp")
+    input_dir = "../../../students/2020-2021/Thema06/RawFiles/"
+    output_dir = "../../../students/2020-2021/Thema06/groepje3/temp"
+    samples = {f"{Path(Path(file).stem).stem}_aligned": [file]
+               for file in glob.glob(f"{input_dir}*fastq.gz")}
+    run_feature_counts(32, output_dir, prepare_annotation(output_dir, get_genome("human")),
+                       samples, dict())
     return 0
 
 
@@ -10,7 +10,7 @@ There are directories for preprocessing, data and results.
 __author__ = "Vincent Talen and Joost Numan"
 __status__ = "Development"
 __date__ = "29-01-2021"
-__version__ = "v0.3.6"
+__version__ = "v0.7"
 
 # IMPORTS
 import os
@@ -33,43 +33,43 @@ class CreateDirs:
             os.makedirs(output_dir)
         self.output_dir = output_dir
 
-        self.download_genome = self.check_empty()
+        self.keep_genome = self.check_empty()
 
     def check_empty(self):
         """
-        Checks if there already files in the genome directory and if there are ask the user
-        if they want to download them again.
-
-        :return: download_genome; Returns True by default or False if files have been found
-                                  and user wants to use the existing ones
+        Checks if there already are files in the output directory and if there are ask the user
+        if they want to delete them. The genome files live in the reference cache,
+        so only the link to it gets removed, but the user is asked if the cached genome files
+        can be kept or need to be downloaded again. The count cache is kept so samples that
+        were counted before do not have to be counted again.
+
+        :return: keep_genome; Returns True by default or False if genome files have been found
+                              and the user wants to download them again
         """
+        keep_genome = True
         if len(os.listdir(self.output_dir)) > 0:
             choice = input("\tThe output directory is not empty, do you want to proceed and "
                            "delete everything from it?\n\t[Y/N]: ").upper()
             if choice == "Y":
+                genome_dir = f"{self.output_dir}/Data/genome"
+                if os.path.isdir(genome_dir) and len(os.listdir(genome_dir)) > 0:
+                    choice = input("\tIt appears you still have some genome reference files, "
+                                   "do you want to keep the existing ones?\n\t"
+                                   "(They are shared with other runs through the reference "
+                                   "cache, if you choose N they are downloaded again)\n\t"
+                                   "[Y/N]: ").upper()
+                    keep_genome = choice == "Y"
+
                 remove_dirs = ["Preprocessing", "Results", "tool_logs",
-                               "Data/fastqFiles", "Data/counts"]
+                               "Data/fastqFiles", "Data/counts", "Data/genome"]
                 for directory in remove_dirs:
-                    if os.path.exists(f"{self.output_dir}/{directory}"):
+                    if os.path.lexists(f"{self.output_dir}/{directory}"):
                         run(["rm", "-r", f"{self.output_dir}/{directory}"])
-
-                if len(os.listdir(f"{self.output_dir}/Data/genome")) > 0:
-                    choice = input("\tIt appears you still have some genome reference files, "
-                                   "do you want to keep the existing ones?\n\t"
-                                   "(If you don't want to download them (again) make sure that the "
-                                   "pipeline has been run before and you have not changed anything "
-                                   "in the Data/genome directory.\n\t[Y/N]: ").upper()
-                    if choice == "Y":
-                        print()
-                        return False
-                    else:
-                        run(["rm", "-r", f"{self.output_dir}/Data/genome"])
-                        print()
-                        return True
+                print()
             else:
                 sys.exit("You chose not to empty the given output directory "
                          "so the pipeline has been terminated")
-        return True
+        return keep_genome
 
     def create_dir_dict(self):
         """
@@ -80,11 +80,9 @@ class CreateDirs:
         """
         preprocessing_dirs = ["trimmed", "aligned", "sortedBam", "addOrReplace",
                               "mergeSam", "markDuplicates"]
-        result_dirs = ["fastQC", "multiQC"]
-        data_dirs = ["counts"]
-        if not os.path.isdir(f"{self.output_dir}/Data/genome"):
-            data_dirs.append("genome")
-        log_dirs = ["preprocessing", "genome_download", "qualitycheck"]
+        result_dirs = ["fastQC", "fastQC_trimmed", "multiQC"]
+        data_dirs = ["counts", "count_cache"]
+        log_dirs = ["preprocessing", "genome_download", "qualitycheck", "feature_counts"]
 
         dir_dict = {"Preprocessing": preprocessing_dirs, "Results": result_dirs,
                     "Data": data_dirs, "tool_logs": log_dirs}
@@ -95,8 +93,8 @@ class CreateDirs:
         dir_dict = self.create_dir_dict()
         for main_dir, sub_dirs in dir_dict.items():
             for sub_dir in sub_dirs:
-                os.makedirs(f"{self.output_dir}/{main_dir}/{sub_dir}")
-        return self.download_genome
+                os.makedirs(f"{self.output_dir}/{main_dir}/{sub_dir}", exist_ok=True)
+        return self.keep_genome
 
 
 # MAIN
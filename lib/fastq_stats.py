@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+
+"""
+This module contains a quality check engine that is a fast alternative to FastQC.
+A gzipped fastq file is read once in large blocks and the statistics of all the reads
+in a block are collected at once with NumPy: the quality per position, the sequence content
+per position, the GC content, the length distribution and the N content.
+Overrepresented sequences are counted with the Space-Saving algorithm, which only keeps
+a fixed amount of sequences in memory.
+The results are written as a fastqc_data.txt file so MultiQC reads them as FastQC results.
+Every file is checked by its own task, so the files are divided over the cores.
+"""
+
+# METADATA VARIABLES
+__author__ = "Vincent Talen"
+__status__ = "Development"
+__date__ = "17-10-2026"
+__version__ = "v0.2"
+
+# IMPORTS
+import os
+import sys
+from pathlib import Path
+import numpy as np
+from lib.hard_clipper import read_fastq_blocks, NEWLINE
+
+# Smaller blocks than the clipper, every base gets multiple arrays with statistics
+BLOCK_SIZE = 4 * 1024 ** 2
+PHRED_OFFSET = 33
+MAX_QUALITY = 94
+# Amount of sequences the Space-Saving algorithm keeps track of and the bases they are made of
+MAX_TRACKED_SEQUENCES = 10000
+TRACKED_BASES = 50
+# Code of every base in the base counts (order A, C, G, T, N), every other character counts as N
+BASE_CODES = np.full(256, 4, dtype=np.int64)
+for code, base in enumerate(b"ACGT"):
+    BASE_CODES[base] = code
+    BASE_CODES[ord(chr(base).lower())] = code
+
+
+class FastqStats:
+    """
+    Class collecting the quality statistics of a fastq file.
+    """
+    def __init__(self, file):
+        """
+        Constructor for the FastqStats class
+
+        :param file: The gzipped fastq file the statistics are collected of
+        """
+        self.file = file
+        self.reads = 0
+        self.quality_counts = np.zeros((0, MAX_QUALITY), dtype=np.int64)
+        self.base_counts = np.zeros((0, 5), dtype=np.int64)
+        self.mean_quality_counts = np.zeros(MAX_QUALITY, dtype=np.int64)
+        self.gc_counts = np.zeros(101, dtype=np.int64)
+        self.length_counts = np.zeros(0, dtype=np.int64)
+        self.sequences = np.zeros(0, dtype=f"S{TRACKED_BASES}")
+        self.sequence_counts = np.zeros(0, dtype=np.int64)
+
+    def collect(self, max_reads=None, sampling="head"):
+        """
+        Reads the file and collects the statistics of all its reads or of a sample of the reads.
+
+        :param max_reads: The amount of reads to sample (None to use all the reads)
+        :param sampling: 'head' to use the first reads of the file (only reads the start of it)
+                         or 'reservoir' to use a random sample of all the reads of the file
+        :return: The FastqStats itself
+        """
+        if max_reads is not None and sampling == "reservoir":
+            return self._collect_reservoir(max_reads)
+
+        for data, line_ends in read_fastq_blocks(self.file, BLOCK_SIZE):
+            if max_reads is not None:
+                line_ends = line_ends[:(max_reads - self.reads) * 4]
+                data = data[:line_ends[-1] + 1]
+            self.add_block(data, line_ends)
+            if max_reads is not None and self.reads >= max_reads:
+                break
+        return self
+
+    def _collect_reservoir(self, max_reads, seed=0):
+        """
+        Collects the statistics of a random sample of the reads while streaming the whole file.
+        Every read gets a random key and the reads with the lowest keys are kept,
+        which gives every read the same chance to be in the sample (bottom-k sampling).
+        Only reads with a key lower than the highest key in the sample have to be looked at.
+
+        :param max_reads: The amount of reads to sample
+        :param seed: The seed of the random generator, so a preview can be repeated
+        :return: The FastqStats itself
+        """
+        generator = np.random.default_rng(seed)
+        sample_keys = np.zeros(0)
+        sample_records = np.zeros(0, dtype=object)
+        for data, line_ends in read_fastq_blocks(self.file, BLOCK_SIZE):
+            record_ends = line_ends[3::4] + 1
+            record_starts = np.concatenate(([0], record_ends[:-1]))
+            keys = generator.random(len(record_ends))
+            if len(sample_keys) == max_reads:
+                candidates = np.flatnonzero(keys < sample_keys.max())
+            else:
+                candidates = np.arange(len(keys))
+
+            records = np.array([data[record_starts[index]:record_ends[index]].tobytes()
+                                for index in candidates], dtype=object)
+            sample_keys = np.concatenate((sample_keys, keys[candidates]))
+            sample_records = np.concatenate((sample_records, records))
+            if len(sample_keys) > max_reads:
+                keep = np.argpartition(sample_keys, max_reads)[:max_reads]
+                sample_keys, sample_records = sample_keys[keep], sample_records[keep]
+
+        if len(sample_records):
+            data = np.frombuffer(b"".join(sample_records), dtype=np.uint8)
+            self.add_block(data, np.flatnonzero(data == NEWLINE))
+        return self
+
+    def summarize(self):
+        """
+        Summarizes the statistics into the basic statistics and the status of every module.
+
+        :return: A dictionary with the names of the statistics and modules as keys
+        """
+        sections = self.create_sections()
+        summary = dict()
+        for line in sections[0][2][1:]:
+            measure, value = line.split("\t")
+            summary[measure] = value
+        summary.update((module, status) for module, status, _ in sections[1:])
+        return summary
+
+    def add_block(self, data, line_ends):
+        """
+        Adds the statistics of all the records in a block.
+        Every base gets the number of its read and its position in the read,
+        which are used to count everything per read and per position with bincount.
+
+        :param data: A NumPy array with the bytes of complete fastq records
+        :param line_ends: The positions of all the newlines in the data
+        """
+        line_starts = np.concatenate(([0], line_ends[:-1] + 1)).reshape(-1, 4)
+        line_ends = line_ends.reshape(-1, 4)
+        sequence_starts, quality_starts = line_starts[:, 1], line_starts[:, 3]
+        lengths = line_ends[:, 1] - sequence_starts
+        reads = len(lengths)
+        max_length = int(lengths.max(initial=0))
+        self._grow(max_length)
+
+        read_numbers = np.repeat(np.arange(reads), lengths)
+        positions = np.arange(len(read_numbers)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        bases = BASE_CODES[data[sequence_starts[read_numbers] + positions]]
+        qualities = np.clip(data[quality_starts[read_numbers] + positions].astype(np.int64)
+                            - PHRED_OFFSET, 0, MAX_QUALITY - 1)
+
+        self.quality_counts[:max_length] += np.bincount(
+            positions * MAX_QUALITY + qualities,
+            minlength=max_length * MAX_QUALITY).reshape(max_length, MAX_QUALITY)
+        self.base_counts[:max_length] += np.bincount(
+            positions * 5 + bases, minlength=max_length * 5).reshape(max_length, 5)
+        self.length_counts[:max_length + 1] += np.bincount(lengths, minlength=max_length + 1)
+
+        # Statistics per read, reads without bases do not have a quality or GC content
+        has_bases = lengths > 0
+        quality_sums = np.bincount(read_numbers, weights=qualities, minlength=reads)
+        mean_qualities = np.round(quality_sums[has_bases] / lengths[has_bases]).astype(np.int64)
+        self.mean_quality_counts += np.bincount(mean_qualities, minlength=MAX_QUALITY)
+        gc_bases = np.bincount(read_numbers, weights=(bases == 1) | (bases == 2), minlength=reads)
+        gc_percentages = np.round(gc_bases[has_bases] * 100 / lengths[has_bases]).astype(np.int64)
+        self.gc_counts += np.bincount(gc_percentages, minlength=101)
+
+        # The start of every read as a fixed width string for the overrepresented sequences
+        columns = np.arange(TRACKED_BASES)
+        indexes = np.minimum(sequence_starts[has_bases, None] + columns, len(data) - 1)
+        starts = np.where(columns < lengths[has_bases, None], data[indexes], 0).astype(np.uint8)
+        self._count_sequences(np.ascontiguousarray(starts).view(f"S{TRACKED_BASES}").ravel())
+        self.reads += reads
+
+    def _grow(self, max_length):
+        """
+        Makes the arrays with statistics per position long enough for the longest read.
+
+        :param max_length: The length of the longest read of a block
+        """
+        extra = max_length - len(self.quality_counts)
+        if extra > 0:
+            self.quality_counts = np.vstack((self.quality_counts,
+                                             np.zeros((extra, MAX_QUALITY), dtype=np.int64)))
+            self.base_counts = np.vstack((self.base_counts, np.zeros((extra, 5), dtype=np.int64)))
+        extra = max_length + 1 - len(self.length_counts)
+        if extra > 0:
+            self.length_counts = np.concatenate((self.length_counts,
+                                                 np.zeros(extra, dtype=np.int64)))
+
+    def _count_sequences(self, sequences):
+        """
+        Counts the sequences with the Space-Saving algorithm. The counts of a block are
+        merged with the tracked counts and only the most frequent sequences are kept.
+        A sequence that was not tracked yet gets the lowest tracked count on top of its count,
+        so a count is never lower than the real count and at most that much higher.
+
+        :param sequences: A NumPy array with the starts of the reads of a block
+        """
+        items, counts = np.unique(sequences, return_counts=True)
+        if len(self.sequences):
+            tracked_minimum = 0
+            if len(self.sequences) >= MAX_TRACKED_SEQUENCES:
+                tracked_minimum = self.sequence_counts.min()
+            items, inverse = np.unique(np.concatenate((self.sequences, items)),
+                                       return_inverse=True)
+            counts = np.bincount(inverse, weights=np.concatenate((self.sequence_counts, counts)),
+                                 minlength=len(items)).astype(np.int64)
+            untracked = np.ones(len(items), dtype=bool)
+            untracked[inverse[:len(self.sequences)]] = False
+            counts[untracked] += tracked_minimum
+
+        if len(items) > MAX_TRACKED_SEQUENCES:
+            keep = np.argpartition(-counts, MAX_TRACKED_SEQUENCES)[:MAX_TRACKED_SEQUENCES]
+            items, counts = items[keep], counts[keep]
+        self.sequences, self.sequence_counts = items, counts
+
+    def calculate_quality_percentiles(self, percentiles):
+        """
+        Calculates percentiles of the quality of every position from the quality counts.
+
+        :param percentiles: The wanted percentiles as fractions (for example 0.5 for the median)
+        :return: A list with a NumPy array with the values per position for every percentile
+        """
+        cumulative = np.cumsum(self.quality_counts, axis=1)
+        totals = cumulative[:, -1:]
+        return [np.argmax(cumulative >= np.maximum(totals * percentile, 1), axis=1)
+                for percentile in percentiles]
+
+    def create_sections(self):
+        """
+        Creates the modules of the FastQC report from the statistics,
+        every module is graded with the same limits FastQC uses.
+
+        :return: A list with a tuple of the name, status and lines of every module
+        """
+        file_name = Path(self.file).name
+        positions = np.arange(1, len(self.quality_counts) + 1)
+        called = np.maximum(self.quality_counts.sum(axis=1), 1)
+        mean_quality = (self.quality_counts * np.arange(MAX_QUALITY)).sum(axis=1) / called
+        tenth, lower, median, upper, ninetieth = self.calculate_quality_percentiles(
+            [0.1, 0.25, 0.5, 0.75, 0.9])
+        acgt = np.maximum(self.base_counts[:, :4].sum(axis=1, keepdims=True), 1)
+        base_percentages = self.base_counts[:, :4] * 100 / acgt
+        n_percentages = self.base_counts[:, 4] * 100 / called
+        lengths = np.flatnonzero(self.length_counts)
+        total_bases = self.base_counts.sum()
+        gc_percentage = self.base_counts[:, 1:3].sum() * 100 / max(total_bases, 1)
+
+        lowest_lower, lowest_median = lower.min(initial=40), median.min(initial=40)
+        if lowest_lower < 5 or lowest_median < 20:
+            quality_status = "fail"
+        else:
+            quality_status = "warn" if lowest_lower < 10 or lowest_median < 25 else "pass"
+        most_frequent_quality = int(np.argmax(self.mean_quality_counts))
+        content_difference = max(
+            np.abs(base_percentages[:, 0] - base_percentages[:, 3]).max(initial=0),
+            np.abs(base_percentages[:, 1] - base_percentages[:, 2]).max(initial=0))
+
+        order = np.argsort(-self.sequence_counts)
+        overrepresented = [(sequence.decode(), count, count * 100 / max(self.reads, 1))
+                           for sequence, count in zip(self.sequences[order],
+                                                      self.sequence_counts[order])
+                           if count * 1000 > self.reads]
+
+        sections = [
+            ("Basic Statistics", "pass", ["#Measure\tValue", f"Filename\t{file_name}",
+                                          "File type\tConventional base calls",
+                                          "Encoding\tSanger / Illumina 1.9",
+                                          f"Total Sequences\t{self.reads}",
+                                          "Sequences flagged as poor quality\t0",
+                                          f"Sequence length\t{self._format_lengths(lengths)}",
+                                          f"%GC\t{gc_percentage:.0f}"]),
+            ("Per base sequence quality", quality_status,
+             ["#Base\tMean\tMedian\tLower Quartile\tUpper Quartile\t10th Percentile\t"
+              "90th Percentile"] +
+             [f"{position}\t{values[0]:.1f}\t{values[1]}.0\t{values[2]}.0\t{values[3]}.0\t"
+              f"{values[4]}.0\t{values[5]}.0"
+              for position, *values in zip(positions, mean_quality, median, lower, upper,
+                                           tenth, ninetieth)]),
+            ("Per sequence quality scores",
+             "fail" if most_frequent_quality < 20 else
+             "warn" if most_frequent_quality < 27 else "pass",
+             ["#Quality\tCount"] +
+             [f"{quality}\t{count}.0" for quality, count in enumerate(self.mean_quality_counts)
+              if count]),
+            ("Per base sequence content", self._grade(content_difference, 10, 20),
+             ["#Base\tG\tA\tT\tC"] +
+             [f"{position}\t{g:.2f}\t{a:.2f}\t{t:.2f}\t{c:.2f}"
+              for position, (a, c, g, t) in zip(positions, base_percentages)]),
+            ("Per sequence GC content", self._grade(self._gc_deviation(), 15, 30),
+             ["#GC Content\tCount"] +
+             [f"{percentage}\t{count}.0" for percentage, count in enumerate(self.gc_counts)]),
+            ("Per base N content", self._grade(n_percentages.max(initial=0), 5, 20),
+             ["#Base\tN-Count"] +
+             [f"{position}\t{percentage:.2f}"
+              for position, percentage in zip(positions, n_percentages)]),
+            ("Sequence Length Distribution",
+             "fail" if self.length_counts[0] else "warn" if len(lengths) > 1 else "pass",
+             ["#Length\tCount"] +
+             [f"{length}\t{self.length_counts[length]}.0" for length in lengths]),
+            ("Overrepresented sequences",
+             self._grade(max([percentage for *_, percentage in overrepresented], default=0),
+                         0.1, 1),
+             ["#Sequence\tCount\tPercentage\tPossible Source"] +
+             [f"{sequence}\t{count}\t{percentage}\tNo Hit"
+              for sequence, count, percentage in overrepresented]),
+        ]
+        return sections
+
+    def write_fastqc_data(self, output_dir):
+        """
+        Writes the statistics as the fastqc_data.txt file FastQC creates, in a directory named
+        like the one FastQC creates, so MultiQC reads the statistics as FastQC results.
+
+        :param output_dir: The directory the FastQC-like directory is created in
+        :return: The path of the written file
+        """
+        clean_name = Path(Path(self.file).stem).stem
+        report_dir = f"{output_dir}/{clean_name}_fastqc"
+        os.makedirs(report_dir, exist_ok=True)
+
+        output_file = f"{report_dir}/fastqc_data.txt"
+        with open(output_file, "w") as opened_output:
+            opened_output.write("##FastQC\t0.11.9\n")
+            for module, status, lines in self.create_sections():
+                opened_output.write(f">>{module}\t{status}\n")
+                opened_output.writelines(f"{line}\n" for line in lines)
+                opened_output.write(">>END_MODULE\n")
+        return output_file
+
+    def _gc_deviation(self):
+        """
+        Calculates how far the GC content distribution deviates from a normal distribution
+        with the same mean and standard deviation, like FastQC does.
+
+        :return: The percentage of the reads that deviate from the normal distribution
+        """
+        total = self.gc_counts.sum()
+        if not total:
+            return 0
+        percentages = np.arange(101)
+        mean = (self.gc_counts * percentages).sum() / total
+        deviation = np.sqrt((self.gc_counts * (percentages - mean) ** 2).sum() / total)
+        if not deviation:
+            return 0
+        normal = np.exp(-0.5 * ((percentages - mean) / deviation) ** 2)
+        normal = normal * total / normal.sum()
+        return np.abs(self.gc_counts - normal).sum() * 100 / total
+
+    @staticmethod
+    def _grade(value, warn, fail):
+        """
+        Grades a statistic like FastQC does, a higher value is worse.
+
+        :param value: The value of the statistic
+        :param warn: The value above which the module gets a warning
+        :param fail: The value above which the module fails
+        :return: 'pass', 'warn' or 'fail'
+        """
+        if value > fail:
+            return "fail"
+        return "warn" if value > warn else "pass"
+
+    @staticmethod
+    def _format_lengths(lengths):
+        """Formats the lengths of the reads like FastQC does, a single length or a range"""
+        if not len(lengths):
+            return "0"
+        if lengths[0] == lengths[-1]:
+            return str(lengths[0])
+        return f"{lengths[0]}-{lengths[-1]}"
+
+
+# MAIN
+def main():
+    """Main function to test functionality of the module"""
+    if len(sys.argv) != 3:
+        print("Usage: fastq_stats.py <input.fq.gz> <output directory>")
+        return 1
+    stats = FastqStats(sys.argv[1]).collect()
+    print(stats.write_fastqc_data(sys.argv[2]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
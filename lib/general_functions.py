@@ -11,6 +11,7 @@ __date__ = "29-01-2021"
 __version__ = "v0.2"
 
 # IMPORTS
+import os
 from math import floor
 from concurrent.futures import ProcessPoolExecutor
 from termcolor import colored
@@ -56,6 +57,32 @@ def calculate_threads(cores, amt_of_files):
     return threads
 
 
+def get_total_memory():
+    """
+    This function gets the total amount of memory of the system.
+
+    :return: The total amount of memory in gigabytes
+    """
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3
+
+
+def get_available_memory():
+    """
+    This function gets the amount of memory that is available for new processes,
+    falling back to the total amount of memory when /proc/meminfo can not be read.
+
+    :return: The amount of available memory in gigabytes
+    """
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024 ** 2
+    except OSError:
+        pass
+    return get_total_memory()
+
+
 def print_tool(file_name, start_finish, text):
     """
     With this function the status of what is happening to a file with a tool.
@@ -3,78 +3,226 @@
 """
 This module will download all the required genome reference and data files and unpack them.
 From the fasta reference file a dictionary and an index file about it will also be made.
+If there is no prebuilt HISAT2 index for the genome it will be built from the reference file.
 """
 
 # METADATA VARIABLES
 __author__ = "Rob Meulenkamp and Vincent Talen"
 __status__ = "Development"
 __date__ = "29-01-2021"
-__version__ = "v0.6"
+__version__ = "v0.9"
 
 # IMPORTS
+import os
 import sys
-from subprocess import run
+import time
+from gzip import GzipFile
+from shutil import copyfileobj
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import run, Popen, PIPE
+from http.client import IncompleteRead
+from urllib.error import URLError
+from urllib.request import Request, urlopen
 import lib.general_functions as gen_func
+from lib.genome_registry import get_genome
+from lib.picard_runner import PicardRunner
+
+# Amount of bytes that is read from the network and passed on to the extractor at once
+CHUNK_SIZE = 1024 * 1024
+# Amount of seconds between two progress updates of a download
+PROGRESS_INTERVAL = 30
+# Amount of times an interrupted download of an archive is resumed before giving up
+DOWNLOAD_ATTEMPTS = 5
+# Amount of seconds without any received bytes after which a connection counts as lost
+DOWNLOAD_TIMEOUT = 60
 
 
 class DownloadGenomeInfo:
     """
-    Class for downloading required files about the human genome.
+    Class for downloading required files about a genome from the genome registry.
     """
-    def __init__(self, output_dir):
+    def __init__(self, output_dir, genome, cores=1, connections=3):
         """
         Constructor for the DownloadGenomeInfo class
 
         :param output_dir: The directory the user gave for all the output files to be saved in
+        :param genome: The Genome from the genome registry that needs to be downloaded
+        :param cores: The amount of cores hisat2-build may use if the index needs to be built
+        :param connections: The maximum amount of files that are downloaded at the same time
         """
         self.output_dir = output_dir
+        self.genome = genome
+        self.cores = cores
+        self.connections = connections
         if self.output_dir.startswith("/"):
             self.output_dir = self.output_dir[1:]
         self.genome_dir = f"{self.output_dir}/Data/genome"
         self.tool_dir = f"{self.output_dir}/tool_logs/genome_download"
+        self.picard_runner = PicardRunner()
+        self.fed_bytes = dict()
 
     def collect_hisat_index(self):
         """
         This function downloads the HISAT index if it does not exist yet and removes compression.
+        The download is streamed straight into tar so it never has to be kept in memory.
         """
-        hisat_query = ["wget", "-c", "-O", "-",
-                       "https://genome-idx.s3.amazonaws.com/hisat/grch38_genome.tar.gz"]
-        exe_hisat = run(hisat_query, capture_output=True)
+        self.stream_to_tar(self.genome.index_link, "hisat_download")
 
-        unzip_query = ["tar", "-xz", "-C", self.genome_dir]
-        run(unzip_query, input=exe_hisat.stdout)
+    def build_hisat_index(self):
+        """
+        Builds the HISAT index from the fasta reference file with hisat2-build,
+        this is used for genomes that do not have a prebuilt index that can be downloaded.
+        """
+        index_prefix = f"{self.genome_dir}/{self.genome.index_prefix}"
+        os.makedirs(Path(index_prefix).parent, exist_ok=True)
 
-        with open(f"{self.tool_dir}/hisat_download.log", "w") as opened_log_file:
-            opened_log_file.write(exe_hisat.stderr.decode('UTF-8'))
+        query_build = ["hisat2-build", "-p", str(self.cores),
+                       f"{self.genome_dir}/{self.genome.fasta_file}", index_prefix]
+        exe_build = run(query_build, capture_output=True, text=True)
+        gen_func.save_tool_log(exe_build, f"{self.tool_dir}/hisat_build.log")
+        if exe_build.returncode != 0:
+            raise RuntimeError("Building the HISAT index failed, "
+                               "see hisat_build.log for the reason")
 
-    def download_and_unzip(self, link, filename, log_name):
+    def stream_to_tar(self, link, log_name):
         """
-        This function will check if the genome rtf file is existent and otherwise download it.
+        Downloads a tar.gz archive and extracts it in the genome directory while it is downloading.
+        The bytes are passed on to tar in chunks, so the memory usage does not depend on the
+        size of the archive and the archive itself is never saved to disk.
+        When the connection gets interrupted the download is resumed (with a Range request)
+        from the amount of bytes tar already got, at most DOWNLOAD_ATTEMPTS times.
+
+        :param link: The link to the tar.gz archive that needs to be downloaded
+        :param log_name: The name of the log file (without extension) the progress is written to
         """
-        dir_gtf_file = f"{self.genome_dir}/{filename}"
+        with open(f"{self.tool_dir}/{log_name}.log", "w") as opened_log_file:
+            extract = Popen(["tar", "-xz", "-C", self.genome_dir], stdin=PIPE,
+                            stdout=opened_log_file, stderr=opened_log_file)
+            offset = 0
+            try:
+                for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+                    try:
+                        offset = self._feed_extractor(link, extract, offset, opened_log_file)
+                        break
+                    except (URLError, ConnectionError, TimeoutError, IncompleteRead):
+                        # Errors of tar itself (like a broken pipe) can not be resumed
+                        if attempt == DOWNLOAD_ATTEMPTS or extract.poll() is not None:
+                            raise
+                        offset = self.fed_bytes.get(link, offset)
+                        self._log_progress(opened_log_file, "Connection lost, resuming download",
+                                           offset, 0)
+            except BaseException:
+                # The partially extracted files get overwritten by the next download
+                extract.kill()
+                extract.wait()
+                raise
 
-        download_query = ["wget", link, "-P", self.genome_dir]
-        exe_down = run(download_query, capture_output=True, text=True)
+            extract.stdin.close()
+            if extract.wait() != 0:
+                raise RuntimeError(f"Extracting {link} failed, see {log_name}.log for the reason")
 
-        unzip_query = ["gunzip", dir_gtf_file]
-        exe_unzip = run(unzip_query, capture_output=True, text=True)
+    def _feed_extractor(self, link, extract, offset, opened_log_file):
+        """
+        Downloads an archive (from the given offset on) and passes the bytes on to the extractor
+        in chunks. The amount of bytes passed on is kept in self.fed_bytes[link],
+        so it is known where to resume when the connection gets interrupted.
 
-        with open(f"{self.tool_dir}/{log_name}.log", "w") as opened_log_file:
-            opened_log_file.writelines([exe_down.stdout, exe_down.stderr,
-                                        exe_unzip.stdout, exe_unzip.stderr])
+        :param link: The link to the archive
+        :param extract: The running extractor process with an opened stdin
+        :param offset: The amount of bytes that were passed on to the extractor before already
+        :param opened_log_file: The opened log file the progress needs to be written to
+        :return: The total amount of bytes passed on to the extractor
+        """
+        request = Request(link, headers={"Range": f"bytes={offset}-"} if offset else {})
+        with urlopen(request, timeout=DOWNLOAD_TIMEOUT) as response:
+            if offset and response.status != 206:
+                raise RuntimeError(f"The server of {link} does not support resuming downloads")
+            total_size = offset + int(response.headers.get("Content-Length", 0))
+
+            start_time = last_update = time.time()
+            downloaded = 0
+            try:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                    extract.stdin.write(chunk)
+                    downloaded += len(chunk)
+
+                    if time.time() - last_update >= PROGRESS_INTERVAL:
+                        last_update = time.time()
+                        speed = downloaded / (last_update - start_time)
+                        self._log_progress(opened_log_file, "Downloading", offset + downloaded,
+                                           total_size, speed)
+            finally:
+                self.fed_bytes[link] = offset + downloaded
+
+            if total_size and offset + downloaded < total_size:
+                raise IncompleteRead(b"", total_size - offset - downloaded)
+            seconds = max(time.time() - start_time, 1e-6)
+            self._log_progress(opened_log_file, f"Finished downloading {Path(link).name}",
+                               offset + downloaded, total_size, downloaded / seconds)
+        return offset + downloaded
+
+    @staticmethod
+    def _log_progress(opened_log_file, text, done_size, total_size, speed=None):
+        """
+        Prints the progress of a download and writes it to the log file of the download.
 
-    def process_fasta(self):
+        :param opened_log_file: The opened log file the progress needs to be written to
+        :param text: The text describing what is happening
+        :param done_size: The amount of bytes that have been downloaded so far
+        :param total_size: The total size of the download in bytes (0 if unknown)
+        :param speed: The download speed in bytes per second (optional)
         """
-        Creates the fasta dictionary and fai files with the Picard tool.
+        progress = f"{text}: {done_size / 1e9:.2f}"
+        if total_size:
+            progress += f"/{total_size / 1e9:.2f} GB ({100 * done_size / total_size:.0f}%)"
+        else:
+            progress += " GB"
+        if speed is not None:
+            progress += f" at {speed / 1e6:.1f} MB/s"
+
+        print(f"\t{progress}")
+        opened_log_file.write(f"{progress}\n")
+        opened_log_file.flush()
+
+    def download_and_unzip(self, link, log_name):
+        """
+        Downloads a gzipped file and decompresses it while it is downloading,
+        so the compressed file never has to be saved to disk.
+
+        :param link: The link to the gzipped file that needs to be downloaded
+        :param log_name: The name of the log file (without extension) the progress is written to
+        :return: The name of the decompressed file with directories
         """
-        picard_tool = "lib/Picard_2.23.9/picard.jar"
-        dict_file_name = "Homo_sapiens.GRCh38.dna.primary_assembly.dict"
-        fa_file_name = f"{self.genome_dir}/Homo_sapiens.GRCh38.dna.primary_assembly.fa"
+        unzipped_file = f"{self.genome_dir}/{Path(link).stem}"
 
-        query_dict = ["java", "-jar", picard_tool, "CreateSequenceDictionary",
-                      "-R", fa_file_name, "-O", f"{self.genome_dir}/{dict_file_name}"]
-        exe_dict = run(query_dict, capture_output=True, text=True)
-        gen_func.save_tool_log(exe_dict, f"{self.tool_dir}/create_dict_file.log")
+        with urlopen(link) as response, \
+                open(f"{self.tool_dir}/{log_name}.log", "w") as opened_log_file:
+            start_time = time.time()
+            with GzipFile(fileobj=response) as unzipped, open(unzipped_file, "wb") as opened_file:
+                copyfileobj(unzipped, opened_file, CHUNK_SIZE)
+
+            downloaded = int(response.headers.get("Content-Length", 0))
+            seconds = max(time.time() - start_time, 1e-6)
+            self._log_progress(opened_log_file, f"Finished downloading {Path(link).name}",
+                               downloaded, downloaded, downloaded / seconds)
+        return unzipped_file
+
+    def create_fasta_dict(self):
+        """
+        Creates the fasta dictionary file with the Picard tool.
+        """
+        fa_file_name = f"{self.genome_dir}/{self.genome.fasta_file}"
+
+        arguments_dict = ["-R", fa_file_name, "-O", f"{self.genome_dir}/{self.genome.dict_file}"]
+        self.picard_runner.run([{"CreateSequenceDictionary": arguments_dict}],
+                               f"{self.tool_dir}/create_dict_file")
+
+    def create_fasta_index(self):
+        """
+        Creates the fai file of the fasta file with samtools.
+        """
+        fa_file_name = f"{self.genome_dir}/{self.genome.fasta_file}"
 
         query_fai = ["samtools", "faidx", fa_file_name]
         exe_fai = run(query_fai, capture_output=True, text=True)
@@ -84,32 +232,40 @@ class DownloadGenomeInfo:
         """
         This function this is the function that can be called
         to collect all the genome data with other the other functions.
+        The files are downloaded at the same time (at most 'connections' at once) and
+        the fasta dictionary and index get created as soon as the reference file is there,
+        while the other files might still be downloading.
         """
-        print("\tNow downloading the Hisat genome index")
-        self.collect_hisat_index()
-
-        print("\tFinished downloading the Hisat genome index. Now downloading annotation file")
-        self.download_and_unzip("ftp://ftp.ensembl.org/pub/release-84/gtf/homo_sapiens/"
-                                "Homo_sapiens.GRCh38.84.gtf.gz", "Homo_sapiens.GRCh38.84.gtf.gz",
-                                "gtf_download")
+        print(f"\tNow downloading the {self.genome.assembly} reference file, "
+              "Hisat genome index and annotation file")
+        with ThreadPoolExecutor(max_workers=self.connections) as fetcher, \
+                ThreadPoolExecutor(max_workers=3) as builder:
+            fasta = fetcher.submit(self.download_and_unzip, self.genome.fasta_link,
+                                   "reference_download")
+            downloads = [fetcher.submit(self.download_and_unzip, self.genome.gtf_link,
+                                        "gtf_download")]
+            if self.genome.index_link is not None:
+                downloads.append(fetcher.submit(self.collect_hisat_index))
 
-        print("\tFinished downloading annotation file. Now downloading human reference file")
-        self.download_and_unzip("ftp://ftp.ensembl.org/pub/release-84/fasta/homo_sapiens/"
-                                "dna/Homo_sapiens.GRCh38.dna.primary_assembly.fa.gz",
-                                "Homo_sapiens.GRCh38.dna.primary_assembly.fa.gz",
-                                "reference_download")
+            fasta.result()
+            print("\tFinished downloading reference file. Creating fasta dictionary and index now.")
+            builds = [builder.submit(self.create_fasta_dict),
+                      builder.submit(self.create_fasta_index)]
+            if self.genome.index_link is None:
+                print("\tThere is no prebuilt Hisat genome index, building it with hisat2-build")
+                builds.append(builder.submit(self.build_hisat_index))
 
-        print("\tFinished downloading human reference file. Creating fasta dictionary now.")
-        self.process_fasta()
+            for future in [*downloads, *builds]:
+                future.result()  # Raises the error of a download or build if it failed
 
-        print("\tFinished making fasta dictionary")
+        print("\tFinished downloading all files and making fasta dictionary")
 
 
 # MAIN
 def main():
     """Main function to test functionality of the module"""
     output_dir = "../../../students/2020-2021/Thema06/groepje3/temp"
-    DownloadGenomeInfo(output_dir)
+    DownloadGenomeInfo(output_dir, get_genome("human"))
     return 0
 
 
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+"""
+This module contains the registry with all the genomes the pipeline can align against.
+Every genome describes where its reference, annotation and (if available) prebuilt HISAT2 index
+can be downloaded from. Genomes without a prebuilt index get one built locally with hisat2-build.
+To add an organism simply add a Genome to the GENOMES dictionary.
+"""
+
+# METADATA VARIABLES
+__author__ = "Vincent Talen"
+__status__ = "Development"
+__date__ = "17-10-2026"
+__version__ = "v0.1"
+
+# IMPORTS
+import sys
+from pathlib import Path
+
+
+class Genome:
+    """
+    Class describing the files of a single genome assembly.
+    """
+    def __init__(self, assembly, release, fasta_link, gtf_link, index_link=None, index_name=None):
+        """
+        Constructor for the Genome class
+
+        :param assembly: The name of the assembly (for example GRCh38)
+        :param release: The (Ensembl) release the reference and annotation files are from
+        :param fasta_link: The link to the gzipped fasta reference file
+        :param gtf_link: The link to the gzipped gtf annotation file
+        :param index_link: The link to a tar.gz with a prebuilt HISAT2 index (optional)
+        :param index_name: The basename of the index files inside of the prebuilt index archive
+        """
+        self.assembly = assembly
+        self.release = release
+        self.fasta_link = fasta_link
+        self.gtf_link = gtf_link
+        self.index_link = index_link
+
+        if index_link is not None:
+            self.index_prefix = index_name
+        else:
+            self.index_prefix = "hisat2_index/genome"
+
+        self.fasta_file = Path(fasta_link).stem
+        self.dict_file = Path(self.fasta_file).stem + ".dict"
+        self.gtf_file = Path(gtf_link).stem
+
+    @property
+    def links(self):
+        """All the links the files of this genome get downloaded from"""
+        return [link for link in [self.index_link, self.gtf_link, self.fasta_link] if link]
+
+
+ENSEMBL = "ftp://ftp.ensembl.org/pub"
+HISAT_INDEXES = "https://genome-idx.s3.amazonaws.com/hisat"
+
+GENOMES = {
+    "human": Genome(
+        "GRCh38", "84",
+        f"{ENSEMBL}/release-84/fasta/homo_sapiens/dna/"
+        "Homo_sapiens.GRCh38.dna.primary_assembly.fa.gz",
+        f"{ENSEMBL}/release-84/gtf/homo_sapiens/Homo_sapiens.GRCh38.84.gtf.gz",
+        f"{HISAT_INDEXES}/grch38_genome.tar.gz", "grch38/genome"),
+    "mouse": Genome(
+        "GRCm38", "92",
+        f"{ENSEMBL}/release-92/fasta/mus_musculus/dna/"
+        "Mus_musculus.GRCm38.dna.primary_assembly.fa.gz",
+        f"{ENSEMBL}/release-92/gtf/mus_musculus/Mus_musculus.GRCm38.92.gtf.gz",
+        f"{HISAT_INDEXES}/grcm38_genome.tar.gz", "grcm38/genome"),
+    "macaque": Genome(
+        "Mmul_8.0.1", "92",
+        f"{ENSEMBL}/release-92/fasta/macaca_mulatta/dna/"
+        "Macaca_mulatta.Mmul_8.0.1.dna.toplevel.fa.gz",
+        f"{ENSEMBL}/release-92/gtf/macaca_mulatta/Macaca_mulatta.Mmul_8.0.1.92.gtf.gz"),
+    "rat": Genome(
+        "Rnor_6.0", "93",
+        f"{ENSEMBL}/release-93/fasta/rattus_norvegicus/dna/"
+        "Rattus_norvegicus.Rnor_6.0.dna.toplevel.fa.gz",
+        f"{ENSEMBL}/release-93/gtf/rattus_norvegicus/Rattus_norvegicus.Rnor_6.0.93.gtf.gz"),
+    "zebrafish": Genome(
+        "GRCz11", "93",
+        f"{ENSEMBL}/release-93/fasta/danio_rerio/dna/"
+        "Danio_rerio.GRCz11.dna.primary_assembly.fa.gz",
+        f"{ENSEMBL}/release-93/gtf/danio_rerio/Danio_rerio.GRCz11.93.gtf.gz"),
+}
+
+
+# FUNCTIONS
+def get_genome(name):
+    """
+    Gets a genome from the registry.
+
+    :param name: The name of the organism (one of the keys of GENOMES)
+    :return: The Genome of the organism
+    """
+    if name not in GENOMES:
+        raise ValueError(f"Unknown genome '{name}', choose from: {', '.join(GENOMES)}")
+    return GENOMES[name]
+
+
+# MAIN
+def main():
+    """Main function to test functionality of the module"""
+    for name, genome in GENOMES.items():
+        print(f"{name}: {genome.assembly} (release {genome.release}), "
+              f"prebuilt index: {genome.index_link is not None}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+"""
+This module contains a class HardClipper that clips a fixed amount of bases off the reads.
+When only fixed length clipping is needed starting Trim Galore (Perl and cutadapt) for every file
+is not needed, the clipper parses the fastq file in large blocks and clips the sequences
+and qualities of all the reads in a block at once with NumPy.
+(De)compressing is done by pigz (or gzip when pigz is not installed) in separate processes.
+"""
+
+# METADATA VARIABLES
+__author__ = "Vincent Talen"
+__status__ = "Development"
+__date__ = "17-10-2026"
+__version__ = "v0.2"
+
+# IMPORTS
+import sys
+import shutil
+from subprocess import Popen, PIPE
+import numpy as np
+
+# Amount of bytes of decompressed fastq that get clipped at the same time
+BLOCK_SIZE = 16 * 1024 ** 2
+NEWLINE = ord("\n")
+
+
+class HardClipper:
+    """
+    Class to clip a fixed amount of bases of the 5' and 3' end of every read of a fastq file.
+    Reads that are shorter than the bases that need to be clipped are kept as empty reads,
+    so the files of a pair keep the same reads in the same order.
+    """
+    def __init__(self, five_prime=0, three_prime=0, threads=1):
+        """
+        Constructor for the HardClipper class
+
+        :param five_prime: The amount of bases to clip of the 5' end of every read
+        :param three_prime: The amount of bases to clip of the 3' end of every read
+        :param threads: The amount of threads the compression may use
+        """
+        self.five_prime = five_prime
+        self.three_prime = three_prime
+        self.threads = threads
+        self.compressor = shutil.which("pigz") or "gzip"
+
+    def clip_file(self, input_file, output_file, compress=True):
+        """
+        Clips all the reads of a gzipped fastq file.
+
+        :param input_file: The gzipped fastq file that needs to be clipped
+        :param output_file: The file the clipped reads are written to
+        :param compress: If the output file needs to be gzipped
+        :return: A tuple with the amount of reads and the amount of bases that were clipped
+        """
+        compress_query = [self.compressor, "-c"]
+        if self.compressor.endswith("pigz"):
+            compress_query[1:1] = ["-p", str(self.threads)]
+
+        reads = 0
+        clipped_bases = 0
+        with open(output_file, "wb") as opened_output:
+            compressor = Popen(compress_query, stdin=PIPE, stdout=opened_output) if compress \
+                else None
+            output_stream = compressor.stdin if compress else opened_output
+
+            for data, line_ends in read_fastq_blocks(input_file):
+                clipped = self.clip_block(data, line_ends)
+                output_stream.write(clipped)
+                reads += len(line_ends) // 4
+                clipped_bases += (len(data) - len(clipped)) // 2
+
+            if compress:
+                compressor.stdin.close()
+                compressor.wait()
+
+        if compress and compressor.returncode != 0:
+            raise RuntimeError(f"Compressing failed while clipping {input_file}")
+        return reads, clipped_bases
+
+    def clip_block(self, data, line_ends):
+        """
+        Clips the sequence and quality lines of all the records in a block at once.
+        The removed ranges are marked with +1 at their start and -1 at their end,
+        the cumulative sum of those marks is positive for every byte that needs to be removed.
+
+        :param data: A NumPy array with the bytes of complete fastq records
+        :param line_ends: The positions of all the newlines in the data
+        :return: The clipped records as bytes
+        """
+        if not self.five_prime and not self.three_prime:
+            return data.tobytes()
+
+        line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+        # The sequence and quality are the 2nd and 4th line of every record
+        starts = line_starts.reshape(-1, 4)[:, [1, 3]].ravel()
+        ends = line_ends.reshape(-1, 4)[:, [1, 3]].ravel()
+        keep_starts = np.minimum(starts + self.five_prime, ends)
+        keep_ends = np.maximum(ends - self.three_prime, keep_starts)
+
+        positions = np.concatenate((starts, keep_starts, keep_ends, ends))
+        marks = np.repeat([1, -1, 1, -1], len(starts))
+        changes = np.bincount(positions, weights=marks, minlength=len(data) + 1)
+        removed = np.cumsum(changes[:-1]) > 0
+        return data[~removed].tobytes()
+
+
+# FUNCTIONS
+def read_fastq_blocks(input_file, block_size=BLOCK_SIZE):
+    """
+    Reads a gzipped fastq file in blocks of complete records, the file is decompressed
+    by pigz (or gzip) in a separate process. A record that is split by the end of a block
+    is moved to the next block.
+
+    :param input_file: The gzipped fastq file
+    :param block_size: The amount of decompressed bytes to read at the same time
+    :return: Generator of tuples with a NumPy array with the bytes of the complete records
+             in a block and a NumPy array with the positions of all the newlines in it
+    """
+    decompress_query = [shutil.which("pigz") or "gzip", "-dc", input_file]
+    if decompress_query[0].endswith("pigz"):
+        decompress_query[1:1] = ["-p", "2"]  # Decompressing does not scale beyond this
+    decompressor = Popen(decompress_query, stdout=PIPE)
+
+    finished = False
+    try:
+        leftover = b""
+        while True:
+            block = decompressor.stdout.read(block_size)
+            if not block and not leftover:
+                finished = True
+                break
+            data = np.frombuffer(leftover + block, dtype=np.uint8)
+            if not block and data[-1] != NEWLINE:
+                data = np.append(data, np.uint8(NEWLINE))  # Last line without a newline
+
+            # Only complete records are returned, the rest is returned with the next block
+            line_ends = np.flatnonzero(data == NEWLINE)
+            complete_lines = len(line_ends) // 4 * 4
+            if complete_lines == 0:
+                if not block:
+                    raise ValueError(f"{input_file} ends with an incomplete fastq record")
+                leftover = data.tobytes()
+                continue
+            cut = line_ends[complete_lines - 1] + 1
+            leftover = data[cut:].tobytes()
+            yield data[:cut], line_ends[:complete_lines]
+    finally:
+        # Stop the decompressing when the blocks are not read until the end of the file
+        if not finished:
+            decompressor.kill()
+        decompressor.wait()
+
+    if decompressor.returncode != 0:
+        raise RuntimeError(f"Decompressing {input_file} failed")
+
+
+# MAIN
+def main():
+    """Main function to test functionality of the module"""
+    if len(sys.argv) != 5:
+        print("Usage: hard_clipper.py <input.fq.gz> <output.fq.gz> <5' bases> <3' bases>")
+        return 1
+    clipper = HardClipper(int(sys.argv[3]), int(sys.argv[4]), threads=4)
+    reads, clipped_bases = clipper.clip_file(sys.argv[1], sys.argv[2])
+    print(f"Clipped {clipped_bases} bases of {reads} reads")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,7 +2,8 @@
 
 """
 This python module runs the multiQC tool, it requires the target output directory location.
-MultiQC searches the entire output directory for all the results and uses them to create a summary.
+The report files of all the tools are gathered in a file list, so MultiQC only reads those files
+instead of searching through all the (large) bam and fastq files of the output directory.
 The resulting reports will be written to the 'output_directory/Results/multiQC' directory.
 """
 
@@ -11,14 +12,25 @@ The resulting reports will be written to the 'output_directory/Results/multiQC'
 __author__ = "Joost Numan"
 __status__ = "Development"
 __date__ = "29-01-2021"
-__version__ = "v0.3.3"
+__version__ = "v0.4.0"
 
 
 # IMPORTS
 import sys
+import glob
 from subprocess import run
 import lib.general_functions as gen_func
 
+# The report files MultiQC uses, relative to the output directory
+REPORT_PATTERNS = [
+    "Results/fastQC*/*_fastqc.zip",                     # FastQC
+    "Results/fastQC*/*_fastqc/fastqc_data.txt",         # Native quality check
+    "Preprocessing/trimmed/*_trimming_report.txt",      # Trim Galore (cutadapt)
+    "tool_logs/preprocessing/*_alignment.log",          # HISAT2
+    "Preprocessing/markDuplicates/*.metrics.log",       # Picard (or samtools) duplicates
+    "Data/counts/geneCounts.txt.summary"                # featureCounts
+]
+
 
 # FUNCTIONS
 def perform_multiqc(output_dir):
@@ -28,7 +40,8 @@ def perform_multiqc(output_dir):
 
     :param :output_dir is the directory that the user has given as parameter
     """
-    query = ["multiqc", output_dir, "--pdf", "-o", f"{output_dir}/Results/multiQC",
+    file_list = create_file_list(output_dir)
+    query = ["multiqc", "--file-list", file_list, "--pdf", "-o", f"{output_dir}/Results/multiQC",
              "-c", "lib/multiqc_config.yaml"]
     executed_process = run(query, capture_output=True, text=True)
 
@@ -36,6 +49,21 @@ def perform_multiqc(output_dir):
     gen_func.save_tool_log(executed_process, f"{output_dir}/tool_logs/multiQC.log")
 
 
+def create_file_list(output_dir):
+    """
+    Writes the names of all the report files of the tools to a file list for MultiQC.
+
+    :param output_dir: The directory that the user has given as parameter
+    :return: The name of the file list with directories
+    """
+    file_list = f"{output_dir}/Results/multiQC/multiqc_files.txt"
+    with open(file_list, "w") as opened_file_list:
+        for pattern in REPORT_PATTERNS:
+            for file in sorted(glob.glob(f"{output_dir}/{pattern}")):
+                opened_file_list.write(f"{file}\n")
+    return file_list
+
+
 # MAIN
 def main():
     """Main function to test module"""
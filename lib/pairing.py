@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+"""
+This module pairs the fastq files of paired-end samples.
+The first line (header) of every file is read at the same time with multiple threads,
+the files are then indexed by the read name in their header so every file finds its mate
+with a single lookup. Files with headers that do not tell the pair apart are paired
+by their file names (_R1/_R2 or _1/_2).
+The headers are cached in a manifest together with the size and modification time of the files,
+so a next run only has to read the headers of new or changed files.
+"""
+
+# METADATA VARIABLES
+__author__ = "Vincent Talen"
+__status__ = "Development"
+__date__ = "17-10-2026"
+__version__ = "v0.1"
+
+# IMPORTS
+import os
+import re
+import sys
+import gzip
+import json
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# Side of the read in the second part of the header, like 'x/1' or '1:N:0:ATCACG' (Casava 1.8)
+SIDE_PATTERN = re.compile(r"^(?:.*/([12])|([12]):[YN]:.*)$")
+# Side of the file in the file name, like sample_R1_001.fastq.gz or sample_2.fq.gz
+NAME_PATTERN = re.compile(r"^(.*[._])R?([12])((?:[._]\d+)?\.(?:fastq|fq)(?:\.gz)?)$")
+
+
+class FilePairer:
+    """
+    Class to pair fastq files in linear time, with a cached manifest of the file headers.
+    """
+    def __init__(self, manifest_file=None, threads=16):
+        """
+        Constructor for the FilePairer class
+
+        :param manifest_file: The JSON file the headers are cached in (None for no caching)
+        :param threads: The amount of files that are read at the same time
+        """
+        self.manifest_file = manifest_file
+        self.threads = threads
+
+    def read_headers(self, files):
+        """
+        Reads the headers of all the files, the headers of files that did not change since they
+        were cached are taken from the manifest. Empty files are left out.
+
+        :param files: The gzipped fastq files
+        :return: A dictionary with the files as keys and their header as value
+        """
+        cached = self._load_manifest()
+        signatures = {file: self._get_signature(file) for file in files}
+        to_read = [file for file in files
+                   if cached.get(file, {}).get("signature") != signatures[file]]
+
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            read_headers = dict(zip(to_read, executor.map(self.read_header, to_read)))
+
+        headers = dict()
+        manifest = dict()
+        for file in files:
+            header = read_headers[file] if file in read_headers else cached[file]["header"]
+            manifest[file] = {"signature": signatures[file], "header": header}
+            if header:
+                headers[file] = header
+        self._save_manifest(manifest)
+        return headers
+
+    @staticmethod
+    def read_header(file):
+        """
+        Reads the first line (header) of a gzipped fastq file.
+
+        :param file: The gzipped fastq file
+        :return: The header without the newline, or None if the file is empty
+        """
+        with gzip.open(file) as opened_file:
+            first_line = opened_file.readline()
+        return first_line.strip().decode("UTF-8") if first_line else None
+
+    @staticmethod
+    def create_pairs(headers):
+        """
+        Pairs the files, first by the read name in their header and
+        then by their file name for the files that could not be paired by their header.
+
+        :param headers: A dictionary with the files as keys and their header as value
+        :return: pairs: A list containing lists with the names of the files from a pair
+                 single_ended: A list containing all the filenames of single ended files
+        """
+        sides = dict()
+        by_read_name = dict()
+        for file, header in headers.items():
+            fields = header.split()
+            side_match = SIDE_PATTERN.match(fields[1]) if len(fields) > 1 else None
+            if side_match:
+                sides[file] = side_match.group(1) or side_match.group(2)
+                read_name = fields[0].split(".")[0]
+                by_read_name.setdefault(read_name, dict())[sides[file]] = file
+
+        pairs = list()
+        paired_files = set()
+        for read_name, mates in by_read_name.items():
+            if len(mates) == 2:
+                pairs.append([mates["1"], mates["2"]])
+                paired_files.update(mates.values())
+
+        # Pair the rest of the files by their file name
+        by_file_name = dict()
+        for file in headers:
+            name_match = NAME_PATTERN.match(Path(file).name)
+            if file not in paired_files and name_match:
+                key = (str(Path(file).parent), name_match.group(1), name_match.group(3))
+                by_file_name.setdefault(key, dict())[name_match.group(2)] = file
+        for mates in by_file_name.values():
+            if len(mates) == 2:
+                pairs.append([mates["1"], mates["2"]])
+                paired_files.update(mates.values())
+
+        single_ended = list()
+        for file in headers:
+            if file not in paired_files:
+                single_ended.append(file)
+                if file in sides:
+                    print(f"\t[INFO] File {file} was paired but the complementary "
+                          f"file could not be found so it was aligned as singled ended")
+        return pairs, single_ended
+
+    def pair_files(self, files):
+        """
+        Reads the headers of the files and pairs them.
+
+        :param files: The gzipped fastq files
+        :return: pairs: A list containing lists with the names of the files from a pair
+                 single_ended: A list containing all the filenames of single ended files
+        """
+        return self.create_pairs(self.read_headers(files))
+
+    @staticmethod
+    def _get_signature(file):
+        """Gets the size and modification time of a file, a change means it has to be read again"""
+        file_stat = os.stat(file)
+        return [file_stat.st_size, file_stat.st_mtime_ns]
+
+    def _load_manifest(self):
+        """
+        Loads the cached headers from the manifest.
+
+        :return: A dictionary with the files as keys and their signature and header as value
+        """
+        if self.manifest_file is None or not os.path.isfile(self.manifest_file):
+            return dict()
+        try:
+            with open(self.manifest_file) as opened_manifest:
+                return json.load(opened_manifest)
+        except ValueError:
+            return dict()  # A broken manifest only means all the headers are read again
+
+    def _save_manifest(self, manifest):
+        """
+        Saves the headers to the manifest, through a temporary file so a manifest is never
+        left half written.
+
+        :param manifest: A dictionary with the files as keys and their signature and header as value
+        """
+        if self.manifest_file is None:
+            return
+        temporary_file = f"{self.manifest_file}.tmp"
+        with open(temporary_file, "w") as opened_manifest:
+            json.dump(manifest, opened_manifest, indent=1)
+        os.replace(temporary_file, self.manifest_file)
+
+
+# MAIN
+def main():
+    """Main function to test functionality of the module"""
+    if len(sys.argv) < 2:
+        print("Usage: pairing.py <fastq.gz files>")
+        return 1
+    pairs, single_ended = FilePairer().pair_files(sys.argv[1:])
+    for pair in pairs:
+        print("\t".join(pair))
+    for file in single_ended:
+        print(file)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+"""
+This module contains a class that runs multiple Picard tools in one long-lived JVM.
+Starting 'java -jar picard.jar' for every step makes every step pay for the startup and warm-up
+of the JVM and every JVM picks its own default heap size, which oversubscribes the memory
+when multiple files are processed at the same time.
+The PicardRunner sizes the heap from a memory budget and reports the wall-clock time of every
+step and the peak resident memory of the JVM while the step ran. The batch launcher is compiled
+once with javac (a JDK 11 or newer is needed) and recompiled only when its source changes.
+"""
+
+# METADATA VARIABLES
+__author__ = "Vincent Talen"
+__status__ = "Development"
+__date__ = "17-10-2026"
+__version__ = "v0.4"
+
+# IMPORTS
+import os
+import sys
+import fcntl
+from math import floor
+from subprocess import run, Popen, PIPE
+import lib.general_functions as gen_func
+
+PICARD_JAR = "lib/Picard_2.23.9/picard.jar"
+BATCH_LAUNCHER = "lib/PicardBatch.java"
+# Directory the compiled batch launcher is saved in
+LAUNCHER_CLASSES = "lib/classes"
+# Part of the memory of a JVM that is given to the heap, the rest is for the JVM itself
+HEAP_FRACTION = 0.75
+# Smallest heap size (megabytes) a JVM is started with
+MIN_HEAP_SIZE = 256
+
+
+class PicardRunner:
+    """
+    Class to run the Picard steps of a file inside of a single JVM.
+    """
+    def __init__(self, heap_size=None, gc_threads=1):
+        """
+        Constructor for the PicardRunner class
+
+        :param heap_size: The maximum heap size of the JVM in megabytes (None for the default)
+        :param gc_threads: The amount of threads the garbage collector may use
+        """
+        self.heap_size = heap_size
+        self.gc_threads = gc_threads
+
+    @staticmethod
+    def calculate_heap_size(memory, concurrent_jvms):
+        """
+        Calculates the heap size of every JVM so all the JVMs running at the same time
+        together stay within the memory budget.
+
+        :param memory: The amount of gigabytes all the JVMs together may use
+        :param concurrent_jvms: The amount of JVMs that can be running at the same time
+        :return: The heap size of a single JVM in megabytes
+        """
+        return max(floor(memory * 1024 * HEAP_FRACTION / max(concurrent_jvms, 1)), MIN_HEAP_SIZE)
+
+    @staticmethod
+    def calculate_max_jvms(memory):
+        """
+        Calculates how many JVMs with the smallest heap size fit in the memory budget.
+
+        :param memory: The amount of gigabytes all the JVMs together may use
+        :return: The maximum amount of JVMs that can run at the same time (at least 1)
+        """
+        return max(floor(memory * 1024 * HEAP_FRACTION / MIN_HEAP_SIZE), 1)
+
+    def create_java_query(self):
+        """
+        Creates the query that starts the JVM with the batch launcher and the tuned settings.
+
+        :return: The query in the form of a list
+        """
+        query = ["java", "-XX:+UseParallelGC", f"-XX:ParallelGCThreads={self.gc_threads}"]
+        if self.heap_size is not None:
+            query.append(f"-Xmx{self.heap_size}m")
+        return [*query, "-cp", f"{PICARD_JAR}{os.pathsep}{LAUNCHER_CLASSES}", "PicardBatch"]
+
+    @staticmethod
+    def compile_launcher():
+        """
+        Compiles the batch launcher with javac if it is not compiled yet or its source changed.
+        A lock file makes sure runs that start at the same time do not compile it at once.
+        """
+        class_file = f"{LAUNCHER_CLASSES}/PicardBatch.class"
+        os.makedirs(LAUNCHER_CLASSES, exist_ok=True)
+        with open(f"{LAUNCHER_CLASSES}/.lock", "w") as opened_lock_file:
+            fcntl.flock(opened_lock_file, fcntl.LOCK_EX)
+            if os.path.isfile(class_file) and \
+                    os.path.getmtime(class_file) >= os.path.getmtime(BATCH_LAUNCHER):
+                return
+            exe_compile = run(["javac", "-cp", PICARD_JAR, "-d", LAUNCHER_CLASSES, BATCH_LAUNCHER],
+                              capture_output=True, text=True)
+            if exe_compile.returncode != 0:
+                raise RuntimeError(f"Compiling {BATCH_LAUNCHER} failed (a JDK 11 or newer is "
+                                   f"needed): {exe_compile.stderr}")
+
+    def run(self, stages, log_prefix):
+        """
+        Runs all the given Picard steps in one JVM. The stages are run one after the other
+        and the steps of a stage at the same time, so they can be connected with named pipes.
+        Every step gets its own log file and the reported wall-clock time and peak resident memory
+        of every step are written to '<log_prefix>_PicardRunner.log'. The memory is of the whole
+        JVM while the step ran, so it includes the other steps of the same stage.
+        If a step fails the JVM stops straight away, so the steps still waiting on its named pipes
+        do not hang, and a RuntimeError is raised.
+
+        :param stages: A list of stages, every stage is a dictionary with the tool names as keys
+                       and the arguments of the tool in a list as values
+        :param log_prefix: The log files are named '<log_prefix>_<tool name>.log'
+        :return: A list with tuples of the tool name, exit code, seconds and peak memory (kB)
+        """
+        self.compile_launcher()
+        lines = list()
+        for stage_number, stage in enumerate(stages):
+            for tool_name, arguments in stage.items():
+                fields = [str(stage_number), f"{log_prefix}_{tool_name}.log", tool_name, *arguments]
+                lines.append("\t".join(fields))
+
+        log_name = os.path.basename(log_prefix)
+        tool_names = "|".join(tool for stage in stages for tool in stage)
+        gen_func.print_tool(log_name, "s", f"Picard {tool_names}")
+
+        process = Popen(self.create_java_query(), stdin=PIPE, stdout=PIPE, stderr=PIPE, text=True)
+        output, errors = process.communicate("\n".join(lines) + "\n")
+
+        steps = list()
+        for line in output.splitlines():
+            fields = line.split("\t")
+            if len(fields) == 4:  # Anything else is output of a tool itself
+                tool_name, exit_code, seconds, peak_memory = fields
+                steps.append((tool_name, int(exit_code), float(seconds), int(peak_memory)))
+
+        with open(f"{log_prefix}_PicardRunner.log", "w") as opened_log_file:
+            opened_log_file.write(f"JVM: {' '.join(self.create_java_query())}\n")
+            for tool_name, exit_code, seconds, peak_memory in steps:
+                opened_log_file.write(f"{tool_name}\texit code {exit_code}\t{seconds:.1f} seconds"
+                                      f"\tJVM peak RSS during step "
+                                      f"{peak_memory / 1024:.0f} MB\n")
+            if steps:
+                peak_memory = max(step[3] for step in steps)
+                opened_log_file.write(f"JVM peak RSS {peak_memory / 1024:.0f} MB, "
+                                      f"exit code {process.returncode}\n")
+            opened_log_file.write(errors)
+
+        # Steps that did not report an exit code were stopped because another step failed
+        finished = [tool_name for tool_name, exit_code, _, _ in steps if exit_code == 0]
+        failed = [tool for stage in stages for tool in stage if tool not in finished]
+        if failed or process.returncode != 0:
+            raise RuntimeError(f"Picard {'|'.join(failed)} of {log_name} failed (exit code "
+                               f"{process.returncode}), see the {log_name} logs for the reason")
+        gen_func.print_tool(log_name, "f", f"Picard {tool_names}")
+        return steps
+
+
+# MAIN
+def main():
+    """Main function to test functionality of the module"""
+    runner = PicardRunner(PicardRunner.calculate_heap_size(8, 2))
+    print(" ".join(runner.create_java_query()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
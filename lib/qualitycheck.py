@@ -9,14 +9,18 @@ This module contains a class for the quality check,
 __author__ = "Rob Meulenkamp and Vincent Talen"
 __status__ = "Development"
 __date__ = "29-01-2021"
-__version__ = "v0.3"
+__version__ = "v0.8"
 
 
+import os
 import sys
 import glob
 from pathlib import Path
 from subprocess import run
+from concurrent.futures import ProcessPoolExecutor
+from termcolor import colored
 import lib.general_functions as gen_func
+from lib.fastq_stats import FastqStats
 
 
 class QualityCheck:
@@ -39,26 +43,120 @@ class QualityCheck:
 
         :param cores: The amount of cores the quality check needs to use
         """
-        files = glob.glob(f"{self.input_dir}*fastq.gz")
+        files = self.gather_files()
         gen_func.process_files(cores, self.perform_fastqc, files)
 
-    def perform_fastqc(self, file):
+    def preview(self, cores, reads, sampling="head"):
         """
-        This method runs the fastqc tool on a file.
+        Checks the quality of a sample of the reads of every file to quickly find bad runs,
+        the summaries of all the files are printed.
 
-        :param file: The file the fastqc process needs to be run on
+        :param cores: The amount of cores the preview may use
+        :param reads: The amount of reads of every file that are checked
+        :param sampling: 'head' for the first reads or 'reservoir' for a random sample
+        :return: A dictionary with the files as keys and their summary as value
         """
-        file_path = Path(file).stem
-        file_name = Path(file_path).stem
+        files = sorted(self.gather_files())
+        with ProcessPoolExecutor(max_workers=cores) as executor:
+            summaries = executor.map(self.preview_file, files, [reads] * len(files),
+                                     [sampling] * len(files))
+            summaries = dict(zip(files, summaries))
+
+        status_colors = {"pass": "green", "warn": "yellow", "fail": "red"}
+        for file, summary in summaries.items():
+            print(f"\t{Path(file).name}: {summary.pop('Total Sequences')} reads, "
+                  f"length {summary.pop('Sequence length')}, {summary.pop('%GC')}% GC")
+            for module, status in summary.items():
+                if status in status_colors:
+                    print(f"\t\t{colored(status.upper(), status_colors[status])}\t{module}")
+        return summaries
+
+    @staticmethod
+    def preview_file(file, reads, sampling):
+        """
+        Checks the quality of a sample of the reads of a file with the built-in engine.
+
+        :param file: The file that needs to be previewed
+        :param reads: The amount of reads that are checked
+        :param sampling: 'head' for the first reads or 'reservoir' for a random sample
+        :return: A dictionary with the basic statistics and the status of every module
+        """
+        return FastqStats(file).collect(reads, sampling).summarize()
+
+    def gather_files(self):
+        """
+        This method gathers all the fastq.gz files in the given input directory.
+
+        :return: A list with all the fastq.gz files found in the input directory
+        """
+        return glob.glob(f"{self.input_dir}*fastq.gz")
+
+    def perform_fastqc(self, files, trimmed=False):
+        """
+        This method runs the fastqc tool on a file or on the files of a pair.
+        FastQC only uses multiple threads to check multiple files at the same time,
+        so the files of a pair are checked by one fastqc process with a thread per file.
+        Trimmed files are checked in the background with the lowest CPU priority,
+        so they do not slow down the trimming, alignment and bam processing.
+
+        :param files: The file (or a list with the files) the fastqc process needs to be run on
+        :param trimmed: If the files are trimmed files instead of input files
+        """
+        files = files if isinstance(files, list) else [files]
+        file_name = "_".join(Path(Path(file).stem).stem for file in files)
         gen_func.print_tool(file_name, "s", "quality check")
 
-        query = ["fastqc", file, "-o", f"{self.output_dir}/Results/fastQC/"]
+        query = ["fastqc", *files, "-t", str(len(files)), "-o", self.get_results_dir(trimmed)]
+        if trimmed:
+            query = ["nice", "-n", "19", *query]
         exe_fastqc = run(query, capture_output=True, text=True)
 
         log_dir = f"{self.output_dir}/tool_logs/qualitycheck"
         gen_func.save_tool_log(exe_fastqc, f"{log_dir}/{file_name}_qualitycheck.log")
         gen_func.print_tool(file_name, "f", "quality check")
 
+    def perform_native_qc(self, files, trimmed=False):
+        """
+        This method checks the quality of a file (or the files of a pair) with the built-in
+        FastqStats engine instead of FastQC, the results are written in the FastQC format.
+        Trimmed files are checked in a separate process with the lowest CPU priority,
+        the same way FastQC checks them.
+
+        :param files: The file (or a list with the files) that needs to be quality checked
+        :param trimmed: If the files are trimmed files instead of input files
+        """
+        files = files if isinstance(files, list) else [files]
+        for file in files:
+            file_name = Path(Path(file).stem).stem
+            gen_func.print_tool(file_name, "s", "quality check")
+            if trimmed:
+                with ProcessPoolExecutor(max_workers=1, initializer=os.nice,
+                                         initargs=(19,)) as checker:
+                    checker.submit(check_file, file, self.get_results_dir(trimmed)).result()
+            else:
+                check_file(file, self.get_results_dir(trimmed))
+            gen_func.print_tool(file_name, "f", "quality check")
+
+    def get_results_dir(self, trimmed=False):
+        """
+        Gets the directory the quality check results are written to,
+        the results of the input files and the trimmed files are kept apart for MultiQC.
+
+        :param trimmed: If the results are of trimmed files instead of input files
+        :return: The directory for the results
+        """
+        return f"{self.output_dir}/Results/{'fastQC_trimmed' if trimmed else 'fastQC'}"
+
+
+def check_file(file, results_dir):
+    """
+    Checks the quality of a file with the FastqStats engine and writes the results.
+
+    :param file: The gzipped fastq file that needs to be quality checked
+    :param results_dir: The directory the results are written to in the FastQC format
+    """
+    FastqStats(file).collect().write_fastqc_data(results_dir)
+
 
 def main():
     """Main function to test module functionality"""
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+"""
+This module contains a machine-wide cache for the genome reference files.
+Every genome gets its own entry in the cache, identified by the assembly, release and a checksum
+of the links the files are downloaded from, so all runs and output directories can share them.
+The key has to be known before anything is downloaded, so it is based on the links instead of
+the contents of the files: the files of an Ensembl release never change after it is published.
+When the files need to be downloaded again anyway the entry can be refreshed.
+File locks make sure concurrent runs never download the same entry twice or remove an entry
+that is still in use, and the least recently used entries are removed to limit the disk usage.
+"""
+
+# METADATA VARIABLES
+__author__ = "Vincent Talen"
+__status__ = "Development"
+__date__ = "17-10-2026"
+__version__ = "v0.2"
+
+# IMPORTS
+import os
+import sys
+import fcntl
+import shutil
+import hashlib
+
+# Directory of the cache when it is not given, can be changed with an environment variable
+DEFAULT_CACHE_DIR = os.environ.get("PIPELINE_REFERENCE_CACHE",
+                                   os.path.expanduser("~/.cache/alignment_pipeline/references"))
+
+
+class CacheEntry:
+    """
+    Class for a single genome in the reference cache.
+    As long as the entry is open it is locked, so other runs can not remove it.
+    """
+    def __init__(self, cache_dir, key, refresh=False):
+        """
+        Constructor for the CacheEntry class, it waits until no other run is downloading the entry
+
+        :param cache_dir: The directory of the reference cache
+        :param key: The key of the genome in the cache
+        :param refresh: Remove the files of the entry so they get downloaded again, this waits
+                        until no other run is using the entry
+        """
+        self.key = key
+        self.path = f"{cache_dir}/{key}"
+
+        self.lock_file = self._open_lock(fcntl.LOCK_EX if refresh else fcntl.LOCK_SH)
+        if refresh and os.path.isdir(self.path):
+            shutil.rmtree(self.path)  # No other run can use the entry while it is locked
+        self.complete = os.path.exists(f"{self.path}/.complete")
+        if not self.complete and not refresh:
+            # Only one run at a time is allowed to download the files of an entry
+            self.lock_file.close()
+            self.lock_file = self._open_lock(fcntl.LOCK_EX)
+            self.complete = os.path.exists(f"{self.path}/.complete")
+
+        os.makedirs(self.path, exist_ok=True)
+        os.utime(self.path)  # The modification time is used to find the least recently used
+
+    def _open_lock(self, lock_type):
+        """
+        Opens and locks the lock file of the entry, waiting for other runs if needed.
+        If the entry got removed by another run while waiting the lock is taken again.
+
+        :param lock_type: fcntl.LOCK_SH to share the entry or fcntl.LOCK_EX to use it alone
+        :return: The opened and locked lock file
+        """
+        lock_name = f"{self.path}.lock"
+        while True:
+            lock_file = open(lock_name, "a")
+            fcntl.flock(lock_file, lock_type)
+            if os.path.exists(lock_name) and \
+                    os.path.samestat(os.fstat(lock_file.fileno()), os.stat(lock_name)):
+                return lock_file
+            lock_file.close()
+
+    def link(self, link_name):
+        """
+        Creates a symbolic link to the entry so the rest of the pipeline can use it as a directory.
+
+        :param link_name: The name (with directories) of the link that needs to be created
+        """
+        if os.path.islink(link_name):
+            os.remove(link_name)
+        os.symlink(os.path.abspath(self.path), link_name)
+
+    def mark_complete(self):
+        """Marks all the files of the entry as downloaded and lets other runs use it as well."""
+        with open(f"{self.path}/.complete", "w"):
+            pass
+        self.complete = True
+        fcntl.flock(self.lock_file, fcntl.LOCK_SH)
+
+    def close(self):
+        """Releases the lock, after this the entry can be removed by other runs."""
+        self.lock_file.close()
+
+
+class ReferenceCache:
+    """
+    Class for the machine-wide cache with the genome reference files.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=100):
+        """
+        Constructor for the ReferenceCache class
+
+        :param cache_dir: The directory of the reference cache
+        :param max_size: The maximum amount of gigabytes all entries together may use
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size * 1e9
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def create_key(assembly, release, links):
+        """
+        Creates the key of a genome, a checksum of the links makes sure that different files
+        for the same assembly and release never end up in the same entry.
+
+        :param assembly: The name of the assembly of the genome (for example GRCh38)
+        :param release: The release of the genome files
+        :param links: All the links the files of the genome get downloaded from
+        :return: The key of the genome in the cache
+        """
+        checksum = hashlib.sha256("\n".join(links).encode()).hexdigest()[:12]
+        return f"{assembly}_{release}_{checksum}"
+
+    def open_entry(self, key, refresh=False):
+        """
+        Opens the entry of a genome, when the entry is not complete yet
+        the caller is the only one allowed to download the files until it is marked complete.
+
+        :param key: The key of the genome in the cache
+        :param refresh: Remove the cached files of the genome so they get downloaded again
+        :return: The opened CacheEntry
+        """
+        return CacheEntry(self.cache_dir, key, refresh)
+
+    def evict(self, keep):
+        """
+        Removes the least recently used entries until the cache fits within the maximum size.
+        Entries that are being used by another run and the entry to keep are never removed.
+
+        :param keep: The key of the entry that is used by the current run
+        :return: A list with the keys of the removed entries
+        """
+        entries = [entry for entry in os.listdir(self.cache_dir)
+                   if os.path.isdir(f"{self.cache_dir}/{entry}")]
+        sizes = {entry: self._get_size(f"{self.cache_dir}/{entry}") for entry in entries}
+        total_size = sum(sizes.values())
+
+        removed = list()
+        for entry in sorted(entries, key=lambda name: os.path.getmtime(f"{self.cache_dir}/{name}")):
+            if total_size <= self.max_size:
+                break
+            if entry == keep:
+                continue
+
+            with open(f"{self.cache_dir}/{entry}.lock", "a") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # The entry is being used by another run
+                shutil.rmtree(f"{self.cache_dir}/{entry}")
+                os.remove(f"{self.cache_dir}/{entry}.lock")
+            total_size -= sizes[entry]
+            removed.append(entry)
+        return removed
+
+    @staticmethod
+    def _get_size(directory):
+        """Calculates the total size in bytes of all the files in a directory"""
+        size = 0
+        for root, _, files in os.walk(directory):
+            size += sum(os.path.getsize(f"{root}/{file}") for file in files)
+        return size
+
+
+# MAIN
+def main():
+    """Main function to test functionality of the module"""
+    cache = ReferenceCache()
+    key = cache.create_key("GRCh38", "84", ["test_link"])
+    entry = cache.open_entry(key)
+    print(f"Entry {entry.path} is complete: {entry.complete}")
+    entry.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+"""
+This module contains a scheduler that runs tasks as soon as the tasks they depend on are finished.
+Every task claims an amount of cores and the scheduler makes sure that the claimed cores
+of all running tasks never exceed the core budget of the pipeline.
+This way a file can go to its next step without waiting for the slowest file of the current step.
+Tasks with a lower priority only get the cores no task with a higher priority is waiting for.
+A task can get the return value of a task it depends on as an argument with Scheduler.result_of.
+Background tasks only start on free cores, but the other tasks do not wait for the cores
+of running background tasks: they run next to them and get the CPU first (background tasks
+run with the lowest CPU priority).
+"""
+
+# METADATA VARIABLES
+__author__ = "Vincent Talen"
+__status__ = "Development"
+__date__ = "17-10-2026"
+__version__ = "v0.6"
+
+# IMPORTS
+import sys
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from termcolor import colored
+
+# Priority of background tasks that should only use the cores no other task needs
+BACKGROUND_PRIORITY = -1
+
+
+class Task:
+    """Small class holding everything the scheduler needs to know about a single task."""
+    def __init__(self, name, function, arguments, dependencies, cores, group, priority,
+                 slots=1):
+        """
+        Constructor for the Task class
+
+        :param name: Unique name of the task, other tasks use it to depend on this task
+        :param function: The function that needs to be run for this task
+        :param arguments: A tuple with the arguments the function needs to be called with
+        :param dependencies: The names of the tasks that need to be finished before this one
+        :param cores: The amount of cores the task will use while it is running
+        :param group: The name of the group of tasks this task belongs to (or None)
+        :param priority: Tasks with a higher priority are started first
+        :param slots: The amount of places in the group the task takes while it is running
+        """
+        self.name = name
+        self.function = function
+        self.arguments = arguments
+        self.dependencies = set(dependencies)
+        self.cores = cores
+        self.group = group
+        self.priority = priority
+        self.slots = slots
+
+
+class TaskResult:
+    """Placeholder argument that is replaced by the return value of a task when it is started."""
+    def __init__(self, name):
+        """
+        Constructor for the TaskResult class
+
+        :param name: The name of the task whose return value is used
+        """
+        self.name = name
+
+
+class Scheduler:
+    """
+    Class to run a graph of tasks with multiprocessing within a core budget.
+    Tasks are started in the order of their priority and then the order they were added,
+    as soon as all their dependencies are done.
+    """
+    def __init__(self, cores):
+        """
+        Constructor for the Scheduler class
+
+        :param cores: The total amount of cores all running tasks together are allowed to use
+        """
+        self.cores = cores
+        self.tasks = dict()
+        self.group_limits = dict()
+
+    def limit_group(self, group, max_running):
+        """
+        Limits the amount of tasks of a group that are allowed to run at the same time,
+        for example because every task of the group needs a lot of memory.
+
+        :param group: The name of the group of tasks
+        :param max_running: The maximum amount of tasks of the group that can run at the same time
+        """
+        self.group_limits[group] = max(max_running, 1)
+
+    def add_task(self, name, function, arguments=(), dependencies=(), cores=1, group=None,
+                 priority=0, slots=1):
+        """
+        Adds a task to the graph, the tasks it depends on need to be added before it.
+
+        :param name: Unique name of the task, other tasks use it to depend on this task
+        :param function: The function that needs to be run for this task
+        :param arguments: A tuple with the arguments the function needs to be called with
+        :param dependencies: The names of the tasks that need to be finished before this one
+        :param cores: The amount of cores the task will use (capped at the core budget)
+        :param group: The name of the group of tasks this task belongs to (optional)
+        :param priority: Tasks with a higher priority are started first, use BACKGROUND_PRIORITY
+                         for background tasks that should only use cores nothing else needs
+                         (they need to lower their own CPU priority)
+        :param slots: The amount of places in the group the task takes while it is running,
+                      for tasks that run multiple processes of the group at once (default 1)
+        :return: The name of the task so it can directly be used as a dependency
+        """
+        if name in self.tasks:
+            raise ValueError(f"A task with the name '{name}' has already been added")
+        unknown = [dependency for dependency in dependencies if dependency not in self.tasks]
+        if unknown:
+            raise ValueError(f"Task '{name}' depends on unknown task(s): {', '.join(unknown)}")
+
+        missing = [argument.name for argument in arguments
+                   if isinstance(argument, TaskResult) and argument.name not in dependencies]
+        if missing:
+            raise ValueError(f"Task '{name}' uses the result of task(s) it does not depend on: "
+                             f"{', '.join(missing)}")
+
+        cores = min(max(cores, 1), self.cores)
+        self.tasks[name] = Task(name, function, tuple(arguments), dependencies, cores, group,
+                                priority, slots)
+        return name
+
+    @staticmethod
+    def result_of(name):
+        """
+        Creates an argument that is replaced by the return value of a task, the task that
+        gets it as an argument needs to depend on that task.
+
+        :param name: The name of the task whose return value is used
+        :return: The placeholder argument
+        """
+        return TaskResult(name)
+
+    def run(self):
+        """
+        Runs all the tasks of the graph, starting every task as soon as it is able to.
+        When a task fails all the tasks that depend on it (in)directly will be skipped.
+
+        :return: A list with the names of all the tasks that failed or were skipped
+        """
+        pending = sorted(self.tasks.values(), key=lambda task: -task.priority)
+        finished = set()
+        results = dict()
+        failed = list()
+        running = dict()
+        free_cores = self.cores
+        background_cores = 0
+
+        # Background tasks can run next to a full core budget of other tasks
+        with ProcessPoolExecutor(max_workers=2 * self.cores) as executor:
+            while pending or running:
+                # Skip the tasks that can never run because something they depend on failed
+                for task in [task for task in pending if task.dependencies.intersection(failed)]:
+                    pending.remove(task)
+                    failed.append(task.name)
+                    self._print_warning(f"Skipped '{task.name}' because a task it "
+                                        f"depends on did not finish")
+
+                # Start every task that is ready and still fits within the core budget,
+                # tasks with a lower priority can not take the cores a waiting task needs
+                # and only background tasks have to wait for the cores of background tasks
+                waiting_priority = None
+                for task in [task for task in pending if task.dependencies <= finished]:
+                    if waiting_priority is not None and task.priority < waiting_priority:
+                        break
+                    background = task.priority <= BACKGROUND_PRIORITY
+                    if task.cores > free_cores + (0 if background else background_cores):
+                        waiting_priority = task.priority
+                    elif self._group_has_room(task, running):
+                        pending.remove(task)
+                        free_cores -= task.cores
+                        if background:
+                            background_cores += task.cores
+                        arguments = [results[argument.name] if isinstance(argument, TaskResult)
+                                     else argument for argument in task.arguments]
+                        future = executor.submit(task.function, *arguments)
+                        running[future] = task
+
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    free_cores += task.cores
+                    if task.priority <= BACKGROUND_PRIORITY:
+                        background_cores -= task.cores
+                    if future.exception() is not None:
+                        failed.append(task.name)
+                        self._print_warning(f"Task '{task.name}' failed: {future.exception()}")
+                    else:
+                        finished.add(task.name)
+                        results[task.name] = future.result()
+        return failed
+
+    def _group_has_room(self, task, running):
+        """
+        Checks if another task of the group of the given task is allowed to start.
+        A task that takes more places than the group has can still start when the group is empty.
+
+        :param task: The task that is ready to be started
+        :param running: A dictionary with all the running tasks as values
+        :return: True if the task is allowed to start, otherwise False
+        """
+        if task.group not in self.group_limits:
+            return True
+        running_in_group = sum(other.slots for other in running.values()
+                               if other.group == task.group)
+        return running_in_group == 0 or \
+            running_in_group + task.slots <= self.group_limits[task.group]
+
+    @staticmethod
+    def _print_warning(text):
+        """Prints a warning about a task in the same format the rest of the pipeline uses"""
+        warning = colored("WARNING", "yellow")
+        print(f"\t[{warning}] {text}")
+
+
+# MAIN
+def main():
+    """Main function to test functionality of the module"""
+    scheduler = Scheduler(4)
+    first = scheduler.add_task("first", print, ("first task",))
+    second = scheduler.add_task("second", print, ("second task",), cores=2)
+    scheduler.add_task("last", print, ("last task",), dependencies=[first, second])
+    scheduler.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
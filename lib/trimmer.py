@@ -9,30 +9,38 @@ When calling the class it will automatically perform the trimming with the given
 __author__ = "Michael Hagen, Vincent Talen and Joost Numan"
 __status__ = "Development"
 __date__ = "29-01-2021"
-__version__ = "v0.7"
+__version__ = "v1.1"
 
 # IMPORTS
 import sys
 import glob
 import re
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import run
 from termcolor import colored
 import lib.general_functions as gen_func
+from lib.hard_clipper import HardClipper
 
 
 class Trimmer:
     """The Trimmer class is a package to trim files with. It uses multiprocessing."""
-    def __init__(self, trim_values, input_dir, output_dir):
+    def __init__(self, trim_values, input_dir, output_dir, clip_only=False):
         """
         Constructor for the Trimmer class
 
         :param trim_values: None or string with "\"3-5\" (start and end) or \"3\" (end only)"
         :param input_dir: The directory with all the files you want you use the trimmer on
         :param output_dir: The directory where all the output files need to be saved in
+        :param clip_only: Only clip the trim values off the reads with the HardClipper,
+                          without the adapter and quality trimming of TrimGalore
         """
         self.input_files = [file for file in glob.glob(input_dir + "*.gz")]
         self.output_dir = output_dir
+        self.clip_only = clip_only
+        self.threads = 1
+        self.pairs = list()
+        self.mates = dict()
 
         self.trim_values = trim_values
         self.value_type = self.check_trim_values()
@@ -43,7 +51,37 @@ class Trimmer:
 
         :param cores: The amount of cores the trimmer needs to use
         """
-        gen_func.process_files(cores, self.trim_file, self.input_files)
+        units = self.get_units()
+        self.threads = gen_func.calculate_threads(cores, len(units))
+        gen_func.process_files(max(cores // self.threads, 1), self.trim_unit, units)
+
+    def set_pairs(self, pairs):
+        """
+        Sets the pairs of input files, the files of a pair are trimmed together in one pass
+        so their reads stay in the same order.
+
+        :param pairs: A list containing lists with the input files of a pair (read 1 first)
+        """
+        self.pairs = [list(pair) for pair in pairs]
+        self.mates = {file: str(side) for pair in self.pairs
+                      for side, file in enumerate(pair, start=1)}
+
+    def get_units(self):
+        """
+        Gets the files that are trimmed together, the files of a pair or a single file.
+
+        :return: A list containing lists with the files of a pair or a single file
+        """
+        return [*self.pairs, *[[file] for file in self.input_files if file not in self.mates]]
+
+    def get_galore_cores(self):
+        """
+        Calculates the value for the --cores option of TrimGalore that fits in the threads.
+        With --cores N TrimGalore uses about 3N + 3 cores (reading, cutadapt, writing and itself).
+
+        :return: The amount of cores to give to TrimGalore
+        """
+        return max((self.threads - 3) // 3, 1)
 
     def check_trim_values(self):
         """
@@ -82,37 +120,145 @@ class Trimmer:
                 sys.exit(1)
         return value_type
 
-    def trim_file(self, file):
+    @staticmethod
+    def get_clean_name(file):
+        """
+        Gets the name of a file without directories and without the (compression) extensions.
+
+        :param file: Name of the file with directories
+        :return: The name of the file without directories and extensions
+        """
+        file_path = Path(file).stem
+        return Path(file_path).stem
+
+    def get_trimmed_file(self, file, compressed=True):
+        """
+        Gets the name of the file TrimGalore will create when trimming the given file,
+        the files of a pair get the name of the validated files (_val_1 and _val_2).
+
+        :param file: Name of the input file with directories
+        :param compressed: If the trimmed file is gzipped or not
+        :return: Name of the trimmed file with directories
+        """
+        clean_name = self.get_clean_name(file)
+        extension = ".fq.gz" if compressed else ".fq"
+        suffix = f"_val_{self.mates[file]}" if file in self.mates else "_trimmed"
+        return f"{self.output_dir}/Preprocessing/trimmed/{clean_name}{suffix}{extension}"
+
+    def trim_unit(self, files, compress=True):
+        """
+        Trims a single file or both files of a pair.
+
+        :param files: A list with a single file or both files of a pair
+        :param compress: If the trimmed files need to be gzipped
+        """
+        if len(files) == 2:
+            self.trim_pair(files, compress)
+        else:
+            self.trim_file(files[0], compress)
+
+    def trim_file(self, file, compress=True):
         """
         This method performs the trimming on a file, based on the user specified trim values
         it uses different parameters for the trimming tool.
 
         :param file: Name of the file you want to trim with directories.
+        :param compress: If the trimmed file needs to be gzipped, which is not needed when it
+                         is a named pipe another tool reads from
         """
-        file_path = Path(file).stem
-        clean_name = Path(file_path).stem
+        if self.clip_only:
+            self.clip_file(file, compress)
+            return
+        self.run_galore([file], compress)
+
+    def trim_pair(self, files, compress=True):
+        """
+        This method trims both files of a pair in one TrimGalore process (--paired),
+        the pairs of reads of which one read became too short are removed from both files
+        so the reads of the validated files stay in the same order.
+
+        :param files: A list with both files of a pair, read 1 first
+        :param compress: If the trimmed files need to be gzipped
+        """
+        if self.clip_only:
+            self.clip_pair(files, compress)
+            return
+        self.run_galore(files, compress)
+
+    def run_galore(self, files, compress=True):
+        """
+        Runs TrimGalore on a single file or on both files of a pair.
+
+        :param files: A list with a single file or both files of a pair
+        :param compress: If the trimmed files need to be gzipped
+        """
+        clean_name = "_".join(self.get_clean_name(file) for file in files)
         gen_func.print_tool(clean_name, "s", "trimming process")
         trimmed_dir = f"{self.output_dir}/Preprocessing/trimmed/"
-        galore_loc = "lib/TrimGalore-0.6.6/trim_galore"
-
-        if self.value_type == 1:  # Don't trim ends
-            galore_query = [galore_loc, file, "-o", trimmed_dir]
+        galore_query = ["lib/TrimGalore-0.6.6/trim_galore", *files, "-o", trimmed_dir]
+        if len(files) == 2:
+            galore_query.append("--paired")
 
-        elif self.value_type == 2:  # Both 3'- and 5' end
+        # The clip values are given for both reads of a pair
+        reads = ["R1", "R2"][:len(files)]
+        if self.value_type == 2:  # Both 3'- and 5' end
             trim_list = self.trim_values.split("-")
-            galore_query = [galore_loc, file, "-o", trimmed_dir,
-                            "--clip_R1", trim_list[0], "--three_prime_clip_R1", trim_list[1]]
+            for read in reads:
+                galore_query.extend([f"--clip_{read}", trim_list[0],
+                                     f"--three_prime_clip_{read}", trim_list[1]])
 
         elif self.value_type == 3:  # Only 3' end
-            galore_query = [galore_loc, file, "-o", trimmed_dir,
-                            "--three_prime_clip_R1", self.trim_values]
+            for read in reads:
+                galore_query.extend([f"--three_prime_clip_{read}", self.trim_values])
 
+        if self.get_galore_cores() > 1:
+            galore_query.extend(["--cores", str(self.get_galore_cores())])
+        if not compress:
+            galore_query.append("--dont_gzip")
         executed_process = run(galore_query, capture_output=True, text=True)
 
         save_tool_dir = f"{self.output_dir}/tool_logs/preprocessing"
         gen_func.save_tool_log(executed_process, f"{save_tool_dir}/{clean_name}_trimmed.log")
         gen_func.print_tool(clean_name, "f", "trimming process")
 
+    def clip_file(self, file, compress=True):
+        """
+        This method clips the trim values off the reads of a file with the HardClipper.
+
+        :param file: Name of the file you want to clip with directories.
+        :param compress: If the clipped file needs to be gzipped
+        """
+        clean_name = self.get_clean_name(file)
+        gen_func.print_tool(clean_name, "s", "clipping process")
+
+        five_prime, three_prime = 0, 0
+        if self.value_type == 2:  # Both 3'- and 5' end
+            five_prime, three_prime = [int(value) for value in self.trim_values.split("-")]
+        elif self.value_type == 3:  # Only 3' end
+            three_prime = int(self.trim_values)
+
+        clipper = HardClipper(five_prime, three_prime, self.threads)
+        reads, clipped_bases = clipper.clip_file(
+            file, self.get_trimmed_file(file, compress), compress)
+
+        save_tool_dir = f"{self.output_dir}/tool_logs/preprocessing"
+        with open(f"{save_tool_dir}/{clean_name}_clipped.log", "w") as opened_log_file:
+            opened_log_file.write(f"Clipped {five_prime} bases of the 5' end and {three_prime} "
+                                  f"bases of the 3' end of {reads} reads "
+                                  f"({clipped_bases} bases in total)\n")
+        gen_func.print_tool(clean_name, "f", "clipping process")
+
+    def clip_pair(self, files, compress=True):
+        """
+        Clips both files of a pair at the same time. The HardClipper keeps every read,
+        so the clipped files of a pair keep the same reads in the same order.
+
+        :param files: A list with both files of a pair
+        :param compress: If the clipped files need to be gzipped
+        """
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(self.clip_file, files, [compress] * 2))
+
 
 def main():
     """Main function to test the module"""
@@ -9,7 +9,7 @@ From here all the modules will be used in correct order to form the pipeline and
 __author__ = "Vincent Talen"
 __status__ = "Development"
 __date__ = "29-01-2021"
-__version__ = "v0.4.2"
+__version__ = "v1.15"
 
 # IMPORTS
 import sys
@@ -19,14 +19,21 @@ from datetime import datetime
 from multiprocessing import cpu_count
 from termcolor import colored
 
-from lib.alignment import Alignment
+from lib.alignment import Alignment, CHUNK_THREADS
+from lib.annotation_cache import prepare_annotation
 from lib.bam_processing import BamProcessing
 from lib.count_matrix import run_feature_counts
 from lib.directories import CreateDirs
 from lib.genome_download import DownloadGenomeInfo
+from lib.genome_registry import GENOMES, get_genome
+from lib.reference_cache import ReferenceCache, DEFAULT_CACHE_DIR
 from lib.multiqc import perform_multiqc
+from lib.pairing import FilePairer
+from lib.picard_runner import PicardRunner, MIN_HEAP_SIZE, HEAP_FRACTION
 from lib.qualitycheck import QualityCheck
+from lib.scheduler import Scheduler, BACKGROUND_PRIORITY
 from lib.trimmer import Trimmer
+import lib.general_functions as gen_func
 
 
 # FUNCTIONS
@@ -55,17 +62,69 @@ def create_parser():
                              "If you want to only trim the 3' end only give 1 integer and for"
                              "trimming both ends give 'int-int'."
                              "If you don't want to trim simply don't use this argument")
+    parser.add_argument("--clip_only", required=False, action="store_true",
+                        help="Only clip the bases given with -t off the reads, without the "
+                             "adapter and quality trimming of TrimGalore (much faster)")
+    parser.add_argument("--qc_engine", required=False, default="fastqc",
+                        choices=["fastqc", "native"],
+                        help="Tool used for the quality check, the native engine is a lot "
+                             "faster and its results are also shown by MultiQC "
+                             "(Defaults to fastqc)")
+    parser.add_argument("--preview", required=False, type=int, metavar="READS",
+                        help="Only check the quality of this amount of reads of every file, "
+                             "print the summaries and stop (nothing else is run)")
+    parser.add_argument("--preview_sampling", required=False, default="head",
+                        choices=["head", "reservoir"],
+                        help="Check the first reads of every file or a random sample of all "
+                             "the reads (takes longer) for the preview (Defaults to head)")
     parser.add_argument("-c", "--cores", required=False,
                         help="Define the number of cores to be used (optional) "
                              "(Defaults to three-quarters of the systems total amount)")
+    parser.add_argument("--keep_intermediates", required=False, action="store_true",
+                        help="Save the bam file of every processing step instead of piping "
+                             "the steps together and only saving the final bam file")
+    parser.add_argument("--bam_backend", required=False, default="picard",
+                        choices=["picard", "samtools"],
+                        help="Tools used to process the bam files, samtools can use multiple "
+                             "threads per file (Defaults to picard)")
+    parser.add_argument("-g", "--genome", required=False, default="human",
+                        choices=sorted(GENOMES),
+                        help="The organism the reads need to be aligned to (Defaults to human)")
+    parser.add_argument("-m", "--memory", required=False, type=float,
+                        help="Define the amount of memory in gigabytes the pipeline may use "
+                             "(Defaults to three-quarters of the systems total amount)")
+    parser.add_argument("--shared_index", required=False, action="store_true",
+                        help="Memory-map the HISAT2 index so all the concurrent alignments "
+                             "share one copy of it, which allows more alignments at once")
+    parser.add_argument("--batch_threshold", required=False, type=float, default=100,
+                        help="Samples smaller than this amount of megabytes are aligned together "
+                             "in batches so the index is only loaded once per batch, "
+                             "use 0 to align every sample on its own (Defaults to 100)")
+    parser.add_argument("--stream", required=False, action="store_true",
+                        help="Trim the reads straight into the alignment through named pipes "
+                             "instead of writing compressed trimmed files (samples that are "
+                             "aligned in batches or chunks and pairs trimmed by Trim Galore "
+                             "still get trimmed files)")
+    parser.add_argument("--connections", required=False, type=int, default=3,
+                        help="Maximum amount of genome files to download at the same time "
+                             "(Defaults to 3)")
+    parser.add_argument("--reference_cache", required=False, default=DEFAULT_CACHE_DIR,
+                        help="Directory of the genome reference cache shared by all runs "
+                             f"(Defaults to '{DEFAULT_CACHE_DIR}')")
+    parser.add_argument("--cache_size", required=False, type=float, default=100,
+                        help="Maximum amount of gigabytes the reference cache may use, the "
+                             "least recently used genomes are removed when it is exceeded "
+                             "(Defaults to 100)")
 
     args = parser.parse_args()  # Collect the arguments/values
+    if args.clip_only and not args.trim:
+        parser.error("--clip_only needs the amount of bases to clip given with -t")
     return args
 
 
 def fix_core_count(cores):
     """Small function checking given (or not given -> default) core count against system info"""
-    cores = int(cores)
+    cores = int(cores) if cores else 0
     if cores:
         if not cores <= cpu_count():
             if not cpu_count() == 1:
@@ -77,6 +136,14 @@ def fix_core_count(cores):
     return cores
 
 
+def fix_memory(memory):
+    """Small function checking given (or not given -> default) memory against system info"""
+    total_memory = gen_func.get_total_memory()
+    if not memory or memory > total_memory:
+        memory = 0.75 * total_memory  # Default for pipeline
+    return memory
+
+
 def print_status(color, text):
     """
     Function to print the status of a process so the user can see where the pipeline is at.
@@ -97,6 +164,215 @@ def print_status(color, text):
     print(f"[{time}] {string}")
 
 
+def prepare_reference(args, output_dir, cores, keep_genome=True):
+    """
+    Opens the genome in the reference cache and links it into the output directory.
+    If the genome is not in the cache yet all the required files get downloaded into it.
+    Afterwards the least recently used genomes are removed if the cache got too big.
+
+    :param args: The object with all the arguments from the command line
+    :param output_dir: The directory where all the files need to be saved
+    :param cores: The amount of cores that may be used to build a HISAT index
+    :param keep_genome: False if the cached genome files need to be downloaded again
+    :return: The opened cache entry, it needs to be closed when the pipeline is finished with it
+    """
+    genome = get_genome(args.genome)
+    cache = ReferenceCache(args.reference_cache, args.cache_size)
+    key = cache.create_key(genome.assembly, genome.release, genome.links)
+    reference = cache.open_entry(key, refresh=not keep_genome)
+    reference.link(f"{output_dir}/Data/genome")
+
+    # Download all the needed files from the internet
+    if not reference.complete:
+        print_status("c", "Starting downloads of all required genome files")
+        heap_size = PicardRunner.calculate_heap_size(fix_memory(args.memory), 1)
+        genome_info = DownloadGenomeInfo(output_dir, genome, cores, args.connections)
+        genome_info.picard_runner = PicardRunner(heap_size)
+        genome_info.collect_all_genome_info()
+        reference.mark_complete()
+        print_status("g", "Finished downloading all files")
+
+    removed = cache.evict(keep=key)
+    if removed:
+        print_status("", "Removed least recently used genome(s) from the cache: "
+                         f"{', '.join(removed)}")
+    return reference
+
+
+def create_task_graph(args, input_dir, output_dir, cores, reference_key):
+    """
+    Creates the graph with all the tasks of the pipeline for the scheduler.
+    Every file gets its own chain of trimming, alignment and bam processing tasks and
+    the quality check of a file is an independent branch next to it.
+    Only featureCounts and MultiQC wait for all the files to be finished.
+    The quality check of the trimmed files runs in the background with a low priority.
+
+    :param args: The object with all the arguments from the command line
+    :param input_dir: The directory with the files the pipeline needs to run on
+    :param output_dir: The directory where all the files need to be saved
+    :param cores: The amount of cores all the tasks together are allowed to use
+    :param reference_key: The key of the genome in the reference cache
+    :return: A scheduler with all the tasks added to it
+    """
+    scheduler = Scheduler(cores)
+    quality_check = QualityCheck(input_dir, output_dir)
+    trimmer = Trimmer(args.trim, input_dir, output_dir, args.clip_only)
+    genome = get_genome(args.genome)
+    align = Alignment(args.paired, output_dir, genome, args.shared_index)
+    bam_pro = BamProcessing(output_dir, args.keep_intermediates, args.bam_backend)
+
+    # Determine what files need to be aligned together, the headers stay the same after trimming
+    pairer = FilePairer(f"{output_dir}/Data/pairing_manifest.json")
+    file_dict = pairer.read_headers(trimmer.input_files)
+    if args.paired:
+        pairs, single_ended = pairer.create_pairs(file_dict)
+    else:
+        pairs, single_ended = list(), list(file_dict.keys())
+    units = [unit if isinstance(unit, list) else [unit] for unit in [*pairs, *single_ended]]
+    trimmer.set_pairs(pairs)
+    batches, separate = align.create_batches(units, args.batch_threshold)
+
+    # Run FastQC tool on all files to create reports of quality, the files of a pair together
+    qc_files = quality_check.gather_files()
+    if args.qc_engine == "native":
+        # The native engine checks one file per task, the decompressing runs next to it
+        qc_function, qc_units, qc_cores = quality_check.perform_native_qc, list(), 2
+    else:
+        qc_function, qc_cores = quality_check.perform_fastqc, None
+        qc_units = [unit for unit in units if len(unit) == 2 and set(unit) <= set(qc_files)]
+    paired_files = {file for unit in qc_units for file in unit}
+    qc_units.extend([file] for file in qc_files if file not in paired_files)
+    qc_tasks = list()
+    for unit in qc_units:
+        unit_name = "_".join(trimmer.get_clean_name(file) for file in unit)
+        qc_tasks.append(scheduler.add_task(f"qc:{unit_name}", qc_function, (unit,),
+                                           cores=qc_cores or len(unit)))
+
+    # Only as many alignments as fit in the memory can run at the same time,
+    # with room for at least one Picard JVM next to them
+    memory = fix_memory(args.memory)
+    jvm_memory = MIN_HEAP_SIZE / HEAP_FRACTION / 1024 if args.bam_backend == "picard" else 0
+    max_aligners = align.calculate_max_aligners(memory - jvm_memory)
+    scheduler.limit_group("align", max_aligners)
+    align.threads = gen_func.calculate_threads(
+        cores, min(len(batches) + len(separate), max_aligners))
+    if args.bam_backend == "samtools":
+        bam_pro.threads = align.threads
+
+    # The Picard JVMs share the memory the aligners leave over
+    bam_memory = max(memory - align.calculate_aligner_memory(max_aligners), jvm_memory)
+    concurrent_jvms = min(len(units), cores // bam_pro.threads)
+    if args.bam_backend == "picard":
+        concurrent_jvms = min(concurrent_jvms, PicardRunner.calculate_max_jvms(bam_memory))
+        scheduler.limit_group("bam", concurrent_jvms)
+    heap_size = PicardRunner.calculate_heap_size(bam_memory, concurrent_jvms)
+    bam_pro.picard_runner = PicardRunner(heap_size)
+
+    # Samples that are aligned on their own in one piece can be trimmed straight into hisat2,
+    # except pairs trimmed by Trim Galore (it only validates the pairs after trimming both files)
+    streamed_files = set()
+    if args.stream:
+        streamed_files = {file for files in separate for file in files
+                          if min(align.calculate_chunks(files, cores), max_aligners) == 1
+                          and (len(files) == 1 or args.clip_only)}
+
+    # Trim the data. (Adapter/primer), every file (or pair) gets a part of the cores
+    trim_units = trimmer.get_units()
+    trimmer.threads = gen_func.calculate_threads(cores, len(trim_units))
+    trim_tasks = dict()
+    for unit in trim_units:
+        if not streamed_files.intersection(unit):
+            unit_name = "_".join(trimmer.get_clean_name(file) for file in unit)
+            trim_task = scheduler.add_task(f"trim:{unit_name}", trimmer.trim_unit, (unit,),
+                                           cores=trimmer.threads)
+            trim_tasks.update(dict.fromkeys(unit, trim_task))
+
+    # Check the quality of the trimmed files in the background, only with the cores that
+    # the trimming, alignment and bam processing are not waiting for
+    for unit in qc_units:
+        if all(file in trim_tasks for file in unit):
+            unit_name = "_".join(trimmer.get_clean_name(file) for file in unit)
+            trimmed_files = [trimmer.get_trimmed_file(file) for file in unit]
+            qc_tasks.append(scheduler.add_task(
+                f"qc_trimmed:{unit_name}", qc_function, (trimmed_files, True),
+                [trim_tasks[file] for file in unit], qc_cores or len(unit),
+                priority=BACKGROUND_PRIORITY))
+
+    # Perform actual alignment to create BAM maps (with genomeHiSat2)
+    align_tasks = dict()
+    alignments = dict()  # How every sample is aligned, the counts are cached by it as well
+    for batch in batches:
+        trimmed_units = [[trimmer.get_trimmed_file(file) for file in unit] for unit in batch]
+        batch_task = scheduler.add_task(
+            f"align:batch:{align.get_aligned_name(batch[0])}", align.align_batch,
+            (trimmed_units,), [trim_tasks[file] for unit in batch for file in unit],
+            align.threads, group="align")
+        for unit in batch:
+            align_tasks[align.get_aligned_name(unit)] = batch_task
+            alignments[align.get_aligned_name(unit)] = "batch"
+
+    for files in separate:
+        aligned_name = align.get_aligned_name(files)
+        trimmed_files = [trimmer.get_trimmed_file(file) for file in files]
+        trim_dependencies = [trim_tasks[file] for file in files if file in trim_tasks]
+
+        # Large samples are split into chunks that are aligned at the same time and merged after
+        # (streamed into the aligners while the sample is split, so they need to run together)
+        chunks = min(align.calculate_chunks(files, cores), max_aligners)
+        if chunks > 1:
+            chunks_task = scheduler.add_task(f"align:{aligned_name}:chunks", align.align_chunks,
+                                             (trimmed_files, chunks), trim_dependencies,
+                                             chunks * CHUNK_THREADS + len(files), group="align",
+                                             slots=chunks)
+            align_tasks[aligned_name] = scheduler.add_task(
+                f"gather:{aligned_name}", align.gather_chunks, (trimmed_files, chunks),
+                [chunks_task])
+            alignments[aligned_name] = "chunks"
+            continue
+
+        if streamed_files.intersection(files):
+            align_tasks[aligned_name] = scheduler.add_task(
+                f"align:{aligned_name}", align.align_trimming, (trimmer, files), (),
+                align.threads + trimmer.threads, group="align")
+            alignments[aligned_name] = "streamed"
+            continue
+
+        if len(trimmed_files) == 2:
+            align_function, align_input = align.align_pair, trimmed_files
+        else:
+            align_function, align_input = align.align_single, trimmed_files[0]
+        align_tasks[aligned_name] = scheduler.add_task(
+            f"align:{aligned_name}", align_function, (align_input,),
+            trim_dependencies, align.threads, group="align")
+        alignments[aligned_name] = "single"
+
+    # Preprocess the mapped data
+    bam_tasks = list()
+    for unit in units:
+        aligned_name = align.get_aligned_name(unit)
+        bam_tasks.append(scheduler.add_task(f"bam:{aligned_name}", bam_pro.process_file,
+                                            (aligned_name,), [align_tasks[aligned_name]],
+                                            bam_pro.threads, group="bam"))
+
+    # The annotation is converted for featureCounts (once per GTF file) next to the alignments
+    annotation_task = scheduler.add_task("annotation", prepare_annotation, (output_dir, genome))
+
+    # With the final sorted bam alignments and genome annotation create a matrix (featureCounts),
+    # the counts are cached by the input files, the settings that change the alignments
+    # and how every sample was aligned
+    samples = {align.get_aligned_name(unit): unit for unit in units}
+    settings = {"genome": reference_key, "trim": args.trim, "clip_only": args.clip_only,
+                "paired": args.paired, "bam_backend": args.bam_backend}
+    count_task = scheduler.add_task("featureCounts", run_feature_counts,
+                                    (cores, output_dir, scheduler.result_of(annotation_task),
+                                     samples, settings, alignments),
+                                    [*bam_tasks, annotation_task], cores)
+
+    # Run the MultiQC creating a HTML report with bam alignment and log files
+    scheduler.add_task("MultiQC", perform_multiqc, (output_dir,), [count_task, *qc_tasks])
+    return scheduler
+
+
 # MAIN
 def main():
     """Main function calling forth all tasks"""
@@ -113,53 +389,32 @@ def main():
     else:
         input_dir = args.input_directory
 
+    # Only check a sample of the reads of every file and stop
+    if args.preview:
+        print_status("c", f"Previewing the quality of {args.preview} reads per file")
+        QualityCheck(input_dir, output_dir).preview(fix_core_count(args.cores), args.preview,
+                                                    args.preview_sampling)
+        print_status("g", "Finished the preview")
+        return 0
+
     # Create all the directories we'll be using
     print_status("c", "Preparing everything for pipeline usage and emptying + creating directories")
     create_dirs = CreateDirs(output_dir)
-    download_genome = create_dirs.create_all_dirs()
+    keep_genome = create_dirs.create_all_dirs()
     cores = fix_core_count(args.cores)  # Determine the to be used core count
 
-    # Download all the needed files from the internet
-    # If files were already found only download the user doesn't want to keep the existing ones
-    if download_genome:
-        print_status("c", "Starting downloads of all required genome files")
-        genome_info = DownloadGenomeInfo(output_dir)
-        genome_info.collect_all_genome_info()
-        print_status("g", "Finished downloading all files")
-
-    # Run FastQC tool on all files to create reports of quality
-    print_status("c", "Starting Quality Check")
-    quality_check = QualityCheck(input_dir, output_dir)
-    quality_check.run_qualitycheck(cores)
-    print_status("g", "Finished Quality Check")
-
-    # Trim the data. (Adapter/primer)
-    print_status("c", "Starting Trimmer")
-    trimmer = Trimmer(args.trim, input_dir, output_dir)
-    trimmer.run_trimmer(cores)
-    print_status("g", "Finished Trimmer")
+    # Link the genome files from the reference cache, they only get downloaded if not cached yet
+    reference = prepare_reference(args, output_dir, cores, keep_genome)
 
-    # Perform actual alignment to create BAM maps (with genomeHiSat2)
-    print_status("c", "Starting Alignment")
-    align = Alignment(args.paired, output_dir)
-    align.perform_alignment(cores)
-    print_status("g", "Finished Alignment")
-
-    # Preprocess all the mapped data
-    print_status("c", "Preprocessing bam files")
-    bam_pro = BamProcessing(output_dir)
-    bam_pro.perform_preprocessing(cores)
-    print_status("g", "Finished preprocessing bam files")
-
-    # With the final sorted bam alignment and genome annotation create a matrix (featureCounts)
-    print_status("c", "Starting featureCounts to create count matrix")
-    run_feature_counts(cores, output_dir)
-    print_status("g", "Finished creating count matrix")
+    # Every file goes through its own steps as soon as its previous step is done
+    print_status("c", "Starting quality check, trimming, alignment and bam processing per file")
+    scheduler = create_task_graph(args, input_dir, output_dir, cores, reference.key)
+    failed_tasks = scheduler.run()
+    if failed_tasks:
+        print_status("", f"{len(failed_tasks)} task(s) did not finish: {', '.join(failed_tasks)}")
+    print_status("g", "Finished all tasks, count matrix and summary report have been created")
 
-    # Run the MultiQC creating a HTML report with bam alignment and log files
-    print_status("c", "Starting MultiQC to create summary report")
-    perform_multiqc(output_dir)
-    print_status("g", "Finished summary report")
+    reference.close()
 
     finished = colored("Pipeline finished!", "green")
     print(f"{finished} Output created in '{output_dir}'")
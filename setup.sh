@@ -6,6 +6,8 @@ echo 'Done installing hisat2, installing cutadapt'
 sudo apt-get install cutadapt;
 echo 'Done installing cutadapt, installing samtools'
 sudo apt-get install samtools;
-echo 'Done installing samtools, installing required python packages'
+echo 'Done installing samtools, installing the Java development kit (11 or newer) for Picard'
+sudo apt-get install default-jdk;
+echo 'Done installing the Java development kit, installing required python packages'
 sudo pip install -r requirements.txt
 echo 'Done installing everything that is needed for the pipeline'
\ No newline at end of file
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+"""
+Tests of converting the GTF annotation into the flattened SAF annotation for featureCounts,
+and of reusing the SAF file as long as the GTF file does not change.
+"""
+
+# METADATA VARIABLES
+__author__ = "Vincent Talen"
+__status__ = "Development"
+__date__ = "17-10-2026"
+__version__ = "v0.1"
+
+# IMPORTS
+import os
+import pytest
+import lib.annotation_cache as annotation_cache
+from lib.annotation_cache import prepare_annotation, convert_gtf_to_saf
+from lib.genome_registry import Genome
+
+GTF_LINES = [
+    ("1", "gene", 100, 900, "+", "G1"),
+    ("1", "exon", 100, 200, "+", "G1"),
+    ("1", "exon", 150, 300, "+", "G1"),  # Overlaps the first exon
+    ("1", "exon", 300, 400, "+", "G1"),  # Starts where the merged exon ends
+    ("1", "exon", 401, 500, "+", "G1"),  # Right next to it, but not overlapping
+    ("2", "exon", 120, 180, "+", "G1"),  # Same gene on another chromosome
+    ("1", "exon", 160, 260, "-", "G1"),  # Same gene on the other strand
+    ("1", "exon", 50, 80, "-", "G2"),
+    ("1", "CDS", 50, 70, "-", "G2"),
+    ("1", "exon", 10, 60, "-", "G2"),
+]
+
+
+def write_gtf(gtf_file, lines):
+    """Writes the lines (chromosome, feature, start, end, strand, gene) as a GTF file"""
+    with open(gtf_file, "w") as opened_gtf:
+        opened_gtf.write("#!genome-build Test\n")
+        for chromosome, feature, start, end, strand, gene in lines:
+            opened_gtf.write(f"{chromosome}\ttest\t{feature}\t{start}\t{end}\t.\t{strand}\t.\t"
+                             f'gene_id "{gene}"; transcript_id "{gene}.1";\n')
+
+
+def test_exons_are_merged_per_gene_chromosome_and_strand(tmp_path):
+    """Overlapping exons of a gene are merged, but only on the same chromosome and strand"""
+    write_gtf(tmp_path / "ann.gtf", GTF_LINES)
+    convert_gtf_to_saf(str(tmp_path / "ann.gtf"), str(tmp_path / "ann.saf"))
+
+    lines = (tmp_path / "ann.saf").read_text().splitlines()
+    assert lines[0] == "GeneID\tChr\tStart\tEnd\tStrand"
+    assert [line.split("\t") for line in lines[1:]] == [
+        ["G1", "1", "100", "400", "+"], ["G1", "1", "401", "500", "+"],
+        ["G1", "2", "120", "180", "+"], ["G1", "1", "160", "260", "-"],
+        ["G2", "1", "10", "80", "-"]]
+
+
+@pytest.fixture
+def output_dir(tmp_path):
+    """Creates an output directory with a GTF file and the genome it belongs to"""
+    (tmp_path / "Data/genome").mkdir(parents=True)
+    write_gtf(tmp_path / "Data/genome/ann.gtf", GTF_LINES)
+    return tmp_path, Genome("Test", "1", "http://test/ref.fa.gz", "http://test/ann.gtf.gz")
+
+
+def test_saf_file_is_reused_until_the_gtf_changes(output_dir, monkeypatch):
+    """The GTF file is only hashed and converted again when its size or mtime changed"""
+    output_dir, genome = output_dir
+    saf_file = prepare_annotation(str(output_dir), genome)
+    assert os.path.isfile(saf_file)
+
+    conversions = list()
+    convert = annotation_cache.convert_gtf_to_saf
+    monkeypatch.setattr(annotation_cache, "convert_gtf_to_saf",
+                        lambda *files: conversions.append(files) or convert(*files))
+    monkeypatch.setattr(annotation_cache, "hashlib", None)  # Hashing the GTF file would fail
+    assert prepare_annotation(str(output_dir), genome) == saf_file
+    assert conversions == []
+
+    monkeypatch.undo()
+    write_gtf(output_dir / "Data/genome/ann.gtf", GTF_LINES[:3])
+    new_saf_file = prepare_annotation(str(output_dir), genome)
+    assert new_saf_file != saf_file
+    # The annotation of the old GTF file is removed
+    assert sorted(os.listdir(output_dir / "Data/genome")) == \
+        sorted(["ann.gtf", "ann.checksum.json", os.path.basename(new_saf_file)])
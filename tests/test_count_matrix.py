@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+"""
+Offline tests of the cached counting of the samples, featureCounts is replaced by a script
+that counts the alignment lines of the stand-in bam files and records every sample it counts.
+The NumPy count store is tested on its own as well.
+"""
+
+# METADATA VARIABLES
+__author__ = "Vincent Talen"
+__status__ = "Development"
+__date__ = "17-10-2026"
+__version__ = "v0.3"
+
+# IMPORTS
+import os
+import sys
+import gzip
+import numpy as np
+import pytest
+from lib.count_matrix import run_feature_counts, write_count_store, CountMatrix
+
+STAND_IN_FEATURE_COUNTS = f"""#!{sys.executable}
+import sys
+arguments = sys.argv[1:]
+output, bam = arguments[arguments.index("-o") + 1], arguments[-1]
+with open("feature_counts_calls.txt", "a") as opened_calls:
+    opened_calls.write(bam + "\\n")
+with open(bam) as opened_bam:
+    reads = sum(1 for line in opened_bam if not line.startswith("@"))
+with open(output, "w") as opened_output:
+    opened_output.write("# Program:featureCounts v2.0.1\\n")
+    opened_output.write(f"Geneid\\tChr\\tStart\\tEnd\\tStrand\\tLength\\t{{bam}}\\n")
+    opened_output.write(f"G1\\t1\\t1\\t4\\t+\\t4\\t{{reads}}\\n")
+with open(f"{{output}}.summary", "w") as opened_summary:
+    opened_summary.write(f"Status\\t{{bam}}\\nAssigned\\t{{reads}}\\n")
+"""
+SETTINGS = {"genome": "GRCh38.102", "trim": None, "clip_only": False, "paired": False,
+            "bam_backend": "picard"}
+
+
+@pytest.fixture
+def output_dir(tmp_path, monkeypatch):
+    """Creates an output directory with an annotation and the stand-in featureCounts"""
+    monkeypatch.chdir(tmp_path)
+    for directory in ["out/Data/genome", "out/Data/counts", "out/Preprocessing/markDuplicates",
+                      "out/tool_logs/feature_counts", "raw", "lib/Subread-2.0.1/bin"]:
+        (tmp_path / directory).mkdir(parents=True)
+    (tmp_path / "out/Data/genome/ann.abc.saf").write_text("GeneID\tChr\tStart\tEnd\tStrand\n"
+                                                          "G1\t1\t1\t4\t+\n")
+    feature_counts = tmp_path / "lib/Subread-2.0.1/bin/featureCounts"
+    feature_counts.write_text(STAND_IN_FEATURE_COUNTS)
+    feature_counts.chmod(0o755)
+    return tmp_path / "out"
+
+
+def add_samples(output_dir, names, threads):
+    """
+    Creates the input file (unless it exists) and the processed bam file of samples,
+    the header of the bam file holds the amount of hisat2 threads like a real one does.
+    """
+    samples = dict()
+    for reads, name in enumerate(names, start=1):
+        input_file = output_dir.parent / f"raw/{name}.fastq.gz"
+        if not input_file.exists():
+            with gzip.open(input_file, "wt") as opened_input:
+                opened_input.write(f"@{name}\nACGT\n+\nIIII\n" * reads)
+        bam_file = output_dir / f"Preprocessing/markDuplicates/{name}_aligned_sorted.bam"
+        bam_file.write_text(f"@PG\tID:hisat2\tCL:hisat2 -p {threads}\n" + "read\n" * reads)
+        samples[f"{name}_aligned"] = [str(input_file)]
+    return samples
+
+
+def count(output_dir, samples, settings=None, alignments=None):
+    """Runs the counting of the samples and gets the samples featureCounts counted"""
+    calls_file = output_dir.parent / "feature_counts_calls.txt"
+    calls_file.write_text("")
+    run_feature_counts(4, str(output_dir), str(output_dir / "Data/genome/ann.abc.saf"), samples,
+                       settings or SETTINGS, alignments)
+    return [line.split("/")[-1] for line in calls_file.read_text().splitlines()]
+
+
+def test_rerun_with_extra_sample_counts_one_sample(output_dir):
+    """Samples that were counted before are taken from the cache, even with new bam headers"""
+    assert count(output_dir, add_samples(output_dir, ["A", "B"], 8)) == \
+        ["A_aligned_sorted.bam", "B_aligned_sorted.bam"]
+
+    # The hisat2 threads differ in the rerun, so the bam files of A and B are not the same
+    assert count(output_dir, add_samples(output_dir, ["A", "B", "C"], 5)) == \
+        ["C_aligned_sorted.bam"]
+    matrix = CountMatrix(str(output_dir / "Data/counts/geneCounts"))
+    assert matrix.get_samples(["A", "B", "C"]).tolist() == [[1, 2, 3]]
+
+
+def test_changed_settings_count_again(output_dir):
+    """Samples are counted again when they are processed with different settings"""
+    samples = add_samples(output_dir, ["A", "B"], 8)
+    count(output_dir, samples)
+
+    assert len(count(output_dir, samples, {**SETTINGS, "trim": "3-5"})) == 2
+    assert count(output_dir, samples) == []
+
+
+def test_changed_inputs_count_again(output_dir):
+    """Samples are counted again when the size or modification time of an input file changed"""
+    samples = add_samples(output_dir, ["A", "B"], 8)
+    count(output_dir, samples)
+
+    input_file = samples["B_aligned"][0]
+    os.utime(input_file, ns=(0, os.stat(input_file).st_mtime_ns + 1))
+    assert count(output_dir, samples) == ["B_aligned_sorted.bam"]
+
+
+def test_changed_alignment_counts_again(output_dir):
+    """Samples are counted again when they were aligned in another way"""
+    samples = add_samples(output_dir, ["A", "B"], 8)
+    count(output_dir, samples, alignments={"A_aligned": "batch", "B_aligned": "batch"})
+
+    assert count(output_dir, samples, alignments={"A_aligned": "batch",
+                                                  "B_aligned": "chunks"}) == \
+        ["B_aligned_sorted.bam"]
+
+
+@pytest.fixture
+def count_store(tmp_path):
+    """Writes a count store with 4 genes and 3 samples"""
+    counts = np.arange(12, dtype=np.int64).reshape(4, 3)
+    prefix = str(tmp_path / "geneCounts")
+    write_count_store(prefix, ["G1", "G2", "G3", "G4"], ["S1", "S2", "S3"], counts)
+    return prefix, counts
+
+
+def test_count_store_round_trip(count_store):
+    """Slices of genes and samples are loaded in the asked order"""
+    prefix, counts = count_store
+    matrix = CountMatrix(prefix)
+    assert matrix.counts.dtype == np.uint32
+    assert matrix.get_samples(["S3", "S1"]).tolist() == counts[:, [2, 0]].tolist()
+    assert matrix.get_genes(["G2"]).tolist() == counts[[1], :].tolist()
+    assert matrix.get_genes(["G4", "G1"], ["S2"]).tolist() == [[10], [1]]
+
+
+def test_count_store_keeps_large_counts(tmp_path):
+    """Counts that do not fit in 32 bits are stored as 64 bit integers"""
+    counts = np.array([[2 ** 33, 1]])
+    write_count_store(str(tmp_path / "geneCounts"), ["G1"], ["S1", "S2"], counts)
+    assert CountMatrix(str(tmp_path / "geneCounts")).get_samples(["S1"]).tolist() == [[2 ** 33]]
+
+
+def test_count_store_without_samples_file(count_store):
+    """A store without its samples file can not be loaded"""
+    prefix, _ = count_store
+    os.remove(f"{prefix}.samples.txt")
+    with pytest.raises(FileNotFoundError):
+        CountMatrix(prefix)
+
+
+def test_count_store_with_mismatched_samples_file(count_store):
+    """A samples file that does not match the matrix is refused instead of mixing up samples"""
+    prefix, _ = count_store
+    with open(f"{prefix}.samples.txt", "w") as opened_samples:
+        opened_samples.write("S1\nS2\n")
+    with pytest.raises(ValueError):
+        CountMatrix(prefix)
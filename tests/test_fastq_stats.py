@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+"""
+Tests of the native quality check engine, the modules of the written fastqc_data.txt file
+are compared with statistics that were calculated by hand for a few reads.
+The reservoir sampling of the preview is checked on a file that is read in many small blocks.
+"""
+
+# METADATA VARIABLES
+__author__ = "Vincent Talen"
+__status__ = "Development"
+__date__ = "17-10-2026"
+__version__ = "v0.2"
+
+# IMPORTS
+import gzip
+import pytest
+from lib.fastq_stats import FastqStats
+
+# 'I' is quality 40, '+' is 10 and '#' is 2
+READS = [("r1", "ACGT", "IIII"), ("r2", "GGCC", "++++"), ("r3", "ACGTN", "IIII#"),
+         ("r4", "ACGT", "IIII")]
+
+
+def write_fastq(file, reads):
+    """Writes the reads to a gzipped fastq file"""
+    with gzip.open(file, "wt") as opened_fastq:
+        opened_fastq.writelines(f"@{name}\n{sequence}\n+\n{quality}\n"
+                                for name, sequence, quality in reads)
+    return str(file)
+
+
+def read_modules(fastqc_data):
+    """Reads the status and lines of every module of a fastqc_data.txt file"""
+    modules = dict()
+    with open(fastqc_data) as opened_data:
+        assert opened_data.readline().startswith("##FastQC")
+        for line in opened_data:
+            line = line.rstrip("\n")
+            if line == ">>END_MODULE":
+                continue
+            if line.startswith(">>"):
+                module, status = line[2:].split("\t")
+                lines = modules.setdefault(module, (status, list()))[1]
+            else:
+                lines.append(line.split("\t"))
+    return modules
+
+
+@pytest.fixture
+def modules(tmp_path):
+    """Checks the reads with the native engine and reads the modules of its fastqc_data.txt"""
+    fastq_file = write_fastq(tmp_path / "sample.fastq.gz", READS)
+    return read_modules(FastqStats(fastq_file).collect().write_fastqc_data(str(tmp_path)))
+
+
+def test_basic_statistics(modules):
+    """The basic statistics count all the reads, their lengths and the GC of all bases"""
+    statistics = dict(modules["Basic Statistics"][1][1:])
+    assert statistics["Filename"] == "sample.fastq.gz"
+    assert statistics["Total Sequences"] == "4"
+    assert statistics["Sequence length"] == "4-5"
+    assert statistics["%GC"] == "59"  # 10 of the 17 bases
+
+
+def test_per_base_modules(modules):
+    """The statistics per position use all the reads that are long enough for the position"""
+    status, lines = modules["Per base sequence quality"]
+    assert status == "fail"  # The fifth base only has quality 2
+    assert lines[1] == ["1", "32.5", "40.0", "10.0", "40.0", "10.0", "40.0"]
+    assert lines[5] == ["5", "2.0", "2.0", "2.0", "2.0", "2.0", "2.0"]
+
+    assert modules["Per base sequence content"][1][1] == ["1", "25.00", "75.00", "0.00", "0.00"]
+    status, lines = modules["Per base N content"]
+    assert status == "fail"
+    assert [line[1] for line in lines[1:]] == ["0.00", "0.00", "0.00", "0.00", "100.00"]
+
+
+def test_per_sequence_modules(modules):
+    """The statistics per read use the mean quality and GC content of every read"""
+    lines = modules["Per sequence quality scores"][1]
+    assert lines[1:] == [["10", "1.0"], ["32", "1.0"], ["40", "2.0"]]
+
+    gc_counts = {int(percentage): float(count)
+                 for percentage, count in modules["Per sequence GC content"][1][1:]}
+    assert {percentage: count for percentage, count in gc_counts.items() if count} == \
+        {40: 1, 50: 2, 100: 1}
+
+    status, lines = modules["Sequence Length Distribution"]
+    assert status == "warn"
+    assert lines[1:] == [["4", "3.0"], ["5", "1.0"]]
+
+    status, lines = modules["Overrepresented sequences"]
+    assert lines[1] == ["ACGT", "2", "50.0", "No Hit"]
+    assert sorted(line[0] for line in lines[2:]) == ["ACGTN", "GGCC"]
+
+
+@pytest.fixture
+def many_reads(tmp_path, monkeypatch):
+    """Writes a file with reads of different lengths that is read in many small blocks"""
+    monkeypatch.setattr("lib.fastq_stats.BLOCK_SIZE", 1000)
+    reads = [(f"r{number}", "ACGT" * (number % 10 + 1), "I" * 4 * (number % 10 + 1))
+             for number in range(2000)]
+    return write_fastq(tmp_path / "many.fastq.gz", reads)
+
+
+@pytest.mark.parametrize("max_reads", [1, 100, 1500])
+def test_reservoir_sample_is_bounded(many_reads, max_reads):
+    """The reservoir sample holds exactly the wanted amount of reads"""
+    stats = FastqStats(many_reads).collect(max_reads, "reservoir")
+    assert stats.reads == max_reads
+    assert stats.length_counts.sum() == max_reads
+
+
+def test_reservoir_sample_is_repeatable(many_reads):
+    """The same reads are sampled every time, but they are not simply the first reads"""
+    first = FastqStats(many_reads).collect(100, "reservoir")
+    second = FastqStats(many_reads).collect(100, "reservoir")
+    head = FastqStats(many_reads).collect(100, "head")
+    assert first.length_counts.tolist() == second.length_counts.tolist()
+    assert first.create_sections() == second.create_sections()
+    assert first.length_counts.tolist() != head.length_counts.tolist()
+
+
+def test_reservoir_sample_of_a_small_file(many_reads):
+    """All the reads are used when the file has less reads than the sample"""
+    sampled = FastqStats(many_reads).collect(5000, "reservoir")
+    assert sampled.reads == 2000
+    assert sampled.create_sections() == FastqStats(many_reads).collect().create_sections()
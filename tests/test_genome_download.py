@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+"""
+Offline tests of the genome downloads, the files are served by a local HTTP server.
+The Picard and samtools steps are replaced by steps that only record when they ran,
+these tests are about fetching the files at the same time and handling failing links.
+"""
+
+# METADATA VARIABLES
+__author__ = "Vincent Talen"
+__status__ = "Development"
+__date__ = "17-10-2026"
+__version__ = "v0.1"
+
+# IMPORTS
+import io
+import gzip
+import time
+import tarfile
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+import pytest
+from lib.genome_download import DownloadGenomeInfo
+from lib.genome_registry import Genome
+
+INDEX_CONTENT = b"index " * 200000
+
+
+class StandInHandler(SimpleHTTPRequestHandler):
+    """Serves the files of a directory with Range support, slowly and with a flaky link"""
+    def log_message(self, *arguments):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            server.requests.append(self.path)
+        try:
+            path = self.translate_path(self.path.replace("/flaky", ""))
+            try:
+                with open(path, "rb") as opened_file:
+                    data = opened_file.read()
+            except FileNotFoundError:
+                self.send_error(404)
+                return
+            time.sleep(server.delays.get(self.path, 0.2))
+
+            start = 0
+            if self.headers.get("Range"):
+                start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+                self.send_response(206)
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(data) - start))
+            self.end_headers()
+
+            # The first request to a flaky link is cut off halfway
+            if self.path.startswith("/flaky") and not self.headers.get("Range"):
+                self.wfile.write(data[start:len(data) // 2])
+                self.wfile.flush()
+                self.close_connection = True
+                return
+            self.wfile.write(data[start:])
+        finally:
+            with server.lock:
+                server.active -= 1
+                server.finished[self.path] = time.time()
+
+
+@pytest.fixture
+def server(tmp_path):
+    """Starts a local HTTP server serving a small genome"""
+    served = tmp_path / "served"
+    served.mkdir()
+    with open(served / "ref.fa.gz", "wb") as opened_file:
+        opened_file.write(gzip.compress(b">1\nACGT\n"))
+    with open(served / "ann.gtf.gz", "wb") as opened_file:
+        opened_file.write(gzip.compress(b'1\tx\texon\t1\t4\t.\t+\t.\tgene_id "G1";\n'))
+    with tarfile.open(served / "index.tar.gz", "w:gz") as archive:
+        info = tarfile.TarInfo("idx/genome.1.ht2")
+        info.size = len(INDEX_CONTENT)
+        archive.addfile(info, io.BytesIO(INDEX_CONTENT))
+
+    http_server = ThreadingHTTPServer(("127.0.0.1", 0),
+                                      partial(StandInHandler, directory=str(served)))
+    http_server.lock = threading.Lock()
+    http_server.active, http_server.max_active = 0, 0
+    http_server.requests, http_server.finished, http_server.delays = list(), dict(), dict()
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    http_server.url = f"http://127.0.0.1:{http_server.server_port}"
+    yield http_server
+    http_server.shutdown()
+    http_server.server_close()
+
+
+def create_downloader(tmp_path, monkeypatch, genome):
+    """Creates a DownloadGenomeInfo in an empty output directory with recording fasta steps"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "out/Data/genome").mkdir(parents=True)
+    (tmp_path / "out/tool_logs/genome_download").mkdir(parents=True)
+    downloader = DownloadGenomeInfo("out", genome)
+    downloader.builds = dict()
+    for step in ["create_fasta_dict", "create_fasta_index"]:
+        monkeypatch.setattr(downloader, step, partial(record_build, downloader.builds, step))
+    return downloader
+
+
+def record_build(builds, step):
+    """Records the time a fasta step was started instead of running Picard or samtools"""
+    builds[step] = time.time()
+
+
+def get_pool_threads():
+    """Gets the worker threads of thread pools that are still alive"""
+    return [thread for thread in threading.enumerate()
+            if thread.name.startswith("ThreadPoolExecutor")]
+
+
+def test_all_files_arrive_concurrently(tmp_path, monkeypatch, server):
+    """All files are downloaded at the same time and the fasta steps start before the index is in"""
+    genome = Genome("Test", "1", f"{server.url}/ref.fa.gz", f"{server.url}/ann.gtf.gz",
+                    f"{server.url}/index.tar.gz", "idx/genome")
+    server.delays["/index.tar.gz"] = 1.5
+    downloader = create_downloader(tmp_path, monkeypatch, genome)
+    downloader.collect_all_genome_info()
+
+    genome_dir = tmp_path / "out/Data/genome"
+    assert (genome_dir / "ref.fa").read_bytes() == b">1\nACGT\n"
+    assert (genome_dir / "ann.gtf").read_bytes().startswith(b"1\tx\texon")
+    assert (genome_dir / "idx/genome.1.ht2").read_bytes() == INDEX_CONTENT
+    assert server.max_active == 3
+    assert set(downloader.builds) == {"create_fasta_dict", "create_fasta_index"}
+    assert max(downloader.builds.values()) < server.finished["/index.tar.gz"]
+    assert not get_pool_threads()
+
+
+def test_failing_link_raises(tmp_path, monkeypatch, server):
+    """A link that can not be downloaded makes the whole collection fail"""
+    genome = Genome("Test", "1", f"{server.url}/ref.fa.gz", f"{server.url}/missing.gtf.gz",
+                    f"{server.url}/index.tar.gz", "idx/genome")
+    downloader = create_downloader(tmp_path, monkeypatch, genome)
+
+    with pytest.raises(HTTPError):
+        downloader.collect_all_genome_info()
+    assert not get_pool_threads()
+
+
+def test_interrupted_archive_is_resumed(tmp_path, monkeypatch, server):
+    """An archive download that gets cut off is resumed without keeping a copy of the archive"""
+    genome = Genome("Test", "1", f"{server.url}/ref.fa.gz", f"{server.url}/ann.gtf.gz",
+                    f"{server.url}/flaky/index.tar.gz", "idx/genome")
+    downloader = create_downloader(tmp_path, monkeypatch, genome)
+
+    downloader.collect_hisat_index()
+
+    genome_dir = tmp_path / "out/Data/genome"
+    assert (genome_dir / "idx/genome.1.ht2").read_bytes() == INDEX_CONTENT
+    assert server.requests.count("/flaky/index.tar.gz") == 2
+    assert sorted(path.name for path in genome_dir.iterdir()) == ["idx"]
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+"""
+Tests of the hard clipper, the reads clipped a block at a time with NumPy are compared with
+reads clipped one by one in plain Python.
+"""
+
+# METADATA VARIABLES
+__author__ = "Vincent Talen"
+__status__ = "Development"
+__date__ = "17-10-2026"
+__version__ = "v0.1"
+
+# IMPORTS
+import gzip
+import random
+import pytest
+from lib.hard_clipper import HardClipper, read_fastq_blocks
+
+
+def create_reads(amount, seed=1):
+    """Creates reads of different lengths, some are shorter than the bases that are clipped"""
+    generator = random.Random(seed)
+    reads = list()
+    for number in range(amount):
+        length = generator.randint(0, 40)
+        sequence = "".join(generator.choice("ACGTN") for _ in range(length))
+        quality = "".join(generator.choice("#5?I") for _ in range(length))
+        reads.append((f"@read_{number} 1:N:0:1", sequence, quality))
+    return reads
+
+
+def clip_naive(reads, five_prime, three_prime):
+    """Clips the reads one by one"""
+    clipped = list()
+    for name, sequence, quality in reads:
+        end = max(len(sequence) - three_prime, five_prime)
+        clipped.append((name, sequence[five_prime:end], quality[five_prime:end]))
+    return "".join(f"{name}\n{sequence}\n+\n{quality}\n" for name, sequence, quality in clipped)
+
+
+@pytest.fixture
+def fastq_file(tmp_path):
+    """Creates a gzipped fastq file and returns it with its reads"""
+    reads = create_reads(500)
+    file = tmp_path / "sample.fastq.gz"
+    with gzip.open(file, "wt") as opened_fastq:
+        opened_fastq.writelines(f"{name}\n{sequence}\n+\n{quality}\n"
+                                for name, sequence, quality in reads)
+    return str(file), reads
+
+
+@pytest.mark.parametrize("five_prime, three_prime", [(3, 0), (0, 5), (3, 5), (25, 25)])
+@pytest.mark.parametrize("block_size", [7, 64, 1001])
+def test_blocks_are_clipped_like_single_reads(fastq_file, five_prime, three_prime, block_size):
+    """Clipping in blocks gives the same reads, also for records split by the end of a block"""
+    file, reads = fastq_file
+    clipper = HardClipper(five_prime, three_prime)
+    clipped = b"".join(clipper.clip_block(data, line_ends)
+                       for data, line_ends in read_fastq_blocks(file, block_size))
+    assert clipped.decode() == clip_naive(reads, five_prime, three_prime)
+
+
+def test_clip_file(fastq_file, tmp_path):
+    """The whole file is clipped and the amount of reads and clipped bases is reported"""
+    file, reads = fastq_file
+    output_file = tmp_path / "sample_trimmed.fq"
+    assert HardClipper(2, 3).clip_file(file, str(output_file), compress=False) == \
+        (len(reads), sum(min(len(sequence), 5) for _, sequence, _ in reads))
+    assert output_file.read_text() == clip_naive(reads, 2, 3)
+
+
+def test_last_line_without_newline(tmp_path):
+    """A file that does not end with a newline still gets its last read clipped"""
+    file = tmp_path / "sample.fastq.gz"
+    with gzip.open(file, "wt") as opened_fastq:
+        opened_fastq.write("@read_1\nACGTACGT\n+\nIIIIIIII\n@read_2\nACGT\n+\nIIII")
+    clipper = HardClipper(1, 1)
+    clipped = b"".join(clipper.clip_block(data, line_ends)
+                       for data, line_ends in read_fastq_blocks(str(file), 10))
+    assert clipped.decode() == "@read_1\nCGTACG\n+\nIIIIII\n@read_2\nCG\n+\nII\n"
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""
+Tests of pairing the fastq files by the read names in their headers or by their file names,
+and of the manifest that caches the headers between runs.
+"""
+
+# METADATA VARIABLES
+__author__ = "Vincent Talen"
+__status__ = "Development"
+__date__ = "17-10-2026"
+__version__ = "v0.1"
+
+# IMPORTS
+import os
+import gzip
+import pytest
+from lib.pairing import FilePairer
+
+
+@pytest.fixture
+def write_fastq(tmp_path):
+    """Returns a function that writes a gzipped fastq file with a single read"""
+    def write(name, header):
+        file = tmp_path / name
+        with gzip.open(file, "wt") as opened_fastq:
+            opened_fastq.write(f"{header}\nACGT\n+\nIIII\n")
+        return str(file)
+    return write
+
+
+def test_pairs_by_read_name(write_fastq):
+    """Files are paired by the read name and side in their header, whatever their file names"""
+    slash_1 = write_fastq("lane_a.fastq.gz", "@SRR001.1 HWI-ST:5:1:817:345/1")
+    slash_2 = write_fastq("other_name.fastq.gz", "@SRR001.1 HWI-ST:5:1:817:345/2")
+    casava_2 = write_fastq("x.fastq.gz", "@M001:7:FC:1:1101:1:2 2:N:0:ATCACG")
+    casava_1 = write_fastq("y.fastq.gz", "@M001:7:FC:1:1101:1:2 1:N:0:ATCACG")
+
+    pairs, single_ended = FilePairer().pair_files([slash_1, casava_2, slash_2, casava_1])
+    assert sorted(pairs) == sorted([[slash_1, slash_2], [casava_1, casava_2]])
+    assert single_ended == []
+
+
+def test_pairs_by_file_name(write_fastq):
+    """Files without the side in their header are paired by _R1/_R2 or _1/_2 in their name"""
+    r1 = write_fastq("sample_R1_001.fastq.gz", "@SRR002.1 length=50")
+    r2 = write_fastq("sample_R2_001.fastq.gz", "@SRR002.1 length=50")
+    first = write_fastq("other_1.fq.gz", "@SRR003.1")
+    second = write_fastq("other_2.fq.gz", "@SRR003.1")
+
+    pairs, single_ended = FilePairer().pair_files([r2, second, r1, first])
+    assert sorted(pairs) == sorted([[r1, r2], [first, second]])
+    assert single_ended == []
+
+
+def test_files_without_mate_stay_single(write_fastq, tmp_path):
+    """Files without a mate are single ended, an empty file is left out"""
+    lonely_mate = write_fastq("lonely.fastq.gz", "@SRR004.1 HWI-ST:5:1:817:345/1")
+    lonely_r1 = write_fastq("sample_R1.fastq.gz", "@SRR005.1")
+    single = write_fastq("single.fastq.gz", "@SRR006.1")
+    empty = str(tmp_path / "empty.fastq.gz")
+    with gzip.open(empty, "wt"):
+        pass
+
+    pairs, single_ended = FilePairer().pair_files([lonely_mate, lonely_r1, single, empty])
+    assert pairs == []
+    assert single_ended == [lonely_mate, lonely_r1, single]
+
+
+def test_manifest_only_reads_changed_files(write_fastq, tmp_path, monkeypatch):
+    """Headers are read again only for files whose size or modification time changed"""
+    unchanged = write_fastq("unchanged.fastq.gz", "@SRR007.1")
+    resized = write_fastq("resized.fastq.gz", "@SRR008.1")
+    touched = write_fastq("touched.fastq.gz", "@SRR009.1")
+    files = [unchanged, resized, touched]
+    pairer = FilePairer(str(tmp_path / "manifest.json"))
+    assert pairer.read_headers(files) == {unchanged: "@SRR007.1", resized: "@SRR008.1",
+                                          touched: "@SRR009.1"}
+
+    read_files = list()
+    read_header = FilePairer.read_header
+    monkeypatch.setattr(FilePairer, "read_header",
+                        staticmethod(lambda file: read_files.append(file) or read_header(file)))
+    assert pairer.read_headers(files)[resized] == "@SRR008.1"
+    assert read_files == []
+
+    write_fastq("resized.fastq.gz", "@SRR008.1 with a longer header")
+    os.utime(touched, ns=(0, os.stat(touched).st_mtime_ns + 1))
+    headers = FilePairer(str(tmp_path / "manifest.json")).read_headers(files)
+    assert sorted(read_files) == sorted([resized, touched])
+    assert headers[resized] == "@SRR008.1 with a longer header"
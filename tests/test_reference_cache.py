@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+"""
+Tests of the reference cache, the locking between runs and removing the least recently used
+genomes. Every opened entry stands in for a run, the locks work the same way within one process.
+"""
+
+# METADATA VARIABLES
+__author__ = "Vincent Talen"
+__status__ = "Development"
+__date__ = "17-10-2026"
+__version__ = "v0.1"
+
+# IMPORTS
+import os
+import time
+import threading
+import pytest
+from lib.reference_cache import ReferenceCache
+
+ENTRY_SIZE = 1000
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """Creates a cache with room for two entries"""
+    return ReferenceCache(str(tmp_path / "references"), max_size=2.5 * ENTRY_SIZE / 1e9)
+
+
+def add_entry(cache, key, last_used):
+    """Adds a complete entry with a genome file to the cache and closes it"""
+    entry = cache.open_entry(key)
+    with open(f"{entry.path}/genome.fa", "wb") as opened_genome:
+        opened_genome.write(b"A" * ENTRY_SIZE)
+    entry.mark_complete()
+    entry.close()
+    os.utime(entry.path, (last_used, last_used))
+
+
+def test_evict_removes_least_recently_used(cache):
+    """The least recently used entries are removed until the cache fits"""
+    for last_used, key in enumerate(["old", "older_than_new", "new", "newest"]):
+        add_entry(cache, key, 1000 + last_used)
+
+    assert cache.evict(keep="newest") == ["old", "older_than_new"]
+    assert sorted(entry for entry in os.listdir(cache.cache_dir)
+                  if not entry.endswith(".lock")) == ["new", "newest"]
+
+
+def test_evict_keeps_entries_in_use(cache):
+    """Entries that are opened by other runs and the entry of the current run are never removed"""
+    for last_used, key in enumerate(["in_use", "current", "unused", "new"]):
+        add_entry(cache, key, 1000 + last_used)
+
+    in_use = cache.open_entry("in_use")
+    os.utime(in_use.path, (1000, 1000))  # Still the least recently used entry
+    assert cache.evict(keep="current") == ["unused", "new"]
+    assert in_use.complete and os.path.isfile(f"{in_use.path}/genome.fa")
+    in_use.close()
+
+
+def test_incomplete_entry_waits_for_download(cache):
+    """A run opening an entry that is being downloaded waits until it is complete"""
+    downloading = cache.open_entry("genome")
+    assert not downloading.complete
+
+    opened = list()
+    waiting = threading.Thread(target=lambda: opened.append(cache.open_entry("genome")))
+    waiting.start()
+    time.sleep(0.3)
+    assert waiting.is_alive()
+
+    with open(f"{downloading.path}/genome.fa", "w") as opened_genome:
+        opened_genome.write("ACGT")
+    downloading.mark_complete()
+    waiting.join(timeout=5)
+    assert opened and opened[0].complete
+    opened[0].close()
+    downloading.close()
+
+
+def test_refresh_waits_for_other_runs(cache):
+    """Refreshing an entry waits until other runs are done with it and then empties it"""
+    add_entry(cache, "genome", time.time())
+    in_use = cache.open_entry("genome")
+
+    refreshed = list()
+    refreshing = threading.Thread(
+        target=lambda: refreshed.append(cache.open_entry("genome", refresh=True)))
+    refreshing.start()
+    time.sleep(0.3)
+    assert refreshing.is_alive()
+    assert os.path.isfile(f"{in_use.path}/genome.fa")
+
+    in_use.close()
+    refreshing.join(timeout=5)
+    assert refreshed and not refreshed[0].complete
+    assert os.listdir(refreshed[0].path) == []
+    refreshed[0].close()
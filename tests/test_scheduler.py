@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+"""
+Tests of the scheduler with small tasks that record when they ran, so the tests can check
+how many cores and tasks of a group were in use at the same time and in which order they ran.
+"""
+
+# METADATA VARIABLES
+__author__ = "Vincent Talen"
+__status__ = "Development"
+__date__ = "17-10-2026"
+__version__ = "v0.1"
+
+# IMPORTS
+import time
+import pytest
+from lib.scheduler import Scheduler
+
+
+def record(record_dir, name, seconds=0.2):
+    """Task that writes when it started and finished to a file with the name of the task"""
+    start = time.monotonic()
+    time.sleep(seconds)
+    (record_dir / name).write_text(f"{start} {time.monotonic()}")
+    return name
+
+
+def fail():
+    """Task that always fails"""
+    raise RuntimeError("this task fails")
+
+
+def join(*names):
+    """Task that combines the return values of other tasks"""
+    return "+".join(names)
+
+
+def read_records(record_dir):
+    """Reads the start and finish times of all the tasks that ran, in the order they started"""
+    records = dict()
+    for record_file in record_dir.iterdir():
+        start, finish = record_file.read_text().split()
+        records[record_file.name] = (float(start), float(finish))
+    return dict(sorted(records.items(), key=lambda item: item[1][0]))
+
+
+def max_in_use(records, weights):
+    """Calculates the highest total weight (cores or slots) of the tasks running at once"""
+    events = sorted([(start, weights[name]) for name, (start, _) in records.items()] +
+                    [(finish, -weights[name]) for name, (_, finish) in records.items()],
+                    key=lambda event: (event[0], event[1]))
+    in_use = highest = 0
+    for _, change in events:
+        in_use += change
+        highest = max(highest, in_use)
+    return highest
+
+
+def test_running_tasks_stay_within_the_cores(tmp_path):
+    """The claimed cores of the running tasks never exceed the core budget, but fill it"""
+    scheduler = Scheduler(4)
+    cores = {"one": 1, "two": 2, "three": 3, "four": 4, "other_one": 1, "other_two": 2}
+    for name, task_cores in cores.items():
+        scheduler.add_task(name, record, (tmp_path, name), cores=task_cores)
+
+    assert scheduler.run() == []
+    records = read_records(tmp_path)
+    assert set(records) == set(cores)
+    assert max_in_use(records, cores) == 4
+
+
+def test_groups_limit_the_running_tasks(tmp_path):
+    """Only as many slots of a group as its limit are used at once, other groups are free"""
+    scheduler = Scheduler(8)
+    scheduler.limit_group("align", 2)
+    slots = {"align_1": 1, "align_2": 1, "align_3": 1, "chunks": 2, "align_4": 1}
+    for name, task_slots in slots.items():
+        scheduler.add_task(name, record, (tmp_path, name), group="align", slots=task_slots)
+    scheduler.add_task("trim_1", record, (tmp_path, "trim_1"))
+    scheduler.add_task("trim_2", record, (tmp_path, "trim_2"))
+
+    assert scheduler.run() == []
+    records = read_records(tmp_path)
+    assert max_in_use({name: records[name] for name in slots}, slots) == 2
+    # The tasks of the other group start straight away next to the first aligners
+    first_finish = min(finish for _, finish in records.values())
+    assert all(records[name][0] < first_finish for name in ["trim_1", "trim_2"])
+
+
+def test_tasks_start_in_order_of_priority(tmp_path):
+    """Tasks with a higher priority start first, tasks of the same priority in order of adding"""
+    scheduler = Scheduler(1)
+    for name, priority in [("low_1", 0), ("high", 5), ("low_2", 0), ("middle", 2)]:
+        scheduler.add_task(name, record, (tmp_path, name, 0.05), priority=priority)
+
+    assert scheduler.run() == []
+    assert list(read_records(tmp_path)) == ["high", "middle", "low_1", "low_2"]
+
+
+def test_dependents_of_a_failed_task_are_skipped(tmp_path):
+    """The tasks depending (in)directly on a failed task are skipped, other tasks still run"""
+    scheduler = Scheduler(2)
+    failing = scheduler.add_task("failing", fail)
+    dependent = scheduler.add_task("dependent", record, (tmp_path, "dependent"),
+                                   dependencies=[failing])
+    scheduler.add_task("indirect", record, (tmp_path, "indirect"), dependencies=[dependent])
+    scheduler.add_task("independent", record, (tmp_path, "independent"))
+
+    assert scheduler.run() == ["failing", "dependent", "indirect"]
+    assert list(read_records(tmp_path)) == ["independent"]
+
+
+def test_tasks_get_the_results_of_their_dependencies(tmp_path):
+    """A result_of argument is replaced by the return value of the task it names"""
+    scheduler = Scheduler(2)
+    first = scheduler.add_task("first", record, (tmp_path, "first", 0))
+    second = scheduler.add_task("second", record, (tmp_path, "second", 0))
+    scheduler.add_task("joined", join, (scheduler.result_of(first), scheduler.result_of(second)),
+                       dependencies=[first, second])
+    scheduler.add_task("check", record, (tmp_path, scheduler.result_of("joined"), 0),
+                       dependencies=["joined"])
+
+    assert scheduler.run() == []
+    assert set(read_records(tmp_path)) == {"first", "second", "first+second"}
+
+
+def test_invalid_tasks_are_refused():
+    """Tasks with a used name, unknown dependencies or results they can not get are refused"""
+    scheduler = Scheduler(2)
+    scheduler.add_task("first", join)
+    with pytest.raises(ValueError):
+        scheduler.add_task("first", join)
+    with pytest.raises(ValueError):
+        scheduler.add_task("second", join, dependencies=["unknown"])
+    with pytest.raises(ValueError):
+        scheduler.add_task("third", join, (scheduler.result_of("first"),))